@@ -1,4 +1,10 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
 
 
 PRODUCT_METADATA_ALLOWED_API_KEY_CACHE_KEY = 'team.product_metadata_allowed_api_key'
@@ -10,3 +16,139 @@ def save_product_allowed_feeds_value(product_id, allowed_api_access):
 
 def get_product_allowed_feeds_value(product_id):
     return cache.get(_get_product_metadata_allowed_api_cache_key(product_id))
+
+
+TEAM_API_KEY_CACHE_KEY = 'team.verified_api_key'
+
+
+class LocalCache:
+    """
+    Small in-process cache with a per-entry TTL, in front of redis.
+
+    Other processes can't reach it to invalidate it, so its TTL bounds how long they
+    may keep using a stale entry.
+    """
+
+    def __init__(self, max_size=10000):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.max_size = max_size
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + timeout, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_api_key_local_cache = LocalCache()
+
+def _get_team_api_key_cache_key(prefix):
+    return f'{TEAM_API_KEY_CACHE_KEY}:{prefix}'
+
+def save_verified_team_api_key(prefix, entry):
+    verified_api_key_local_cache.set(prefix, entry, timeout=settings.TEAM_API_KEY_LOCAL_CACHE_TTL)
+    try:
+        cache.set(_get_team_api_key_cache_key(prefix), entry, timeout=settings.TEAM_API_KEY_CACHE_TTL)
+    except Exception:
+        logging.exception("could not cache verified api key")
+
+def get_verified_team_api_key(prefix):
+    entry = verified_api_key_local_cache.get(prefix)
+    if entry is not None:
+        return entry
+    try:
+        entry = cache.get(_get_team_api_key_cache_key(prefix))
+    except Exception:
+        logging.exception("could not read verified api key from cache")
+        return None
+    if entry is not None:
+        verified_api_key_local_cache.set(prefix, entry, timeout=settings.TEAM_API_KEY_LOCAL_CACHE_TTL)
+    return entry
+
+def delete_verified_team_api_keys(prefixes):
+    for prefix in prefixes:
+        verified_api_key_local_cache.delete(prefix)
+    try:
+        cache.delete_many([_get_team_api_key_cache_key(prefix) for prefix in prefixes])
+    except Exception:
+        logging.exception("could not invalidate verified api keys")
+
+
+TEAM_API_KEY_USAGE_KEY = 'team.api_key_usage'
+# hash of key id -> requests made since the last flush
+TEAM_API_KEY_REQUEST_COUNT_KEY = f'{TEAM_API_KEY_USAGE_KEY}:request_count'
+# hash of key id -> latest use (unix time, rounded down to TEAM_API_KEY_LAST_USED_RESOLUTION)
+TEAM_API_KEY_LAST_USED_KEY = f'{TEAM_API_KEY_USAGE_KEY}:last_used'
+
+# key id -> last_used step already recorded by this process
+_recorded_last_used = {}
+
+def record_team_api_key_usage(key_id):
+    """
+    Counts a request made with an API key, in redis. `flush_team_api_key_usage` writes
+    the counts to the DB in bulk.
+    """
+    resolution = max(1, settings.TEAM_API_KEY_LAST_USED_RESOLUTION)
+    last_used = int(time.time()) // resolution * resolution
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        pipeline.hincrby(TEAM_API_KEY_REQUEST_COUNT_KEY, key_id, 1)
+        if _recorded_last_used.get(key_id) != last_used:
+            pipeline.hset(TEAM_API_KEY_LAST_USED_KEY, key_id, last_used)
+        pipeline.execute()
+    except Exception:
+        logging.exception("could not record api key usage")
+        return
+    if len(_recorded_last_used) >= 10000:
+        _recorded_last_used.clear()
+    _recorded_last_used[key_id] = last_used
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def pop_team_api_key_usage():
+    """
+    Returns `{key_id: (request_count, last_used)}` for every key used since the last
+    call, and resets the counts.
+    """
+    pipeline = get_redis_connection("default").pipeline(transaction=True)
+    pipeline.hgetall(TEAM_API_KEY_REQUEST_COUNT_KEY)
+    pipeline.hgetall(TEAM_API_KEY_LAST_USED_KEY)
+    pipeline.delete(TEAM_API_KEY_REQUEST_COUNT_KEY, TEAM_API_KEY_LAST_USED_KEY)
+    request_counts, last_used, _ = pipeline.execute()
+    return {
+        _decode(key_id): (int(request_counts.get(key_id, 0)), int(last_used[key_id]) if key_id in last_used else None)
+        for key_id in set(request_counts) | set(last_used)
+    }
+
+def restore_team_api_key_usage(usage):
+    """
+    Puts back usage returned by `pop_team_api_key_usage` that couldn't be written to the DB.
+    """
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    for key_id, (request_count, last_used) in usage.items():
+        if request_count:
+            pipeline.hincrby(TEAM_API_KEY_REQUEST_COUNT_KEY, key_id, request_count)
+        if last_used:
+            pipeline.hsetnx(TEAM_API_KEY_LAST_USED_KEY, key_id, last_used)
+    pipeline.execute()
@@ -1,13 +1,26 @@
+import hashlib
+import hmac
+
+from asgiref.sync import sync_to_async
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext as _
+from rest_framework.exceptions import PermissionDenied
 
-from apps.api.helpers import _get_api_key_object
+from apps.api.helpers import _get_api_key
 from apps.users.models import CustomUser
+from apps.utils.db import db_sync_to_async
 from apps.subscriptions.helpers import subscribe_team_to_initial_subscription
 from apps.utils.slug import get_next_unique_slug
 from . import roles
+from .cache import (
+    get_verified_team_api_key,
+    record_team_api_key_usage,
+    save_verified_team_api_key,
+    verified_api_key_local_cache,
+)
 from .models import Team, TeamApiKey, TeamApiKeyStatus
 
 
@@ -54,15 +67,93 @@ def get_default_team_for_user(user: CustomUser):
     else:
         return None
 
+def _get_key_digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _make_verified_api_key_entry(team_api_key, key):
+    return {
+        'id': team_api_key.id,
+        'team_id': team_api_key.team_id,
+        'status': team_api_key.status,
+        'expiry_date': team_api_key.expiry_date,
+        'api_limits': team_api_key.team.get_api_limits(),
+        # the cached verification only applies to this exact key
+        'digest': _get_key_digest(key),
+    }
+
+
+def _check_verified_api_key_entry(entry):
+    if entry['status'] != TeamApiKeyStatus.ACTIVE:
+        raise PermissionDenied("Invalid key")
+    if entry['expiry_date'] and entry['expiry_date'] < timezone.now():
+        raise PermissionDenied("Invalid key")
+    return entry
+
+
+def verify_team_api_key(key: str) -> dict:
+    """
+    Verifies a team API key and returns what the proxy needs to know about it: its
+    `id`, `team_id`, `status`, `expiry_date` and the team's `api_limits`.
+
+    Successful verifications are cached (in process, then in redis), so the slow key
+    hashing and the DB lookups only happen once per key every `TEAM_API_KEY_CACHE_TTL`
+    seconds. Entries are dropped whenever the key is saved or deleted.
+    """
+    if not key:
+        raise PermissionDenied("Invalid key")
+    prefix, _, _ = key.partition(".")
+    entry = get_verified_team_api_key(prefix)
+    if entry is None or not hmac.compare_digest(entry['digest'], _get_key_digest(key)):
+        try:
+            team_api_key = TeamApiKey.objects.get_usable_keys().select_related('team').get(prefix=prefix)
+        except TeamApiKey.DoesNotExist:
+            raise PermissionDenied("Invalid key")
+        if not team_api_key.is_valid(key):
+            raise PermissionDenied("Invalid key")
+        entry = _make_verified_api_key_entry(team_api_key, key)
+        save_verified_team_api_key(prefix, entry)
+    return _check_verified_api_key_entry(entry)
+
+
+async def averify_team_api_key(key: str) -> dict:
+    if key:
+        # in-process hits don't need to leave the event loop
+        entry = verified_api_key_local_cache.get(key.partition(".")[0])
+        if entry is not None and hmac.compare_digest(entry['digest'], _get_key_digest(key)):
+            return _check_verified_api_key_entry(entry)
+    # DB bound, so concurrent lookups shouldn't queue up on the single sync thread
+    return await db_sync_to_async(verify_team_api_key)(key)
+
+
 def get_team_from_request(request: HttpRequest):
+    """
+    Returns the team of the request's API key, loaded from the DB only when used.
+
+    The key's usage is counted in redis rather than saved to the DB on every request.
+    """
     if request is None:
         return None
-    team_api_key = _get_api_key_object(request, TeamApiKey)
-    if team_api_key.status != TeamApiKeyStatus.ACTIVE:
-        raise PermissionDenied("Invalid key")
-    team_api_key.last_used = timezone.now()
-    team_api_key.save()
-    return team_api_key.team
+    entry = verify_team_api_key(_get_api_key(request))
+    record_team_api_key_usage(entry['id'])
+    request.team_api_key = entry
+    return SimpleLazyObject(lambda: Team.objects.get(id=entry['team_id']))
+
+
+async def aget_team_from_request(request: HttpRequest):
+    """
+    Async counterpart of `get_team_from_request` for views served under ASGI.
+
+    On a cache miss, the DB lookups and the (deliberately slow) key hashing run in a
+    worker thread so they don't block the event loop.
+    """
+    if request is None:
+        return None
+    entry = await averify_team_api_key(_get_api_key(request))
+    # redis only, no DB connection involved
+    await sync_to_async(record_team_api_key_usage, thread_sensitive=False)(entry['id'])
+    request.team_api_key = entry
+    return SimpleLazyObject(lambda: Team.objects.get(id=entry['team_id']))
 
 
 def create_default_team_for_user(user: CustomUser, team_name: str = None):
@@ -80,13 +171,3 @@ def create_default_team_for_user(user: CustomUser, team_name: str = None):
     team.save()
     subscribe_team_to_initial_subscription(team)
     return team
-
-def get_team_from_request(request: HttpRequest):
-    if request is None:
-        return None
-    team_api_key = _get_api_key_object(request, TeamApiKey)
-    if team_api_key.status != TeamApiKeyStatus.ACTIVE:
-        raise PermissionDenied("Invalid key")
-    team_api_key.last_used = timezone.now()
-    team_api_key.save()
-    return team_api_key.team
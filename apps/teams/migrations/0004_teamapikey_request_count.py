@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("teams", "0003_invitation_last_email_date"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="teamapikey",
+            name="request_count",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -41,6 +41,21 @@ class Team(BaseModel, SubscriptionModelBase):
             return False
         return self.subscription.plan.product.metadata.get('allowed_api_access', '') == 'true'
 
+    def get_api_limits(self):
+        """
+        Returns the API limits of the team's plan, read from the product metadata:
+        `rate_limit` (requests per minute), `burst` and `daily_quota`. 0 means unlimited.
+        A rate-limited plan always allows a burst of at least one request.
+        """
+        metadata = self.subscription.plan.product.metadata if self.active_stripe_subscription else {}
+        rate_limit = max(0, int(metadata.get('api_rate_limit') or 0))
+        burst = max(1, int(metadata.get('api_rate_limit_burst') or rate_limit)) if rate_limit else 0
+        return {
+            'rate_limit': rate_limit,
+            'burst': burst,
+            'daily_quota': max(0, int(metadata.get('api_daily_quota') or 0)),
+        }
+
     @property
     def allowed_api_access(self):
         return self.get_allowed_api_access()
@@ -145,6 +160,7 @@ class TeamApiKey(AbstractAPIKey):
     status = models.CharField(max_length=10, default=TeamApiKeyStatus.ACTIVE)
     key_id = models.UUIDField(blank=True, null=True)
     last_used = models.DateTimeField(blank=True, null=True)
+    request_count = models.BigIntegerField(default=0)
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
     membership = models.ForeignKey(Membership, on_delete=models.CASCADE)
     clear_key = models.CharField(max_length=100, blank=True, null=True)
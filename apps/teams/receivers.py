@@ -4,7 +4,11 @@ from djstripe import signals as djstripe_signals
 from djstripe.enums import SubscriptionStatus
 from djstripe.models import Subscription, Product
 from apps.subscriptions.helpers import subscription_is_active
-from .cache import save_product_allowed_feeds_value, get_product_allowed_feeds_value
+from .cache import (
+    delete_verified_team_api_keys,
+    get_product_allowed_feeds_value,
+    save_product_allowed_feeds_value,
+)
 from .models import Membership, Team, TeamApiKey, TeamApiKeyStatus
 from .utils import update_user_teams_on_auth0
 
@@ -20,11 +24,30 @@ def membership_created_or_updated(sender, instance, created, **kwargs):
 def membership_deleted(sender, instance, **kwargs):
     update_user_teams_on_auth0(instance.user_id)
 
+def block_team_api_keys(queryset):
+    # update() doesn't send post_save, so the verified key cache is cleared here
+    prefixes = list(queryset.values_list('prefix', flat=True))
+    queryset.update(status=TeamApiKeyStatus.BLOCKED)
+    delete_verified_team_api_keys(prefixes)
+
+
+@receiver(post_save, sender=TeamApiKey)
+def team_api_key_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_used', 'request_count'}:
+        return
+    delete_verified_team_api_keys([instance.prefix])
+
+
+@receiver(post_delete, sender=TeamApiKey)
+def team_api_key_deleted(sender, instance, **kwargs):
+    delete_verified_team_api_keys([instance.prefix])
+
+
 @receiver(pre_save, sender=Subscription)
 def handle_subscription_pre_save(sender, signal, instance, **kwargs):
     old_instance = Subscription.objects.filter(id=instance.id).first()
     if not subscription_is_active(instance):
-        TeamApiKey.objects.filter(team__subscription__djstripe_id=instance.djstripe_id).update(status=TeamApiKeyStatus.BLOCKED)
+        block_team_api_keys(TeamApiKey.objects.filter(team__subscription__djstripe_id=instance.djstripe_id))
         return
     if not old_instance:
         return
@@ -34,7 +57,7 @@ def handle_subscription_pre_save(sender, signal, instance, **kwargs):
         return
     if old_allowed_api_access == new_allowed_api_access:
         return
-    TeamApiKey.objects.filter(team__subscription__djstripe_id=instance.djstripe_id).update(status=TeamApiKeyStatus.BLOCKED)
+    block_team_api_keys(TeamApiKey.objects.filter(team__subscription__djstripe_id=instance.djstripe_id))
 
 @receiver(pre_save, sender=Product)
 def handle_product_pre_save(sender, signal, instance, **kwargs):
@@ -57,4 +80,4 @@ def handle_product_post_save(sender, signal, instance, **kwargs):
         return
     active_subscriptions = Subscription.objects.filter(status=SubscriptionStatus.active, plan__product__id=instance.id)
     active_subscriptions_ids = [subscription.djstripe_id for subscription in active_subscriptions]
-    TeamApiKey.objects.filter(team__subscription_id__in=active_subscriptions_ids).update(status=TeamApiKeyStatus.BLOCKED)
+    block_team_api_keys(TeamApiKey.objects.filter(team__subscription_id__in=active_subscriptions_ids))
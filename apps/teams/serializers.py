@@ -188,7 +188,7 @@ class ApiKeySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = TeamApiKey
-        fields = ('id', 'name', 'team_name', 'key_id', 'last_used', 'status')
+        fields = ('id', 'name', 'team_name', 'key_id', 'last_used', 'request_count', 'status')
 
 
 class UserCompleteRegistrationSerializer(serializers.Serializer):
@@ -0,0 +1,53 @@
+import logging
+from datetime import datetime, timezone
+
+from celery import shared_task
+from django.db.models import Case, F, Value, When
+
+from .cache import pop_team_api_key_usage, restore_team_api_key_usage
+from .models import TeamApiKey
+
+# keys written per UPDATE statement
+USAGE_FLUSH_BATCH_SIZE = 500
+
+
+def _update_team_api_key_usage(usage):
+    """
+    Adds the request counts and sets last_used of each key in `usage`, touching no
+    other columns.
+    """
+    items = sorted(usage.items())
+    for i in range(0, len(items), USAGE_FLUSH_BATCH_SIZE):
+        batch = items[i:i + USAGE_FLUSH_BATCH_SIZE]
+        last_used_whens = [
+            When(id=key_id, then=Value(datetime.fromtimestamp(last_used, timezone.utc)))
+            for key_id, (_, last_used) in batch if last_used
+        ]
+        request_count_whens = [
+            When(id=key_id, then=Value(request_count))
+            for key_id, (request_count, _) in batch if request_count
+        ]
+        updates = {}
+        if last_used_whens:
+            updates['last_used'] = Case(*last_used_whens, default=F('last_used'))
+        if request_count_whens:
+            updates['request_count'] = F('request_count') + Case(*request_count_whens, default=Value(0))
+        if updates:
+            TeamApiKey.objects.filter(id__in=[key_id for key_id, _ in batch]).update(**updates)
+
+
+@shared_task()
+def flush_team_api_key_usage():
+    """
+    Writes the API key usage counted in redis (see `record_team_api_key_usage`) to the DB.
+    """
+    usage = pop_team_api_key_usage()
+    if not usage:
+        return 0
+    try:
+        _update_team_api_key_usage(usage)
+    except Exception:
+        logging.exception("could not flush api key usage, putting it back")
+        restore_team_api_key_usage(usage)
+        raise
+    return len(usage)
@@ -0,0 +1,100 @@
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import PermissionDenied
+
+from apps.teams.cache import verified_api_key_local_cache
+from apps.teams.helpers import verify_team_api_key
+from apps.teams.models import Membership, Team, TeamApiKey, TeamApiKeyStatus
+from apps.teams.receivers import block_team_api_keys
+from apps.teams.roles import ROLE_ADMIN
+from apps.users.models import CustomUser
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VerifiedApiKeyCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username="heidi@example.com")
+        cls.team = Team.objects.create(name="Cubs", slug="cubs")
+        with patch("apps.teams.receivers.update_user_teams_on_auth0"):
+            cls.membership = Membership.objects.create(team=cls.team, user=cls.user, role=ROLE_ADMIN)
+
+    def setUp(self):
+        cache.clear()
+        verified_api_key_local_cache.clear()
+        self.team_api_key, self.key = TeamApiKey.objects.create_key(
+            name="test", user=self.user, team=self.team, membership=self.membership
+        )
+
+    def test_verification_is_cached(self):
+        entry = verify_team_api_key(self.key)
+        self.assertEqual(entry["team_id"], self.team.id)
+        self.assertEqual(entry["api_limits"], {"rate_limit": 0, "burst": 0, "daily_quota": 0})
+        with patch.object(TeamApiKey, "is_valid") as is_valid, self.assertNumQueries(0):
+            self.assertEqual(verify_team_api_key(self.key), entry)
+            verified_api_key_local_cache.clear()
+            # falls back to redis
+            self.assertEqual(verify_team_api_key(self.key), entry)
+        is_valid.assert_not_called()
+
+    def test_wrong_secret_with_cached_prefix(self):
+        verify_team_api_key(self.key)
+        prefix = self.key.partition(".")[0]
+        with self.assertRaises(PermissionDenied):
+            verify_team_api_key(f"{prefix}.wrong")
+
+    def test_status_change_invalidates(self):
+        verify_team_api_key(self.key)
+        self.team_api_key.status = TeamApiKeyStatus.BLOCKED
+        self.team_api_key.save()
+        with self.assertRaises(PermissionDenied):
+            verify_team_api_key(self.key)
+
+    def test_last_used_updates_dont_invalidate(self):
+        verify_team_api_key(self.key)
+        self.team_api_key.save(update_fields=["last_used"])
+        with self.assertNumQueries(0):
+            verify_team_api_key(self.key)
+
+    def test_delete_invalidates(self):
+        verify_team_api_key(self.key)
+        self.team_api_key.delete()
+        with self.assertRaises(PermissionDenied):
+            verify_team_api_key(self.key)
+
+    def test_blocking_by_queryset_invalidates(self):
+        verify_team_api_key(self.key)
+        block_team_api_keys(TeamApiKey.objects.filter(team=self.team))
+        with self.assertRaises(PermissionDenied):
+            verify_team_api_key(self.key)
+
+
+class ApiLimitsTest(SimpleTestCase):
+    def get_api_limits(self, **metadata):
+        team = Team(name="Cubs")
+        team.__dict__["active_stripe_subscription"] = True
+        subscription = Mock()
+        subscription.plan.product.metadata = metadata
+        with patch.object(Team, "subscription", subscription):
+            return team.get_api_limits()
+
+    def test_burst_defaults_to_rate_limit(self):
+        self.assertEqual(
+            self.get_api_limits(api_rate_limit="60", api_daily_quota="1000"),
+            {"rate_limit": 60, "burst": 60, "daily_quota": 1000},
+        )
+
+    def test_burst_is_at_least_one(self):
+        for burst in ["0", "-5"]:
+            with self.subTest(burst=burst):
+                self.assertEqual(self.get_api_limits(api_rate_limit="60", api_rate_limit_burst=burst)["burst"], 1)
+
+    def test_negative_limits_are_unlimited(self):
+        self.assertEqual(
+            self.get_api_limits(api_rate_limit="-1", api_rate_limit_burst="10", api_daily_quota="-1"),
+            {"rate_limit": 0, "burst": 0, "daily_quota": 0},
+        )
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from apps.teams import cache as teams_cache
+from apps.teams.tasks import flush_team_api_key_usage
+from apps.teams.models import Team, TeamApiKey
+from vulmatch_api.tests.utils import LOCMEM_CACHES, create_team_api_key
+
+
+class FakeRedis:
+    """
+    Just enough of a redis client (hashes and pipelines) for the usage counters.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def hincrby(self, name, key, amount=1):
+        self.commands.append(("hincrby", name, str(key), amount))
+
+    def hset(self, name, key, value):
+        self.commands.append(("hset", name, str(key), value))
+
+    def hsetnx(self, name, key, value):
+        self.commands.append(("hsetnx", name, str(key), value))
+
+    def hgetall(self, name):
+        self.commands.append(("hgetall", name))
+
+    def delete(self, *names):
+        self.commands.append(("delete", names))
+
+    def execute(self):
+        results = []
+        for command, *args in self.commands:
+            if command == "hincrby":
+                name, key, amount = args
+                values = self.hashes.setdefault(name, {})
+                values[key] = int(values.get(key, 0)) + amount
+                results.append(values[key])
+            elif command in ("hset", "hsetnx"):
+                name, key, value = args
+                values = self.hashes.setdefault(name, {})
+                if command == "hset" or key not in values:
+                    values[key] = value
+                results.append(1)
+            elif command == "hgetall":
+                results.append(dict(self.hashes.get(args[0], {})))
+            elif command == "delete":
+                results.append(sum(self.hashes.pop(name, None) is not None for name in args[0]))
+        self.commands = []
+        return results
+
+
+@override_settings(CACHES=LOCMEM_CACHES, TEAM_API_KEY_LAST_USED_RESOLUTION=60)
+class ApiKeyUsageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team = Team.objects.create(name="Usage", slug="usage")
+        cls.first_key, _ = create_team_api_key("ivan@example.com", team=cls.team)
+        cls.second_key, _ = create_team_api_key("judy@example.com", team=cls.team)
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("apps.teams.cache.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        teams_cache._recorded_last_used.clear()
+
+    def test_last_used_is_recorded_once_per_step(self):
+        with patch("apps.teams.cache.time.time", return_value=1000):
+            teams_cache.record_team_api_key_usage(self.first_key.id)
+            teams_cache.record_team_api_key_usage(self.first_key.id)
+        with patch("apps.teams.cache.time.time", return_value=1010):
+            teams_cache.record_team_api_key_usage(self.first_key.id)
+        self.assertEqual(
+            self.redis.hashes[teams_cache.TEAM_API_KEY_REQUEST_COUNT_KEY], {str(self.first_key.id): 3}
+        )
+        self.assertEqual(self.redis.hashes[teams_cache.TEAM_API_KEY_LAST_USED_KEY], {str(self.first_key.id): 960})
+
+    def test_flush_updates_only_usage_columns(self):
+        with patch("apps.teams.cache.time.time", return_value=1200):
+            for _ in range(3):
+                teams_cache.record_team_api_key_usage(self.first_key.id)
+            teams_cache.record_team_api_key_usage(self.second_key.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_team_api_key_usage(), 2)
+
+        first, second = TeamApiKey.objects.get(id=self.first_key.id), TeamApiKey.objects.get(id=self.second_key.id)
+        self.assertEqual(first.request_count, 3)
+        self.assertEqual(second.request_count, 1)
+        self.assertEqual(first.last_used, datetime.fromtimestamp(1200, timezone.utc))
+        self.assertEqual(first.name, self.first_key.name)
+        self.assertEqual(self.redis.hashes, {})
+
+        # the step was already recorded, so only the count moves
+        with patch("apps.teams.cache.time.time", return_value=1210):
+            teams_cache.record_team_api_key_usage(self.first_key.id)
+        flush_team_api_key_usage()
+        first.refresh_from_db()
+        self.assertEqual(first.request_count, 4)
+        self.assertEqual(first.last_used, datetime.fromtimestamp(1200, timezone.utc))
+
+    def test_nothing_to_flush(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_team_api_key_usage(), 0)
+
+    def test_failed_flush_puts_usage_back(self):
+        with patch("apps.teams.cache.time.time", return_value=1200):
+            teams_cache.record_team_api_key_usage(self.first_key.id)
+        with patch("apps.teams.tasks._update_team_api_key_usage", side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            flush_team_api_key_usage()
+        self.assertEqual(
+            self.redis.hashes[teams_cache.TEAM_API_KEY_REQUEST_COUNT_KEY], {str(self.first_key.id): 1}
+        )
+        self.assertEqual(self.redis.hashes[teams_cache.TEAM_API_KEY_LAST_USED_KEY], {str(self.first_key.id): 1200})
+
+    def test_redis_errors_are_ignored(self):
+        with patch("apps.teams.cache.get_redis_connection", side_effect=ConnectionError):
+            teams_cache.record_team_api_key_usage(self.first_key.id)
@@ -0,0 +1,50 @@
+"""
+Running ORM code from async views without going through Django's single sync thread.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix="async-db"
+                )
+    return _executor
+
+
+def _call(func, args, kwargs):
+    # these threads are outside the request lifecycle, so their connections are
+    # recycled here, as Django does around each request
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def db_sync_to_async(func):
+    """
+    Like `sync_to_async(func, thread_sensitive=False)`, for functions that use the DB:
+    they run on a pool of ASYNC_DB_THREADS threads whose connections are closed when
+    broken or older than CONN_MAX_AGE.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), _call, func, args, kwargs
+        )
+
+    return wrapper
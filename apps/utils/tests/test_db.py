@@ -0,0 +1,19 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from apps.utils.db import db_sync_to_async
+
+
+class DbSyncToAsyncTest(SimpleTestCase):
+    def test_runs_on_db_threads_and_recycles_connections(self):
+        def get_thread_name(suffix):
+            return threading.current_thread().name + suffix
+
+        with patch("apps.utils.db.close_old_connections") as close_old_connections:
+            name = asyncio.run(db_sync_to_async(get_thread_name)("!"))
+        self.assertTrue(name.startswith("async-db"))
+        self.assertTrue(name.endswith("!"))
+        self.assertEqual(close_old_connections.call_count, 2)
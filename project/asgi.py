@@ -3,6 +3,8 @@ ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run with e.g. ``gunicorn project.asgi:application -k uvicorn.workers.UvicornWorker``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -12,5 +14,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+# serve the Vulmatch proxy routes with the async views when running under ASGI
+os.environ.setdefault("VULMATCH_PROXY_ASYNC", "true")
 
 application = get_asgi_application()
+
+# generating the admin API schema takes a while, do it before serving requests
+from vulmatch_api.schema import warm_admin_schema  # noqa: E402
+
+warm_admin_schema()
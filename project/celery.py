@@ -2,6 +2,7 @@ import os
 from datetime import timedelta
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 
 # set the default Django settings module for the 'celery' program.
@@ -23,4 +24,8 @@ app.conf.beat_schedule = {
         'task': 'vulmatch_api.tasks.cve_download_cron',
         'schedule': crontab(hour=0, minute=0),
     },
+    'flush_team_api_key_usage': {
+        'task': 'apps.teams.tasks.flush_team_api_key_usage',
+        'schedule': timedelta(seconds=settings.TEAM_API_KEY_USAGE_FLUSH_INTERVAL),
+    },
 }
@@ -94,8 +94,124 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + PROJECT_APPS
 
 VULMATCH_SERVICE_BASE_URL = env("VULMATCH_SERVICE_BASE_URL", default="")
 
+# Upstream HTTP client (connection pool per worker process)
+VULMATCH_UPSTREAM_POOL_CONNECTIONS = env.int("VULMATCH_UPSTREAM_POOL_CONNECTIONS", default=4)
+VULMATCH_UPSTREAM_POOL_MAXSIZE = env.int("VULMATCH_UPSTREAM_POOL_MAXSIZE", default=20)
+VULMATCH_UPSTREAM_CONNECT_TIMEOUT = env.float("VULMATCH_UPSTREAM_CONNECT_TIMEOUT", default=5.0)
+VULMATCH_UPSTREAM_READ_TIMEOUT = env.float("VULMATCH_UPSTREAM_READ_TIMEOUT", default=60.0)
+VULMATCH_UPSTREAM_KEEPALIVE = env.bool("VULMATCH_UPSTREAM_KEEPALIVE", default=True)
+VULMATCH_UPSTREAM_ASYNC_MAX_CONNECTIONS = env.int("VULMATCH_UPSTREAM_ASYNC_MAX_CONNECTIONS", default=1000)
+VULMATCH_UPSTREAM_ASYNC_KEEPALIVE_TIMEOUT = env.float("VULMATCH_UPSTREAM_ASYNC_KEEPALIVE_TIMEOUT", default=15.0)
+
+# Circuit breaker shared by all workers: opens after FAILURE_THRESHOLD errors, 5xx or calls
+# slower than SLOW_CALL seconds within FAILURE_WINDOW seconds, then fails fast for OPEN_SECONDS
+VULMATCH_UPSTREAM_BREAKER = env.bool("VULMATCH_UPSTREAM_BREAKER", default=True)
+VULMATCH_UPSTREAM_BREAKER_FAILURE_THRESHOLD = env.int("VULMATCH_UPSTREAM_BREAKER_FAILURE_THRESHOLD", default=5)
+VULMATCH_UPSTREAM_BREAKER_FAILURE_WINDOW = env.int("VULMATCH_UPSTREAM_BREAKER_FAILURE_WINDOW", default=30)
+VULMATCH_UPSTREAM_BREAKER_SLOW_CALL = env.float("VULMATCH_UPSTREAM_BREAKER_SLOW_CALL", default=10.0)
+VULMATCH_UPSTREAM_BREAKER_OPEN_SECONDS = env.int("VULMATCH_UPSTREAM_BREAKER_OPEN_SECONDS", default=30)
+
+# Send a second, identical GET when the first is slower than this percentile of recent calls
+VULMATCH_UPSTREAM_HEDGE = env.bool("VULMATCH_UPSTREAM_HEDGE", default=False)
+VULMATCH_UPSTREAM_HEDGE_PERCENTILE = env.float("VULMATCH_UPSTREAM_HEDGE_PERCENTILE", default=95.0)
+VULMATCH_UPSTREAM_HEDGE_MIN_DELAY = env.float("VULMATCH_UPSTREAM_HEDGE_MIN_DELAY", default=0.05)
+
+# Use the async proxy views (set automatically by project/asgi.py)
+VULMATCH_PROXY_ASYNC = env.bool("VULMATCH_PROXY_ASYNC", default=False)
+
+# Relay upstream bodies chunk by chunk instead of buffering them in the worker
+VULMATCH_PROXY_STREAMING = env.bool("VULMATCH_PROXY_STREAMING", default=True)
+VULMATCH_PROXY_STREAM_CHUNK_SIZE = env.int("VULMATCH_PROXY_STREAM_CHUNK_SIZE", default=64 * 1024)
+
+# Gzip uncompressed upstream bodies for clients that accept it (compressed ones are relayed as-is)
+VULMATCH_PROXY_COMPRESS = env.bool("VULMATCH_PROXY_COMPRESS", default=True)
+VULMATCH_PROXY_COMPRESS_MIN_SIZE = env.int("VULMATCH_PROXY_COMPRESS_MIN_SIZE", default=1024)
+VULMATCH_PROXY_COMPRESS_LEVEL = env.int("VULMATCH_PROXY_COMPRESS_LEVEL", default=6)
+
+# Cache proxied GET responses in redis. Entries are invalidated all at once when the
+# nightly ingest finishes, so TTLs are only an upper bound.
+VULMATCH_PROXY_CACHE_ENABLED = env.bool("VULMATCH_PROXY_CACHE_ENABLED", default=True)
+VULMATCH_PROXY_CACHE_DEFAULT_TTL = env.int("VULMATCH_PROXY_CACHE_DEFAULT_TTL", default=24 * 60 * 60)
+VULMATCH_PROXY_CACHE_MAX_BODY_SIZE = env.int("VULMATCH_PROXY_CACHE_MAX_BODY_SIZE", default=5 * 1024 * 1024)
+# (upstream path regex, ttl in seconds) pairs, first match wins; 0 disables caching
+VULMATCH_PROXY_CACHE_TTLS = [
+    (r"jobs/.*", 0),
+    (r"(cve|cpe)/objects/", 60 * 60),
+]
+# Keep a last-known-good copy of each cached response, served (with Age and Warning
+# headers) while it is refreshed in the background for up to its TTL plus
+# VULMATCH_PROXY_STALE_WHILE_REVALIDATE seconds, and instead of upstream errors for up
+# to the route's max staleness
+VULMATCH_PROXY_STALE_ENABLED = env.bool("VULMATCH_PROXY_STALE_ENABLED", default=True)
+VULMATCH_PROXY_STALE_WHILE_REVALIDATE = env.int("VULMATCH_PROXY_STALE_WHILE_REVALIDATE", default=10 * 60)
+VULMATCH_PROXY_DEFAULT_MAX_STALENESS = env.int("VULMATCH_PROXY_DEFAULT_MAX_STALENESS", default=3 * 24 * 60 * 60)
+# (upstream path regex, max staleness in seconds) pairs, first match wins; 0 never serves stale
+VULMATCH_PROXY_MAX_STALENESS = [
+    (r"(cve|cpe)/objects/", 24 * 60 * 60),
+]
+# Background refreshes of stale responses run on their own threads, this many per worker
+# process, so they never hold up batch lookups
+VULMATCH_PROXY_STALE_REFRESH_CONCURRENCY = env.int("VULMATCH_PROXY_STALE_REFRESH_CONCURRENCY", default=4)
+
+# Who gets a Server-Timing header breaking down where the time of a request went
+# (auth, db, cache, upstream, serialization): "all", "staff" or "none"
+VULMATCH_SERVER_TIMING = env("VULMATCH_SERVER_TIMING", default="staff")
+
+# Rewrite query params to a canonical form (sorted, empty and default values dropped, see
+# vulmatch_api/query.py) before they are used as a cache key or sent upstream
+VULMATCH_PROXY_NORMALIZE_QUERY = env.bool("VULMATCH_PROXY_NORMALIZE_QUERY", default=True)
+
+# Cache-Control of the open (web app) proxy routes, whose data is the same for every
+# user, so a CDN or reverse proxy can serve them
+VULMATCH_OPEN_PROXY_MAX_AGE = env.int("VULMATCH_OPEN_PROXY_MAX_AGE", default=60)
+VULMATCH_OPEN_PROXY_S_MAXAGE = env.int("VULMATCH_OPEN_PROXY_S_MAXAGE", default=10 * 60)
+VULMATCH_OPEN_PROXY_STALE_WHILE_REVALIDATE = env.int("VULMATCH_OPEN_PROXY_STALE_WHILE_REVALIDATE", default=60 * 60)
+
+# Warming of the proxy cache after each ingest: the first pages of the web app's default
+# listings, the most requested paths (counted per worker and flushed to redis every few
+# seconds) and the CVEs the ingest modified, fetched this many at a time
+VULMATCH_OPEN_PROXY_WARM_PATHS = ["cve/objects/", "cpe/objects/"]
+VULMATCH_OPEN_PROXY_WARM_PAGES = env.int("VULMATCH_OPEN_PROXY_WARM_PAGES", default=5)
+VULMATCH_PROXY_HITS_FLUSH_INTERVAL = env.float("VULMATCH_PROXY_HITS_FLUSH_INTERVAL", default=10.0)
+VULMATCH_PROXY_HITS_MAX_PATHS = env.int("VULMATCH_PROXY_HITS_MAX_PATHS", default=10000)
+VULMATCH_WARM_TOP_PATHS = env.int("VULMATCH_WARM_TOP_PATHS", default=500)
+VULMATCH_WARM_MODIFIED_MAX = env.int("VULMATCH_WARM_MODIFIED_MAX", default=1000)
+VULMATCH_WARM_CONCURRENCY = env.int("VULMATCH_WARM_CONCURRENCY", default=8)
+
+# Coalesce identical concurrent cache misses (within a worker and across workers) into a
+# single upstream call; waiters give up and call upstream themselves after the timeout
+VULMATCH_PROXY_SINGLE_FLIGHT = env.bool("VULMATCH_PROXY_SINGLE_FLIGHT", default=True)
+VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT = env.float("VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT", default=10.0)
+VULMATCH_PROXY_SINGLE_FLIGHT_POLL_INTERVAL = env.float("VULMATCH_PROXY_SINGLE_FLIGHT_POLL_INTERVAL", default=0.05)
+
+# Batch lookups: upstream calls made at once for batches, per worker process, ids per batch,
+# and bytes (as sent by upstream) of an item over which it fails rather than being read whole
+VULMATCH_BATCH_CONCURRENCY = env.int("VULMATCH_BATCH_CONCURRENCY", default=16)
+VULMATCH_BATCH_MAX_ITEMS = env.int("VULMATCH_BATCH_MAX_ITEMS", default=500)
+VULMATCH_BATCH_MAX_ITEM_SIZE = env.int("VULMATCH_BATCH_MAX_ITEM_SIZE", default=20 * 1024 * 1024)
+
+# NDJSON exports (?stream=ndjson): page size asked of upstream when the client doesn't set one
+VULMATCH_EXPORT_PAGE_SIZE = env.int("VULMATCH_EXPORT_PAGE_SIZE", default=200)
+
+# Port on which each celery worker serves the metrics of its tasks (0 to not serve them),
+# as the web's metrics endpoint can't see those of workers in other containers, see
+# vulmatch_api/metrics.py
+VULMATCH_WORKER_METRICS_PORT = env.int("VULMATCH_WORKER_METRICS_PORT", default=0)
+
+# Daily ingest: the CVE download job is polled after delays growing from the initial one
+# by the backoff factor up to the max, but not before this fraction of the median duration
+# of past jobs has passed. Holders of one of the callback tokens can POST to the job
+# callback endpoint (with ?token=) when a job finishes to have it polled right away; the
+# endpoint is disabled when there are none.
+VULMATCH_INGEST_POLL_INITIAL_DELAY = env.float("VULMATCH_INGEST_POLL_INITIAL_DELAY", default=15.0)
+VULMATCH_INGEST_POLL_BACKOFF = env.float("VULMATCH_INGEST_POLL_BACKOFF", default=2.0)
+VULMATCH_INGEST_POLL_MAX_DELAY = env.float("VULMATCH_INGEST_POLL_MAX_DELAY", default=300.0)
+VULMATCH_INGEST_POLL_ESTIMATE_FRACTION = env.float("VULMATCH_INGEST_POLL_ESTIMATE_FRACTION", default=0.9)
+VULMATCH_INGEST_CALLBACK_TOKENS = env.list("VULMATCH_INGEST_CALLBACK_TOKENS", default="")
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "vulmatch_api.middleware.ServerTimingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -107,6 +223,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "waffle.middleware.WaffleMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "vulmatch_api.middleware.ProxyMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "project.urls"
@@ -146,6 +263,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "project.wsgi.application"
+ASGI_APPLICATION = "project.asgi.application"
 
 FORM_RENDERER = "django.forms.renderers.TemplatesSetting"
 
@@ -418,6 +536,19 @@ else:
     STRIPE_TEST_SECRET_KEY = STRIPE_SECRET_KEY
 
 API_KEY_CUSTOM_HEADER = "HTTP_API_KEY"
+# How long a verified team API key is trusted without hashing it again, in redis and in
+# each process. Saving or deleting a key clears the redis entry straight away, so the
+# in-process TTL bounds how long other processes can keep using a blocked key.
+TEAM_API_KEY_CACHE_TTL = env.int("TEAM_API_KEY_CACHE_TTL", default=60)
+TEAM_API_KEY_LOCAL_CACHE_TTL = env.int("TEAM_API_KEY_LOCAL_CACHE_TTL", default=5)
+# API key usage (last_used and request_count) is counted in redis and written to the DB
+# every TEAM_API_KEY_USAGE_FLUSH_INTERVAL seconds. last_used is rounded down to
+# TEAM_API_KEY_LAST_USED_RESOLUTION seconds, and each process only records it once per step.
+TEAM_API_KEY_USAGE_FLUSH_INTERVAL = env.int("TEAM_API_KEY_USAGE_FLUSH_INTERVAL", default=60)
+TEAM_API_KEY_LAST_USED_RESOLUTION = env.int("TEAM_API_KEY_LAST_USED_RESOLUTION", default=60)
+# Threads async views run their DB queries on (API key and user lookups), each holding
+# at most one DB connection
+ASYNC_DB_THREADS = env.int("ASYNC_DB_THREADS", default=8)
 # djstripe settings
 # Get it from the section in the Stripe dashboard where you added the webhook endpoint
 # or from the stripe CLI when testing
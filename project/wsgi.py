@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 
 application = get_wsgi_application()
+
+# generating the admin API schema takes a while, do it before serving requests
+from vulmatch_api.schema import warm_admin_schema  # noqa: E402
+
+warm_admin_schema()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class VulmatchApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "vulmatch_api"
+
+    def ready(self):
+        # connects the celery task and db connection signals
+        from . import metrics, timing  # noqa: F401
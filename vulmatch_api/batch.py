@@ -0,0 +1,128 @@
+"""
+Batch lookups of CVE and CPE objects.
+
+Each item of a batch is one `<type>/objects/<id>/` call upstream, unless the proxy cache
+already has it. The calls run concurrently on a pool shared by every batch of the worker
+process, so the number of upstream connections a worker uses for batches stays bounded
+by VULMATCH_BATCH_CONCURRENCY however many batches are in flight.
+"""
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+import urllib3
+from django.conf import settings
+from django.http import QueryDict
+
+from . import cache as proxy_cache
+from . import query, single_flight, upstream
+from .exceptions import UpstreamError, UpstreamResponseTooLarge, UpstreamTimeout, UpstreamUnavailable
+
+
+BATCH_OBJECT_TYPES = ("cve", "cpe")
+
+# every item is stored in the proxy cache, which keeps one gzipped copy
+UPSTREAM_HEADERS = {"Accept": "application/json", "Accept-Encoding": "gzip"}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.VULMATCH_BATCH_CONCURRENCY,
+                    thread_name_prefix="vulmatch-batch",
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def get_object_path(object_type, object_id):
+    # CPE names are full of colons and wildcards, which upstream expects unescaped
+    return f"{object_type}/objects/{quote(object_id, safe=':*')}/"
+
+
+def _fetch_entry(path, params, cache_key, cache_ttl):
+    response = upstream.request(
+        method="GET",
+        url=f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}",
+        headers=UPSTREAM_HEADERS,
+        params=query.get_pairs(params),
+        stream=True,
+    )
+    try:
+        body, complete = proxy_cache.read_body(response)
+        if not complete:
+            # the item needs all of it, but it is too big to be cached
+            rest, item_complete = proxy_cache.read_body(response, settings.VULMATCH_BATCH_MAX_ITEM_SIZE - len(body))
+            if not item_complete:
+                raise UpstreamResponseTooLarge()
+            body += rest
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise UpstreamTimeout() from e
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        # the body failed part way, which only fails this item
+        raise UpstreamUnavailable() from e
+    finally:
+        response.close()
+    entry = proxy_cache.make_entry(response.status_code, response.headers, body)
+    if cache_key and complete and proxy_cache.is_cacheable(response.status_code, response.headers):
+        proxy_cache.set_entry(cache_key, entry, cache_ttl, proxy_cache.get_max_staleness(path))
+    return entry
+
+
+def get_entry(path, params=None):
+    """
+    Returns the proxy cache entry for an upstream GET of `path` with `params` (a
+    QueryDict), calling upstream (once across workers, see `single_flight`) if it isn't
+    cached.
+    """
+    params = query.normalize(path, params if params is not None else QueryDict())
+    cache_ttl = proxy_cache.get_ttl(path)
+    cache_key = cache_ttl and proxy_cache.get_cache_key(path, params)
+    if not cache_key:
+        return _fetch_entry(path, params, None, 0)
+    entry = proxy_cache.get_entry(cache_key)
+    if entry is None:
+        entry, _ = single_flight.fetch(
+            cache_key, lambda: (_fetch_entry(path, params, cache_key, cache_ttl), None)
+        )
+    return entry
+
+
+def lookup_item(object_type, object_id):
+    """
+    Looks up a single object and returns its result: `status` is the upstream status,
+    with the upstream body under `data` for a 200 and under `error` otherwise.
+    """
+    item = {"type": object_type, "id": object_id}
+    try:
+        entry = get_entry(get_object_path(object_type, object_id))
+    except UpstreamError as exc:
+        item.update(status=exc.status_code, error={"detail": str(exc.detail)})
+        return item
+    try:
+        body = json.loads(gzip.decompress(entry["body"]))
+    except ValueError:
+        body = None
+    item["status"] = entry["status"]
+    item["data" if entry["status"] == 200 else "error"] = body
+    return item
+
+
+def lookup(items):
+    """
+    Looks up `(object_type, object_id)` pairs concurrently and returns their results in
+    the same order.
+    """
+    return list(get_executor().map(lambda item: lookup_item(*item), items))
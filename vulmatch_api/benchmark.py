@@ -0,0 +1,56 @@
+"""
+Helpers shared by the proxy benchmark commands (`benchmark_proxy`, `benchmark_async_proxy`).
+"""
+import os
+import resource
+import statistics
+import subprocess
+
+
+def summarize(mode, latencies, errors, elapsed, concurrency):
+    """
+    Returns throughput and latency percentiles of a run, `latencies` being the seconds
+    taken by each successful request.
+    """
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99 or [0] * 99
+    return {
+        "mode": mode,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round((len(latencies) + errors) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+    }
+
+
+def get_rss_mb():
+    """
+    Returns the resident set size of this process, in MiB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def get_commit():
+    """
+    Returns the git commit being benchmarked, if known, so results can be compared.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return os.environ.get("GIT_COMMIT")
@@ -0,0 +1,144 @@
+"""
+Circuit breaker around the Vulmatch upstream, with its state shared by every worker
+through redis.
+
+* closed: calls go through. Errors, 5xx responses and calls slower than
+  `VULMATCH_UPSTREAM_BREAKER_SLOW_CALL` count as failures, and once
+  `VULMATCH_UPSTREAM_BREAKER_FAILURE_THRESHOLD` of them happen within
+  `VULMATCH_UPSTREAM_BREAKER_FAILURE_WINDOW` seconds the breaker opens.
+* open: calls fail straight away with a 503 for `VULMATCH_UPSTREAM_BREAKER_OPEN_SECONDS`.
+* half open: a single probe call is let through, the others keep failing fast. The
+  breaker closes if the probe succeeds and opens again if it fails.
+
+If redis can't be reached the breaker stays out of the way.
+"""
+import logging
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .exceptions import UpstreamCircuitOpen
+
+
+UPSTREAM_BREAKER_CACHE_KEY = 'vulmatch_api.upstream_breaker'
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _get_key(name):
+    return f'{UPSTREAM_BREAKER_CACHE_KEY}:{name}'
+
+
+def _get_probe_timeout():
+    # long enough for the probe call to finish, short enough to recover from a dead worker
+    return math.ceil(settings.VULMATCH_UPSTREAM_CONNECT_TIMEOUT + settings.VULMATCH_UPSTREAM_READ_TIMEOUT)
+
+
+def get_status():
+    values = cache.get_many([_get_key("opened_at"), _get_key("tripped_at"), _get_key("failures")])
+    opened_at = values.get(_get_key("opened_at"))
+    if opened_at is not None:
+        state = OPEN
+    elif _get_key("tripped_at") in values:
+        state = HALF_OPEN
+    else:
+        state = CLOSED
+    retry_after = None
+    if opened_at is not None:
+        retry_after = max(0, math.ceil(opened_at + settings.VULMATCH_UPSTREAM_BREAKER_OPEN_SECONDS - time.time()))
+    return {
+        "enabled": settings.VULMATCH_UPSTREAM_BREAKER,
+        "state": state,
+        "failures": values.get(_get_key("failures"), 0),
+        "tripped_at": values.get(_get_key("tripped_at")),
+        "retry_after": retry_after,
+    }
+
+
+def before_request():
+    """
+    Returns the state a call is being made in, or raises `UpstreamCircuitOpen` if it
+    must not be made.
+    """
+    if not settings.VULMATCH_UPSTREAM_BREAKER:
+        return CLOSED
+    try:
+        status = get_status()
+        state = status["state"]
+        if state == HALF_OPEN and not cache.add(_get_key("probe"), 1, timeout=_get_probe_timeout()):
+            # another worker is already probing
+            state = OPEN
+    except Exception:
+        logging.exception("could not read upstream circuit breaker state")
+        return CLOSED
+    if state == OPEN:
+        raise UpstreamCircuitOpen(wait=status["retry_after"])
+    return state
+
+
+def trip():
+    now = time.time()
+    cache.set(_get_key("opened_at"), now, timeout=settings.VULMATCH_UPSTREAM_BREAKER_OPEN_SECONDS)
+    cache.set(_get_key("tripped_at"), now, timeout=None)
+    cache.delete_many([_get_key("failures"), _get_key("probe")])
+    logging.warning("upstream circuit breaker opened")
+
+
+def reset():
+    cache.delete_many([
+        _get_key("opened_at"), _get_key("tripped_at"), _get_key("failures"), _get_key("probe"),
+    ])
+
+
+def record_success(state):
+    if not settings.VULMATCH_UPSTREAM_BREAKER or state != HALF_OPEN:
+        return
+    try:
+        reset()
+        logging.info("upstream circuit breaker closed")
+    except Exception:
+        logging.exception("could not close upstream circuit breaker")
+
+
+def record_failure(state):
+    if not settings.VULMATCH_UPSTREAM_BREAKER:
+        return
+    try:
+        if state == HALF_OPEN:
+            trip()
+            return
+        cache.add(_get_key("failures"), 0, timeout=settings.VULMATCH_UPSTREAM_BREAKER_FAILURE_WINDOW)
+        if cache.incr(_get_key("failures")) >= settings.VULMATCH_UPSTREAM_BREAKER_FAILURE_THRESHOLD:
+            trip()
+    except Exception:
+        logging.exception("could not record upstream failure")
+
+
+def release_probe(state):
+    """
+    Lets another call probe a half-open breaker, when this one ended without a result.
+    """
+    if not settings.VULMATCH_UPSTREAM_BREAKER or state != HALF_OPEN:
+        return
+    try:
+        cache.delete(_get_key("probe"))
+    except Exception:
+        logging.exception("could not release upstream circuit breaker probe")
+
+
+def record_response(state, status_code, elapsed):
+    if status_code >= 500 or elapsed > settings.VULMATCH_UPSTREAM_BREAKER_SLOW_CALL:
+        record_failure(state)
+    else:
+        record_success(state)
+
+
+abefore_request = sync_to_async(before_request, thread_sensitive=False)
+arecord_failure = sync_to_async(record_failure, thread_sensitive=False)
+arecord_response = sync_to_async(record_response, thread_sensitive=False)
+arelease_probe = sync_to_async(release_probe, thread_sensitive=False)
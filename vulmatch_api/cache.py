@@ -0,0 +1,246 @@
+import functools
+import gzip
+import hashlib
+import logging
+import re
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from . import timing
+from .signals import schema_changed
+
+
+PROXY_CACHE_GENERATION_KEY = 'vulmatch_api.proxy_cache_generation'
+PROXY_RESPONSE_CACHE_KEY = 'vulmatch_api.proxy_response'
+PROXY_STALE_RESPONSE_CACHE_KEY = 'vulmatch_api.proxy_stale_response'
+
+# encodings an upstream body may arrive in and still be stored (always gzipped)
+CACHEABLE_ENCODINGS = ("", "identity", "gzip")
+
+
+def normalize_path(path):
+    return re.sub("/{2,}", "/", path.lstrip("/"))
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_ttl_patterns(ttls):
+    return [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+
+
+def get_ttl(path):
+    """
+    Returns how long (in seconds) responses for this upstream path may be cached,
+    0 meaning never.
+    """
+    if not settings.VULMATCH_PROXY_CACHE_ENABLED:
+        return 0
+    path = normalize_path(path)
+    for pattern, ttl in _compile_ttl_patterns(tuple(settings.VULMATCH_PROXY_CACHE_TTLS)):
+        if pattern.fullmatch(path):
+            return ttl
+    return settings.VULMATCH_PROXY_CACHE_DEFAULT_TTL
+
+
+def get_max_staleness(path):
+    """
+    Returns how old (in seconds) the last-known-good copy of a response for this upstream
+    path may be and still be served when upstream fails, 0 meaning never (see `stale`).
+    """
+    if not settings.VULMATCH_PROXY_STALE_ENABLED or not get_ttl(path):
+        return 0
+    path = normalize_path(path)
+    for pattern, max_staleness in _compile_ttl_patterns(tuple(settings.VULMATCH_PROXY_MAX_STALENESS)):
+        if pattern.fullmatch(path):
+            return max_staleness
+    return settings.VULMATCH_PROXY_DEFAULT_MAX_STALENESS
+
+
+def get_generation():
+    generation = cache.get(PROXY_CACHE_GENERATION_KEY)
+    if generation is None:
+        cache.add(PROXY_CACHE_GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(PROXY_CACHE_GENERATION_KEY, 1)
+    return generation
+
+
+def bump_generation():
+    """
+    Invalidates every cached proxy response at once. Called when an ingest finishes.
+    """
+    cache.add(PROXY_CACHE_GENERATION_KEY, 1, timeout=None)
+    return cache.incr(PROXY_CACHE_GENERATION_KEY)
+
+
+@receiver(schema_changed)
+def _invalidate_on_schema_change(sender, **kwargs):
+    # upstream routes changed, so responses cached for them may no longer be right
+    bump_generation()
+
+
+def get_canonical_url(path, params):
+    """
+    Returns `path?query` for an upstream path and its query params (a QueryDict), the
+    same for any order of the params.
+    """
+    query = urlencode(sorted((key, value) for key, values in params.lists() for value in values))
+    return f"{normalize_path(path)}?{query}"
+
+
+@timing.phase("cache")
+def get_cache_key(path, params):
+    """
+    Builds the key for an upstream path and its query params (a QueryDict).
+
+    The key deliberately ignores who is asking, so every team shares the same entries.
+    Returns None if the cache can't be reached.
+    """
+    try:
+        generation = get_generation()
+    except Exception:
+        logging.exception("could not read proxy cache generation")
+        return None
+    digest = hashlib.sha256(get_canonical_url(path, params).encode()).hexdigest()
+    return f'{PROXY_RESPONSE_CACHE_KEY}:{generation}:{digest}'
+
+
+def get_stale_key(key):
+    """
+    Returns the key of the last-known-good copy of an entry, which outlives generations.
+    """
+    digest = key.rsplit(':', 1)[1]
+    return f'{PROXY_STALE_RESPONSE_CACHE_KEY}:{digest}'
+
+
+def get_key_generation(key):
+    return key.rsplit(':', 2)[1]
+
+
+def is_shareable(headers):
+    """
+    Tells whether an upstream response can be turned into an entry, whatever its status.
+    """
+    if headers.get("Content-Encoding", "").strip().lower() not in CACHEABLE_ENCODINGS:
+        return False
+    content_length = headers.get("Content-Length")
+    return not content_length or int(content_length) <= settings.VULMATCH_PROXY_CACHE_MAX_BODY_SIZE
+
+
+def read_body(response, max_size=None):
+    """
+    Reads the raw body of a `requests` response fetched with `stream=True`, but no more
+    than one byte over `max_size` (VULMATCH_PROXY_CACHE_MAX_BODY_SIZE by default), since
+    Content-Length (which `is_shareable` checks) is missing from chunked responses.
+    Returns `(body, complete)`; if the body is too big, the rest of it is left unread.
+    """
+    if max_size is None:
+        max_size = settings.VULMATCH_PROXY_CACHE_MAX_BODY_SIZE
+    limit = max_size + 1
+    chunks, size = [], 0
+    while size < limit:
+        chunk = response.raw.read(limit - size, decode_content=False)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks), size < limit
+
+
+async def aread_body(response):
+    """
+    Same as `read_body`, for an `aiohttp` response.
+    """
+    limit = settings.VULMATCH_PROXY_CACHE_MAX_BODY_SIZE + 1
+    chunks, size = [], 0
+    while size < limit:
+        chunk = await response.content.read(limit - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks), size < limit
+
+
+def is_cacheable(status, headers):
+    return status == 200 and is_shareable(headers)
+
+
+def _get_etag(headers, content):
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+
+
+def make_entry(status, headers, body):
+    if headers.get("Content-Encoding", "").strip().lower() == "gzip":
+        content = gzip.decompress(body)
+    else:
+        content, body = body, gzip.compress(body, mtime=0)
+    return {
+        "status": status,
+        "content_type": headers.get("Content-Type"),
+        "body": body,
+        # strong validator of the identity representation
+        "etag": _get_etag(headers, content) if status == 200 else None,
+        "last_modified": headers.get("Last-Modified"),
+        "stored_at": time.time(),
+    }
+
+
+def get_age(entry):
+    """
+    Returns how long ago (in seconds) an entry was fetched from upstream.
+    """
+    return max(0, int(time.time() - entry.get("stored_at", time.time())))
+
+
+@timing.phase("cache")
+def get_entry(key):
+    try:
+        return cache.get(key)
+    except Exception:
+        logging.exception("could not read proxy response from cache")
+        return None
+
+
+@timing.phase("cache")
+def get_entries(key):
+    """
+    Returns `(entry, stale_entry)`: the entry for `key` and, if stale copies are kept,
+    the last-known-good copy of it, in one round trip.
+    """
+    stale_key = get_stale_key(key)
+    keys = [key, stale_key] if settings.VULMATCH_PROXY_STALE_ENABLED else [key]
+    try:
+        entries = cache.get_many(keys)
+    except Exception:
+        logging.exception("could not read proxy response from cache")
+        return None, None
+    return entries.get(key), entries.get(stale_key)
+
+
+@timing.phase("cache")
+def set_entry(key, entry, ttl, max_staleness=0):
+    """
+    Stores an entry for `ttl` seconds, and a last-known-good copy of it for as long as it
+    may be served stale (see `stale`), marked with the generation it was stored in.
+    """
+    try:
+        cache.set(key, entry, timeout=ttl)
+        if max_staleness:
+            stale_timeout = max(ttl + settings.VULMATCH_PROXY_STALE_WHILE_REVALIDATE, max_staleness)
+            cache.set(get_stale_key(key), dict(entry, generation=get_key_generation(key)), timeout=stale_timeout)
+    except Exception:
+        logging.exception("could not write proxy response to cache")
+
+
+# redis calls are network bound, so they don't need to run in the main sync thread
+aget_cache_key = sync_to_async(get_cache_key, thread_sensitive=False)
+aget_entry = sync_to_async(get_entry, thread_sensitive=False)
+aget_entries = sync_to_async(get_entries, thread_sensitive=False)
+aset_entry = sync_to_async(set_entry, thread_sensitive=False)
@@ -0,0 +1,35 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class UpstreamError(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = _("The Vulmatch service could not be reached.")
+    default_code = "upstream_error"
+
+
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+
+class UpstreamTimeout(UpstreamError):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = _("The Vulmatch service took too long to respond.")
+    default_code = "upstream_timeout"
+
+
+class UpstreamResponseTooLarge(UpstreamError):
+    default_detail = _("The Vulmatch service response is too large.")
+    default_code = "upstream_response_too_large"
+
+
+class UpstreamCircuitOpen(UpstreamError):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("The Vulmatch service is currently unavailable, try again later.")
+    default_code = "upstream_circuit_open"
+
+    def __init__(self, wait=None, detail=None, code=None):
+        super().__init__(detail, code)
+        # sent back as Retry-After
+        self.wait = wait
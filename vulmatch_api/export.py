@@ -0,0 +1,269 @@
+"""
+NDJSON exports of paginated upstream lists.
+
+A proxied list requested with `?stream=ndjson` is walked page by page here instead of by
+the client, and every object is written as one line of JSON. The next page is fetched
+while the current one is written out, so at most two pages are held in memory however
+long the list is.
+
+Every page after the first is charged to the team's rate limit and quota, as it would
+have been had the client asked for it. An error after the response has started (upstream
+failing, or the team running out of requests) ends the stream with a line of the form
+`{"error": {"status": 429, "detail": ...}}`.
+"""
+import asyncio
+import gzip
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException, Throttled
+
+from . import query, ratelimit, upstream
+from .helpers import get_accepted_encodings
+
+
+EXPORT_PARAM = "stream"
+EXPORT_FORMAT = "ndjson"
+CONTENT_TYPE = "application/x-ndjson"
+
+PAGINATION_KEYS = {"page_size", "page_number", "page_results_count", "total_results_count"}
+
+UPSTREAM_HEADERS = {"Accept": "application/json", "Accept-Encoding": "gzip"}
+
+
+class PageError(APIException):
+    """
+    A page after the first that upstream didn't return.
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+class Page:
+    def __init__(self, number, data):
+        self.results = self.results_of(data)
+        self.number = data.get("page_number") or number
+        self.size = data.get("page_size") or len(self.results)
+        self.total = data.get("total_results_count", 0)
+
+    @staticmethod
+    def results_of(data):
+        # the list is under "objects" for STIX objects and "jobs" for jobs
+        for key, value in data.items():
+            if key not in PAGINATION_KEYS and isinstance(value, list):
+                return value
+        raise ValueError("not a page")
+
+    @property
+    def has_next(self):
+        return bool(self.results) and self.number * self.size < self.total
+
+    @classmethod
+    def parse(cls, number, status, headers, body):
+        """
+        Returns the page in an upstream response, or None if it isn't a page of results.
+        """
+        if status != 200:
+            return None
+        try:
+            if headers.get("Content-Encoding", "").strip().lower() == "gzip":
+                body = gzip.decompress(body)
+            data = json.loads(body)
+            return cls(number, data) if isinstance(data, dict) else None
+        except (OSError, ValueError):
+            return None
+
+
+def is_export(request):
+    return request.GET.get(EXPORT_PARAM) == EXPORT_FORMAT
+
+
+def get_start_page(request):
+    try:
+        return max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def get_export_params(request, path):
+    params = query.normalize(path, request.GET).copy()
+    params.pop(EXPORT_PARAM, None)
+    params.pop("page", None)
+    params.setdefault("page_size", str(settings.VULMATCH_EXPORT_PAGE_SIZE))
+    return params
+
+
+def get_page_params(params, number):
+    return query.get_pairs(params) + [("page", number)]
+
+
+def get_error_detail(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode(errors="replace")
+
+
+def format_line(obj):
+    return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
+
+
+def format_error(exc: APIException):
+    return format_line({"error": {"status": exc.status_code, "detail": exc.detail}})
+
+
+def charge(team_api_key):
+    if team_api_key is None:
+        return
+    result = ratelimit.consume(team_api_key)
+    if result and not result.allowed:
+        raise Throttled(wait=result.retry_after)
+
+
+def fetch_page(url, params, number):
+    response = upstream.request(
+        method="GET", url=url, headers=UPSTREAM_HEADERS, params=get_page_params(params, number), stream=True
+    )
+    try:
+        body = response.raw.read(decode_content=False)
+    finally:
+        response.close()
+    return response.status_code, response.headers, body
+
+
+def fetch_next_page(url, params, number, team_api_key):
+    charge(team_api_key)
+    status, headers, body = fetch_page(url, params, number)
+    page = Page.parse(number, status, headers, body)
+    if page is None:
+        raise PageError(status, get_error_detail(body) if status != 200 else "Not a page of results")
+    return page
+
+
+def _relay_response(request, status, headers, body):
+    # upstream is always asked for gzip, which not every client accepts
+    content_encoding = headers.get("Content-Encoding")
+    if content_encoding == "gzip" and "gzip" not in get_accepted_encodings(request):
+        body, content_encoding = gzip.decompress(body), None
+    response = HttpResponse(body, status=status, content_type=headers.get("Content-Type"))
+    if content_encoding:
+        response["Content-Encoding"] = content_encoding
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def _make_response(content, first_page):
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPE)
+    response["X-Total-Count"] = str(first_page.total)
+    return response
+
+
+def build_export_response(request, path, team_api_key=None):
+    """
+    Returns a streaming NDJSON response of every page of `path` from the requested one
+    on, or upstream's response for the first page if it isn't a page of results.
+    """
+    url = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}"
+    params = get_export_params(request, path)
+    number = get_start_page(request)
+    status, headers, body = fetch_page(url, params, number)
+    first_page = Page.parse(number, status, headers, body)
+    if first_page is None:
+        return _relay_response(request, status, headers, body)
+
+    def iter_lines():
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vulmatch-export")
+        page = first_page
+        try:
+            while True:
+                next_page = None
+                if page.has_next:
+                    next_page = executor.submit(fetch_next_page, url, params, page.number + 1, team_api_key)
+                if page.results:
+                    yield b"".join(format_line(obj) for obj in page.results)
+                if next_page is None:
+                    return
+                try:
+                    page = next_page.result()
+                except APIException as exc:
+                    yield format_error(exc)
+                    return
+                except Exception:
+                    logging.exception("could not fetch export page")
+                    yield format_error(PageError(502, "Could not fetch the next page"))
+                    return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return _make_response(iter_lines(), first_page)
+
+
+async def afetch_page(url, params, number):
+    response = await upstream.arequest(
+        "GET", url, headers=UPSTREAM_HEADERS, params=get_page_params(params, number)
+    )
+    try:
+        body = await response.read()
+    finally:
+        response.release()
+    return response.status, response.headers, body
+
+
+async def afetch_next_page(url, params, number, team_api_key):
+    if team_api_key is not None:
+        result = await ratelimit.aconsume(team_api_key)
+        if result and not result.allowed:
+            raise Throttled(wait=result.retry_after)
+    status, headers, body = await afetch_page(url, params, number)
+    page = Page.parse(number, status, headers, body)
+    if page is None:
+        raise PageError(status, get_error_detail(body) if status != 200 else "Not a page of results")
+    return page
+
+
+async def abuild_export_response(request, path, team_api_key=None):
+    """
+    Async version of `build_export_response`.
+    """
+    url = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}"
+    params = get_export_params(request, path)
+    number = get_start_page(request)
+    status, headers, body = await afetch_page(url, params, number)
+    first_page = Page.parse(number, status, headers, body)
+    if first_page is None:
+        return _relay_response(request, status, headers, body)
+
+    async def aiter_lines():
+        page = first_page
+        next_page = None
+        try:
+            while True:
+                next_page = None
+                if page.has_next:
+                    next_page = asyncio.ensure_future(
+                        afetch_next_page(url, params, page.number + 1, team_api_key)
+                    )
+                if page.results:
+                    yield b"".join(format_line(obj) for obj in page.results)
+                if next_page is None:
+                    return
+                try:
+                    page = await next_page
+                except APIException as exc:
+                    yield format_error(exc)
+                    return
+                except Exception:
+                    logging.exception("could not fetch export page")
+                    yield format_error(PageError(502, "Could not fetch the next page"))
+                    return
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    return _make_response(aiter_lines(), first_page)
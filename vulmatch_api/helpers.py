@@ -0,0 +1,286 @@
+import gzip
+import itertools
+import re
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+from . import timing
+
+
+def get_accepted_encodings(request) -> set:
+    """
+    Returns the content codings the client accepts, according to its Accept-Encoding header.
+    """
+    accepted = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+    return accepted
+
+
+# bodies worth compressing when upstream sent them uncompressed
+COMPRESSIBLE_CONTENT_TYPES = re.compile(r"^(text/.*|application/([\w.+-]*\+)?(json|xml|javascript))$")
+
+# response headers that let clients make conditional requests
+VALIDATOR_HEADERS = ("ETag", "Last-Modified")
+
+
+def get_representation_etag(etag, content_encoding):
+    """
+    Derives the strong ETag of an encoded representation from the ETag of the identity one.
+    """
+    if not etag or content_encoding in ("", "identity"):
+        return etag
+    if etag.startswith("W/"):
+        return etag
+    return f'{etag[:-1]}-{content_encoding}"'
+
+
+@timing.phase("serialization")
+def build_cached_response(request, entry):
+    """
+    Builds a response from a proxy cache entry, whose body is stored gzipped.
+
+    Answers 304 without a body if the client's If-None-Match / If-Modified-Since still
+    match the entry.
+    """
+    content_encoding = "gzip" if "gzip" in get_accepted_encodings(request) else ""
+    etag = get_representation_etag(entry.get("etag"), content_encoding)
+    last_modified = entry.get("last_modified")
+    if etag:
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified and parse_http_date_safe(last_modified),
+        )
+    else:
+        response = None
+
+    if response is None:
+        body = entry["body"] if content_encoding else gzip.decompress(entry["body"])
+        response = HttpResponse(body, status=entry["status"], content_type=entry["content_type"])
+        if content_encoding:
+            response["Content-Encoding"] = content_encoding
+    if etag:
+        response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = last_modified
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def patch_public_cache_control(response):
+    """
+    Lets shared caches (a CDN or reverse proxy) keep successful responses of the open
+    proxy, whose data is the same for every user, and serve them stale while they
+    revalidate. Responses served stale (with a `Warning`) aren't, so shared caches don't
+    hold on to data the proxy itself only serves as a fallback.
+    """
+    if response.status_code in (200, 304) and not response.has_header("Warning"):
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.VULMATCH_OPEN_PROXY_MAX_AGE,
+            s_maxage=settings.VULMATCH_OPEN_PROXY_S_MAXAGE,
+            stale_while_revalidate=settings.VULMATCH_OPEN_PROXY_STALE_WHILE_REVALIDATE,
+        )
+    return response
+
+
+def _copy_validators(response, upstream_headers, passthrough, compress=False):
+    for header in VALIDATOR_HEADERS:
+        if header in upstream_headers:
+            response[header] = upstream_headers[header]
+    etag = upstream_headers.get("ETag")
+    if not etag or etag.startswith("W/"):
+        return
+    if compress:
+        response["ETag"] = get_representation_etag(etag, "gzip")
+    elif not passthrough:
+        # the body is decoded on the way through, so it is no longer the same bytes
+        response["ETag"] = f"W/{etag}"
+
+
+@timing.phase("serialization")
+def build_proxy_response(request, upstream_response):
+    """
+    Builds the response for a `requests` response fetched with `stream=True`, buffering
+    it unless VULMATCH_PROXY_STREAMING is set.
+    """
+    response = stream_proxy_response(request, upstream_response)
+    if settings.VULMATCH_PROXY_STREAMING:
+        return response
+    return _buffer_response(response, b"".join(response.streaming_content))
+
+
+def _buffer_response(streaming_response, content):
+    response = HttpResponse(content, status=streaming_response.status_code)
+    for header, value in streaming_response.items():
+        response[header] = value
+    return response
+
+
+def _get_passthrough_encoding(request, upstream_response):
+    """
+    Returns `(content_encoding, passthrough)` for an upstream response, where passthrough
+    tells whether its raw bytes can be relayed to this client without decoding.
+    """
+    content_encoding = upstream_response.headers.get("Content-Encoding", "").strip().lower()
+    passthrough = content_encoding in ("", "identity") or content_encoding in get_accepted_encodings(request)
+    return content_encoding, passthrough
+
+
+def _should_compress(request, status, upstream_headers, content_encoding):
+    """
+    Tells whether an uncompressed upstream body is worth gzipping for this client.
+    """
+    if not settings.VULMATCH_PROXY_COMPRESS or content_encoding not in ("", "identity"):
+        return False
+    if status in (204, 304) or "gzip" not in get_accepted_encodings(request):
+        return False
+    content_type = upstream_headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if not COMPRESSIBLE_CONTENT_TYPES.match(content_type):
+        return False
+    content_length = upstream_headers.get("Content-Length")
+    return not content_length or int(content_length) >= settings.VULMATCH_PROXY_COMPRESS_MIN_SIZE
+
+
+def _get_compressor():
+    return zlib.compressobj(settings.VULMATCH_PROXY_COMPRESS_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+def _make_streaming_response(content, status, upstream_headers, content_encoding, passthrough, compress):
+    response = StreamingHttpResponse(
+        content,
+        status=status,
+        content_type=upstream_headers.get("Content-Type"),
+    )
+    if compress or content_encoding not in ("", "identity"):
+        patch_vary_headers(response, ["Accept-Encoding"])
+    _copy_validators(response, upstream_headers, passthrough, compress)
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    elif passthrough:
+        if content_encoding not in ("", "identity"):
+            response["Content-Encoding"] = content_encoding
+        if "Content-Length" in upstream_headers:
+            response["Content-Length"] = upstream_headers["Content-Length"]
+    return response
+
+
+def stream_proxy_response(request, upstream_response):
+    """
+    Relays the upstream body to the client chunk by chunk, so memory per request is
+    bounded by the chunk size rather than the size of the body.
+
+    Compressed bodies are passed through as-is (together with their Content-Length)
+    when the client accepts the encoding, otherwise they are decoded on the fly.
+    Uncompressed bodies are gzipped on the fly if the client accepts gzip.
+
+    If the start of the raw body was already read (into `body_prefix`, see
+    `cache.read_body`), it is sent first, and the body is decoded here rather than by
+    urllib3, which can't pick up a stream part way through.
+    """
+    content_encoding, passthrough = _get_passthrough_encoding(request, upstream_response)
+    compress = _should_compress(
+        request, upstream_response.status_code, upstream_response.headers, content_encoding
+    )
+    prefix = getattr(upstream_response, "body_prefix", b"")
+
+    def iter_content():
+        decoder = _get_decoder() if prefix and not passthrough else None
+        compressor = _get_compressor() if compress else None
+        try:
+            chunks = upstream_response.raw.stream(
+                settings.VULMATCH_PROXY_STREAM_CHUNK_SIZE,
+                decode_content=not passthrough and not prefix,
+            )
+            for chunk in itertools.chain([prefix] if prefix else [], chunks):
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                yield compressor.compress(chunk) if compressor else chunk
+            if decoder:
+                yield decoder.flush()
+            if compressor:
+                yield compressor.flush()
+        finally:
+            upstream_response.close()
+
+    return _make_streaming_response(
+        iter_content(),
+        upstream_response.status_code,
+        upstream_response.headers,
+        content_encoding,
+        passthrough,
+        compress,
+    )
+
+
+@timing.phase("serialization")
+async def abuild_proxy_response(request, upstream_response):
+    response = astream_proxy_response(request, upstream_response)
+    if settings.VULMATCH_PROXY_STREAMING:
+        return response
+    return _buffer_response(response, b"".join([chunk async for chunk in response.streaming_content]))
+
+
+def _get_decoder():
+    # accepts both gzip and zlib framing
+    return zlib.decompressobj(zlib.MAX_WBITS | 32)
+
+
+def astream_proxy_response(request, upstream_response):
+    """
+    Same as `stream_proxy_response`, for an `aiohttp` response from `upstream.arequest`.
+
+    `arequest` only asks upstream for encodings the client accepts, unless the caller
+    overrides Accept-Encoding with gzip, so gzip is the only coding that may need to be
+    decoded here.
+    """
+    content_encoding, passthrough = _get_passthrough_encoding(request, upstream_response)
+    compress = _should_compress(request, upstream_response.status, upstream_response.headers, content_encoding)
+    prefix = getattr(upstream_response, "body_prefix", b"")
+
+    async def aiter_chunks():
+        if prefix:
+            yield prefix
+        async for chunk in upstream_response.content.iter_chunked(settings.VULMATCH_PROXY_STREAM_CHUNK_SIZE):
+            yield chunk
+
+    async def aiter_content():
+        decoder = None if passthrough else _get_decoder()
+        compressor = _get_compressor() if compress else None
+        try:
+            async for chunk in aiter_chunks():
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                yield compressor.compress(chunk) if compressor else chunk
+            if decoder:
+                yield decoder.flush()
+            if compressor:
+                yield compressor.flush()
+        finally:
+            upstream_response.release()
+
+    return _make_streaming_response(
+        aiter_content(),
+        upstream_response.status,
+        upstream_response.headers,
+        content_encoding,
+        passthrough,
+        compress,
+    )
@@ -0,0 +1,110 @@
+"""
+Per-path request counts of the proxy, used to pick what to warm after an ingest.
+
+Each worker counts the cacheable GETs it serves in memory and adds them to a redis
+sorted set of the day every VULMATCH_PROXY_HITS_FLUSH_INTERVAL seconds, so counting
+costs no redis call on most requests. Counts not flushed when a worker exits are lost,
+which is fine for picking the most requested paths.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from . import cache as proxy_cache
+from . import timing
+
+
+PROXY_HITS_KEY = 'vulmatch_api.proxy_hits'
+
+# days whose counts are kept, today included
+HIT_DAYS = 2
+
+
+class HitCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._flushed_at = time.monotonic()
+
+    def add(self, url):
+        """
+        Counts a hit, and tells whether the counts are due to be flushed.
+        """
+        with self._lock:
+            self._counts[url] += 1
+            return time.monotonic() - self._flushed_at >= settings.VULMATCH_PROXY_HITS_FLUSH_INTERVAL
+
+    def pop(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed_at = time.monotonic()
+            return counts
+
+
+hit_counter = HitCounter()
+
+
+def _get_day_key(day):
+    return f'{PROXY_HITS_KEY}:{day.isoformat()}'
+
+
+@timing.phase("cache")
+def flush():
+    counts = hit_counter.pop()
+    if not counts:
+        return
+    key = _get_day_key(date.today())
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        for url, count in counts.items():
+            pipeline.zincrby(key, count, url)
+        # only the most requested paths are worth keeping
+        pipeline.zremrangebyrank(key, 0, -settings.VULMATCH_PROXY_HITS_MAX_PATHS - 1)
+        pipeline.expire(key, HIT_DAYS * 24 * 60 * 60)
+        pipeline.execute()
+    except Exception:
+        logging.exception("could not record proxy hits")
+
+
+def record(path, params):
+    """
+    Counts a request for an upstream path and its query params (a QueryDict).
+    """
+    if hit_counter.add(proxy_cache.get_canonical_url(path, params)):
+        flush()
+
+
+aflush = sync_to_async(flush, thread_sensitive=False)
+
+
+async def arecord(path, params):
+    if hit_counter.add(proxy_cache.get_canonical_url(path, params)):
+        await aflush()
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_top_urls(count):
+    """
+    Returns the `count` most requested `path?query` urls of the last days, most
+    requested first.
+    """
+    if count <= 0:
+        return []
+    today = date.today()
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    for days in range(HIT_DAYS):
+        pipeline.zrevrange(_get_day_key(today - timedelta(days=days)), 0, count - 1, withscores=True)
+    totals = Counter()
+    for scores in pipeline.execute():
+        for url, score in scores:
+            totals[_decode(url)] += score
+    return [url for url, _ in totals.most_common(count)]
@@ -0,0 +1,85 @@
+"""
+Tracking of the upstream CVE download job that starts the daily ingest (see `tasks`).
+
+The job is polled after short delays that grow by VULMATCH_INGEST_POLL_BACKOFF, up to
+VULMATCH_INGEST_POLL_MAX_DELAY, rather than every five minutes. Once some jobs have
+finished, polls made well before the median duration of the last ones are pushed back
+towards it, so a long job isn't polled needlessly early.
+
+Anything watching upstream can also POST to the job callback endpoint when the job
+finishes, which polls it right away. The first poll to see the job finished moves the
+pipeline on; `finish` makes sure that only happens once per job.
+"""
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+INGEST_JOB_KEY = 'vulmatch_api.ingest_job'
+INGEST_JOB_DURATIONS_KEY = 'vulmatch_api.ingest_job_durations'
+
+# jobs are tracked for this long after they start, much longer than any of them runs
+JOB_TTL = 2 * 24 * 60 * 60
+# durations of the last jobs that are kept for the estimate
+DURATIONS_KEPT = 14
+
+
+def _get_job_key(job_id):
+    return f'{INGEST_JOB_KEY}:{job_id}'
+
+
+def start(job_id):
+    cache.set(_get_job_key(job_id), time.time(), timeout=JOB_TTL)
+
+
+def is_tracked(job_id):
+    return cache.get(_get_job_key(job_id)) is not None
+
+
+def is_finished(job_id):
+    return cache.get(f'{_get_job_key(job_id)}:finished') is not None
+
+
+def finish(job_id, state):
+    """
+    Marks a job finished, recording its duration if it completed, and tells whether
+    this caller is the first to do so (and so should move the pipeline on).
+    """
+    if not cache.add(f'{_get_job_key(job_id)}:finished', state, timeout=JOB_TTL):
+        return False
+    started_at = cache.get(_get_job_key(job_id))
+    if state == "completed" and started_at is not None:
+        record_duration(time.time() - started_at)
+    return True
+
+
+def record_duration(duration):
+    durations = cache.get(INGEST_JOB_DURATIONS_KEY, [])
+    cache.set(INGEST_JOB_DURATIONS_KEY, (durations + [duration])[-DURATIONS_KEPT:], timeout=None)
+
+
+def get_expected_duration():
+    """
+    Returns the median duration of the last jobs, or None before any finished.
+    """
+    durations = cache.get(INGEST_JOB_DURATIONS_KEY)
+    return statistics.median(durations) if durations else None
+
+
+def get_poll_delay(job_id, attempt):
+    """
+    Returns how long to wait before polling a job for the `attempt`th time (from 0).
+    """
+    delay = min(
+        settings.VULMATCH_INGEST_POLL_INITIAL_DELAY * settings.VULMATCH_INGEST_POLL_BACKOFF ** attempt,
+        settings.VULMATCH_INGEST_POLL_MAX_DELAY,
+    )
+    expected = get_expected_duration()
+    started_at = cache.get(_get_job_key(job_id))
+    if expected is None or started_at is None:
+        return delay
+    # wait until the job is close to done, judging by past jobs
+    remaining = expected * settings.VULMATCH_INGEST_POLL_ESTIMATE_FRACTION - (time.time() - started_at)
+    return max(delay, remaining)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from vulmatch_api import upstream
+from vulmatch_api.benchmark import summarize
+from vulmatch_api.stub_upstream import StubUpstreamProcess
+from vulmatch_api.views import AsyncOpenVulmatchProxyView, OpenVulmatchProxyView
+
+PATH = "/vulmatch_api/proxy/open/cve/objects/"
+
+
+class _BenchmarkUser:
+    is_authenticated = True
+    is_active = True
+
+
+def run_sync(total, concurrency):
+    view = OpenVulmatchProxyView.as_view()
+    factory = RequestFactory()
+
+    def call():
+        request = factory.get(PATH)
+        request.user = _BenchmarkUser()
+        start = time.perf_counter()
+        response = view(request)
+        b"".join(response.streaming_content if response.streaming else [response.content])
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: call(), range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, status in results if status == 200]
+    return dict(
+        summarize("sync", latencies, total - len(latencies), elapsed, concurrency),
+        statuses=dict(Counter(status for _, status in results)),
+    )
+
+
+def run_async(total, concurrency):
+    view = AsyncOpenVulmatchProxyView.as_view()
+    factory = AsyncRequestFactory()
+
+    async def call(semaphore):
+        async with semaphore:
+            request = factory.get(PATH)
+            request.user = _BenchmarkUser()
+            start = time.perf_counter()
+            response = await view(request)
+            if response.streaming:
+                async for _ in response.streaming_content:
+                    pass
+            return time.perf_counter() - start, response.status_code
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        try:
+            return await asyncio.gather(*(call(semaphore) for _ in range(total)))
+        finally:
+            await upstream.aclose_async_session()
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, status in results if status == 200]
+    return dict(
+        summarize("async", latencies, total - len(latencies), elapsed, concurrency),
+        statuses=dict(Counter(status for _, status in results)),
+    )
+
+
+class Command(BaseCommand):
+    help = "Compare the sync and async proxy views against a local stub upstream"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--latency", type=float, default=0.05, help="upstream latency in seconds")
+        parser.add_argument("--json", action="store_true", help="print results as JSON")
+
+    def handle(self, *args, **options):
+        with StubUpstreamProcess(latency=options["latency"]) as stub:
+            with override_settings(VULMATCH_SERVICE_BASE_URL=stub.base_url):
+                results = [
+                    run_sync(options["requests"], options["concurrency"]),
+                    run_async(options["requests"], options["concurrency"]),
+                ]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                "{mode:>5}: {throughput_rps} req/s, p50 {p50_ms}ms, p95 {p95_ms}ms, "
+                "p99 {p99_ms}ms, {errors} errors ({requests} requests, concurrency {concurrency})".format(**result)
+            )
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from vulmatch_api import benchmark, upstream
+from vulmatch_api import cache as proxy_cache
+from vulmatch_api.stub_upstream import PayloadStubUpstreamHandler, StubUpstreamProcess
+
+# request mix, as `(weight, path)`; `{cve_id}` and `{cpe_name}` are drawn from a pool of ids
+DEFAULT_MIX = [
+    (4, "cve/objects/{cve_id}/"),
+    (2, "cve/objects/{cve_id}/bundle/"),
+    (2, "cpe/objects/{cpe_name}/"),
+    (1, "cve/objects/?page={page}"),
+    (1, "cpe/objects/?page={page}"),
+]
+
+
+def get_paths(total, ids, seed):
+    """
+    Returns `total` proxy paths drawn from the request mix, the same ones for a given seed.
+    """
+    rng = random.Random(seed)
+    weights, templates = zip(*DEFAULT_MIX)
+    paths = []
+    for template in rng.choices(templates, weights, k=total):
+        i = rng.randrange(ids)
+        path = template.format(
+            cve_id=f"CVE-{2000 + i % 25}-{i:05d}",
+            cpe_name=f"cpe:2.3:a:vendor{i % 997}:product{i}:1.0:*:*:*:*:*:*:*",
+            page=i % 20 + 1,
+        )
+        paths.append(f"/vulmatch_api/api/v1/{path}")
+    return paths
+
+
+def _consume(response):
+    if not response.streaming:
+        return
+    for _ in response.streaming_content:
+        pass
+
+
+async def _aconsume(response):
+    if not response.streaming:
+        return
+    async for _ in response.streaming_content:
+        pass
+
+
+def run_sync(paths, concurrency, api_key):
+    local = threading.local()
+
+    def call(path):
+        if not hasattr(local, "client"):
+            local.client = Client(headers={"API-KEY": api_key})
+        start = time.perf_counter()
+        response = local.client.get(path)
+        _consume(response)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, paths))
+    return results, time.perf_counter() - start
+
+
+def run_async(paths, concurrency, api_key):
+    client = AsyncClient(headers={"API-KEY": api_key})
+
+    async def call(semaphore, path):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(path)
+            await _aconsume(response)
+            return time.perf_counter() - start, response.status_code
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        try:
+            return await asyncio.gather(*(call(semaphore, path) for path in paths))
+        finally:
+            await upstream.aclose_async_session()
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the API-key proxy routes with a mix of CVE, CPE and bundle requests at each "
+        "concurrency level, against a local stub upstream serving realistic payloads, and "
+        "report throughput, latency percentiles and RSS. Requests go through the whole "
+        "middleware stack, with the sync or async views as per VULMATCH_PROXY_ASYNC."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--api-key", required=True, help="team API key to send the requests with")
+        parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+        parser.add_argument("--ids", type=int, default=500, help="number of distinct CVEs and CPEs requested")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--latency", type=float, default=0.05, help="median upstream latency in seconds")
+        parser.add_argument("--latency-sigma", type=float, default=0.5,
+                            help="sigma of the log-normal upstream latency (0 for a constant latency)")
+        parser.add_argument("--description-size", type=int, default=PayloadStubUpstreamHandler.description_size,
+                            help="median length of object descriptions")
+        parser.add_argument("--bundle-size", type=int, default=PayloadStubUpstreamHandler.bundle_size,
+                            help="median number of objects in a CVE bundle")
+        parser.add_argument("--no-cache", action="store_true", help="disable the proxy cache")
+        parser.add_argument("--cold-cache", action="store_true",
+                            help="invalidate the proxy cache before each level (don't use on a shared redis)")
+        parser.add_argument("--output", help="also write the results as JSON to this file")
+        parser.add_argument("--json", action="store_true", help="print results as JSON")
+
+    def handle(self, *args, **options):
+        handler_class = type("BenchmarkStubUpstreamHandler", (PayloadStubUpstreamHandler,), {
+            "description_size": options["description_size"],
+            "bundle_size": options["bundle_size"],
+        })
+        mode = "async" if settings.VULMATCH_PROXY_ASYNC else "sync"
+        run = run_async if settings.VULMATCH_PROXY_ASYNC else run_sync
+        levels = []
+        with StubUpstreamProcess(handler_class, options["latency"], options["latency_sigma"]) as stub:
+            with override_settings(
+                VULMATCH_SERVICE_BASE_URL=stub.base_url,
+                VULMATCH_PROXY_CACHE_ENABLED=settings.VULMATCH_PROXY_CACHE_ENABLED and not options["no_cache"],
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            ):
+                for concurrency in options["concurrency"]:
+                    if options["cold_cache"]:
+                        proxy_cache.bump_generation()
+                    paths = get_paths(options["requests"], options["ids"], options["seed"])
+                    results, elapsed = run(paths, concurrency, options["api_key"])
+                    latencies = [latency for latency, status in results if status == 200]
+                    result = benchmark.summarize(mode, latencies, len(results) - len(latencies), elapsed, concurrency)
+                    result["rss_mb"] = benchmark.get_rss_mb()
+                    result["peak_rss_mb"] = benchmark.get_peak_rss_mb()
+                    levels.append(result)
+
+        report = {
+            "commit": benchmark.get_commit(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                name: options[name]
+                for name in ("requests", "ids", "seed", "latency", "latency_sigma", "description_size",
+                             "bundle_size", "no_cache", "cold_cache")
+            },
+            "results": levels,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for result in levels:
+            self.stdout.write(
+                "{mode:>5} x{concurrency}: {throughput_rps} req/s, p50 {p50_ms}ms, p95 {p95_ms}ms, "
+                "p99 {p99_ms}ms, rss {rss_mb}MiB (peak {peak_rss_mb}MiB), {errors} errors "
+                "({requests} requests)".format(**result)
+            )
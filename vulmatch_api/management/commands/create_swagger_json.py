@@ -1,13 +1,56 @@
-# your_app/management/commands/your_command.py
-import os
+import copy
 import json
+import os
+
 import requests
 import yaml
-
-from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vulmatch_api.schema import read_schema_document, store_schema_documents
+from vulmatch_api.signals import schema_changed
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'templates', 'vulmatch_api')
+
+# drf-spectacular serves JSON when asked, which parses much faster than YAML
+SCHEMA_ACCEPT = "application/vnd.oai.openapi+json, application/json;q=0.9, */*;q=0.1"
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def fetch_upstream_schema():
+    """
+    Fetches and parses the upstream schema once, for every generator.
+    """
+    res = requests.get(
+        settings.VULMATCH_SERVICE_BASE_URL + '/api/schema/',
+        params={"format": "json"},
+        headers={"Accept": SCHEMA_ACCEPT},
+        timeout=settings.VULMATCH_UPSTREAM_READ_TIMEOUT,
+    )
+    res.raise_for_status()
+    if "json" in res.headers.get("Content-Type", ""):
+        return res.json()
+    return yaml.load(res.text, Loader=YAML_LOADER)
 
-VULMATCH_SERVICE_BASE_URL = settings.VULMATCH_SERVICE_BASE_URL
+
+def get_operations(document):
+    return {
+        f"{method.upper()} {path}": operation
+        for path, methods in (document or {}).get("paths", {}).items()
+        for method, operation in methods.items()
+    }
+
+
+def get_changed_operations(old, new):
+    """
+    Returns the "METHOD path"s added, removed or changed between two schema documents.
+    """
+    old_operations, new_operations = get_operations(old), get_operations(new)
+    return {
+        name
+        for name in old_operations.keys() | new_operations.keys()
+        if old_operations.get(name) != new_operations.get(name)
+    }
 
 
 class VulmatchSchemaGenerator():
@@ -23,11 +66,10 @@ class VulmatchSchemaGenerator():
         return path_dict
 
     def get_schema_filename(self):
-        return os.path.join('vulmatch_api', 'templates', 'vulmatch_api', 'schema.json')
+        return os.path.join(SCHEMA_DIR, 'schema.json')
 
-    def generate(self):
-        res = requests.get(VULMATCH_SERVICE_BASE_URL + '/api/schema/')
-        data_json = yaml.safe_load(res.text)
+    def build(self, data_json):
+        data_json = copy.deepcopy(data_json)
         data_json["paths"] = self.get_paths(data_json)
         data_json['components']['securitySchemes'] = {
             'api_key': {
@@ -39,10 +81,31 @@ class VulmatchSchemaGenerator():
         data_json['security'] = [{
             'api_key': []
         }]
+        return data_json
+
+    def read(self):
+        try:
+            return read_schema_document(self.get_schema_filename())
+        except (OSError, ValueError):
+            return None
+
+    def generate(self, data_json=None):
+        """
+        Writes the schema file, and shares it with the web processes (see
+        `schema.read_schema_document`), if the upstream schema `data_json` (fetched if
+        not given) changed it, and returns the operations that changed.
+        """
+        if data_json is None:
+            data_json = fetch_upstream_schema()
+        document = self.build(data_json)
+        current = self.read()
+        if document == current:
+            return set()
 
-        schema_filename = self.get_schema_filename()
-        with open(schema_filename, 'w') as file:
-            file.write(json.dumps(data_json))
+        with open(self.get_schema_filename(), 'w') as file:
+            file.write(json.dumps(document))
+        store_schema_documents({self.get_schema_filename(): document})
+        return get_changed_operations(current, document)
 
 
 class AdminVulmatchSchemaGenerator(VulmatchSchemaGenerator):
@@ -58,14 +121,31 @@ class AdminVulmatchSchemaGenerator(VulmatchSchemaGenerator):
         return path_dict
 
     def get_schema_filename(self):
-        return os.path.join('vulmatch_api', 'templates', 'vulmatch_api', 'admin-schema.json')
-    
-        
+        return os.path.join(SCHEMA_DIR, 'admin-schema.json')
+
+
+def sync_schemas():
+    """
+    Syncs the user and admin schema files with a single fetch of the upstream schema,
+    and sends `schema_changed` if any of their operations changed. Returns the changed
+    operations of each file.
+    """
+    data_json = fetch_upstream_schema()
+    changes = {
+        generator.get_schema_filename(): generator.generate(data_json)
+        for generator in (VulmatchSchemaGenerator(), AdminVulmatchSchemaGenerator())
+    }
+    changed = set().union(*changes.values())
+    if changed:
+        schema_changed.send(sender=sync_schemas, operations=changed)
+    return changes
+
+
 class Command(BaseCommand):
-    
+    help = "Sync the user and admin API schemas with the upstream one, rewriting them only if they changed"
+
     def handle(self, *args, **kwargs):
-        print("Generating User Schema")
-        VulmatchSchemaGenerator().generate()
-        
-        print("Generating Admin Schema")
-        AdminVulmatchSchemaGenerator().generate()
+        for filename, changed in sync_schemas().items():
+            self.stdout.write(f"{os.path.basename(filename)}: {len(changed)} operations changed")
+            for operation in sorted(changed):
+                self.stdout.write(f"  {operation}")
@@ -0,0 +1,216 @@
+"""
+Prometheus metrics of the Vulmatch proxy and of the ingest pipeline.
+
+Paths are labelled with their upstream route template (`cve/objects/{cve_id}/`, from the
+admin schema, which covers every upstream route) rather than the raw path, so the number
+of series stays bounded; paths the schema doesn't know are labelled `other`.
+
+Under gunicorn or celery each process has its own metrics. Set PROMETHEUS_MULTIPROC_DIR
+to a directory shared by the processes of a host (and empty when they start) so the
+metrics endpoint reports all of them, see `get_registry`.
+
+Celery workers (and so the task durations) usually run in containers of their own, which
+the web processes' metrics endpoint can't see into. Set VULMATCH_WORKER_METRICS_PORT to
+have the main process of each worker serve the metrics of its pool on that port, and
+scrape it next to the web's metrics endpoint. With the prefork pool, give the worker its
+own PROMETHEUS_MULTIPROC_DIR so the main process sees what its children record.
+"""
+import functools
+import os
+import re
+import threading
+import time
+
+from celery import signals
+from django.conf import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    start_http_server,
+    REGISTRY,
+)
+from prometheus_client import multiprocess
+
+from .cache import normalize_path
+from .schema import get_schema_version, read_schema_document
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'vulmatch_api', 'admin-schema.json')
+SCHEMA_PATH_PREFIX = '/vulmatch_api/admin/api/v1/'
+OTHER_ROUTE = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+request_duration = Histogram(
+    "vulmatch_proxy_request_duration_seconds",
+    "Time taken by the proxy to answer, until the response (or its first byte) is returned.",
+    ["view", "route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+request_bytes = Counter(
+    "vulmatch_proxy_request_bytes",
+    "Bytes of request bodies received by the proxy.",
+    ["view", "route"],
+)
+response_bytes = Counter(
+    "vulmatch_proxy_response_bytes",
+    "Bytes of response bodies sent by the proxy, as encoded on the wire.",
+    ["view", "route"],
+)
+auth_duration = Histogram(
+    "vulmatch_proxy_auth_duration_seconds",
+    "Time taken to authenticate a proxied request.",
+    ["view"],
+    buckets=LATENCY_BUCKETS,
+)
+cache_requests = Counter(
+    "vulmatch_proxy_cache_requests",
+    "Lookups of the proxy response cache, by result (hit or miss).",
+    ["route", "result"],
+)
+upstream_duration = Histogram(
+    "vulmatch_upstream_request_duration_seconds",
+    "Time taken by the Vulmatch service to answer, until its headers are received.",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+task_duration = Histogram(
+    "vulmatch_task_duration_seconds",
+    "Time taken by celery tasks, such as the steps of the ingest pipeline.",
+    ["task", "state"],
+    buckets=TASK_BUCKETS,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def get_route_patterns(schema_version):
+    schema = read_schema_document(SCHEMA_PATH)
+    patterns = []
+    for path in schema.get("paths", {}):
+        if not path.startswith(SCHEMA_PATH_PREFIX):
+            continue
+        template = path[len(SCHEMA_PATH_PREFIX):]
+        pattern = re.sub(r"\\\{[^}]+\\\}", "[^/]+", re.escape(template))
+        patterns.append((re.compile(pattern), template))
+    return patterns
+
+
+def get_route(path):
+    """
+    Returns the route template of an upstream path, following the last synced schema.
+    """
+    return _get_route(path, get_schema_version())
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_route(path, schema_version):
+    path = normalize_path(path)
+    for pattern, template in get_route_patterns(schema_version):
+        if pattern.fullmatch(path):
+            return template
+    return OTHER_ROUTE
+
+
+def get_upstream_route(url):
+    prefix = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/"
+    return get_route(url[len(prefix):]) if url.startswith(prefix) else OTHER_ROUTE
+
+
+def observe_upstream(method, url, status, elapsed):
+    upstream_duration.labels(get_upstream_route(url), method, status).observe(elapsed)
+
+
+def observe_cache(path, hit):
+    cache_requests.labels(get_route(path), "hit" if hit else "miss").inc()
+
+
+class observe_auth:
+    """
+    Context manager timing the authentication of a request to `view`.
+    """
+
+    def __init__(self, view):
+        self.view = view
+
+    def __enter__(self):
+        self.start = time.monotonic()
+
+    def __exit__(self, *args):
+        auth_duration.labels(self.view).observe(time.monotonic() - self.start)
+
+
+def _count_bytes(content, counter):
+    for chunk in content:
+        counter.inc(len(chunk))
+        yield chunk
+
+
+async def _acount_bytes(content, counter):
+    async for chunk in content:
+        counter.inc(len(chunk))
+        yield chunk
+
+
+def observe_response(view, path, request, response, elapsed):
+    route = get_route(path)
+    request_duration.labels(view, route, request.method, response.status_code).observe(elapsed)
+    request_bytes.labels(view, route).inc(int(request.META.get("CONTENT_LENGTH") or 0))
+    counter = response_bytes.labels(view, route)
+    if not response.streaming:
+        counter.inc(len(response.content))
+    elif response.is_async:
+        response.streaming_content = _acount_bytes(response.streaming_content, counter)
+    else:
+        response.streaming_content = _count_bytes(response.streaming_content, counter)
+    return response
+
+
+_task_starts = {}
+_task_starts_lock = threading.Lock()
+
+
+@signals.task_prerun.connect
+def _on_task_prerun(task_id=None, **kwargs):
+    with _task_starts_lock:
+        _task_starts[task_id] = time.monotonic()
+
+
+@signals.task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    with _task_starts_lock:
+        start = _task_starts.pop(task_id, None)
+    if start is not None:
+        task_duration.labels(task.name, state or "UNKNOWN").observe(time.monotonic() - start)
+
+
+@signals.worker_init.connect
+def _on_worker_init(**kwargs):
+    # in the worker's main process, once whatever the pool, rather than in each (forked)
+    # pool process, which couldn't all listen on the port
+    if settings.VULMATCH_WORKER_METRICS_PORT:
+        start_http_server(settings.VULMATCH_WORKER_METRICS_PORT, registry=get_registry())
+
+
+@signals.worker_process_shutdown.connect
+def _on_worker_process_shutdown(pid=None, **kwargs):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def get_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def export():
+    """
+    Returns `(body, content_type)` of the metrics in the Prometheus text format.
+    """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
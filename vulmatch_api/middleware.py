@@ -0,0 +1,95 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, timing
+
+
+# url names of the proxy views, which are the ones measured
+PROXY_URL_NAMES = ("proxy", "admin-proxy", "open-proxy")
+
+
+def get_proxied_path(request):
+    match = request.resolver_match
+    if match is None or match.url_name not in PROXY_URL_NAMES:
+        return None
+    if "path" in match.kwargs:
+        return match.kwargs["path"]
+    return request.path.split("proxy/open/", 1)[1]
+
+
+class ProxyMetricsMiddleware:
+    """
+    Records the duration, status and size of every response of the proxy views, see
+    `metrics`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.monotonic()
+        response = self.get_response(request)
+        return self.observe(request, response, start)
+
+    async def __acall__(self, request):
+        start = time.monotonic()
+        response = await self.get_response(request)
+        return self.observe(request, response, start)
+
+    def observe(self, request, response, start):
+        path = get_proxied_path(request)
+        if path is None:
+            return response
+        elapsed = time.monotonic() - start
+        return metrics.observe_response(request.resolver_match.url_name, path, request, response, elapsed)
+
+
+def _is_staff(user):
+    # requests turned away by an earlier middleware have no user
+    return user is not None and user.is_staff
+
+
+class ServerTimingMiddleware:
+    """
+    Sends the time spent in each phase of a request (see `timing`) in a `Server-Timing`
+    header, to everyone or only to staff users depending on VULMATCH_SERVER_TIMING.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if settings.VULMATCH_SERVER_TIMING not in ("all", "staff"):
+            return self.get_response(request)
+        timings = timing.start()
+        response = self.get_response(request)
+        if settings.VULMATCH_SERVER_TIMING == "all" or _is_staff(getattr(request, "user", None)):
+            response["Server-Timing"] = timings.get_header()
+        return response
+
+    async def __acall__(self, request):
+        if settings.VULMATCH_SERVER_TIMING not in ("all", "staff"):
+            return await self.get_response(request)
+        timings = timing.start()
+        response = await self.get_response(request)
+        if settings.VULMATCH_SERVER_TIMING == "all" or (
+            hasattr(request, "auser") and _is_staff(await request.auser())
+        ):
+            response["Server-Timing"] = timings.get_header()
+        return response
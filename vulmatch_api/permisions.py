@@ -1,22 +1,62 @@
 import typing
 
+from django.conf import settings
 from django.http import HttpRequest
+from rest_framework.permissions import BasePermission
 from rest_framework_api_key.permissions import BaseHasAPIKey
 
 from apps.api.models import UserAPIKey
 from apps.teams.models import TeamApiKey
-from apps.teams.helpers import get_team_from_request
+from apps.teams.helpers import aget_team_from_request, get_team_from_request
+
+from . import timing
 
 
 class HasTeamApiKey(BaseHasAPIKey):
     model = TeamApiKey
 
+    @timing.phase("auth")
     def has_permission(self, request: HttpRequest, view: typing.Any) -> bool:
-        has_perm = super().has_permission(request, view)
-        print(has_perm)
-        if has_perm:
-            team = get_team_from_request(request)
-            view.team = team
-            request.team = team
+        # verifies the key itself (through the verified key cache) rather than calling
+        # super(), which would hash it a second time
+        if not self.get_key(request):
+            return False
+        if getattr(request, "team_api_key", None):
+            # already checked for this request
             return True
-        return has_perm
+        team = get_team_from_request(request)
+        view.team = team
+        request.team = team
+        return True
+
+    @timing.phase("auth")
+    async def ahas_permission(self, request: HttpRequest, view: typing.Any) -> bool:
+        """
+        Async version of `has_permission` for the ASGI proxy views.
+        """
+        if not self.get_key(request):
+            return False
+        team = await aget_team_from_request(request)
+        view.team = team
+        request.team = team
+        return True
+
+
+class HasHealthCheckToken(BasePermission):
+    """
+    Allows requests carrying one of `HEALTH_CHECK_TOKENS` in their `token` query param.
+    """
+
+    def has_permission(self, request, view):
+        token = request.query_params.get("token")
+        return bool(token) and token in settings.HEALTH_CHECK_TOKENS
+
+
+class HasIngestCallbackToken(BasePermission):
+    """
+    Allows requests carrying one of `VULMATCH_INGEST_CALLBACK_TOKENS` in their `token` query param.
+    """
+
+    def has_permission(self, request, view):
+        token = request.query_params.get("token")
+        return bool(token) and token in settings.VULMATCH_INGEST_CALLBACK_TOKENS
@@ -0,0 +1,127 @@
+"""
+Canonical query params for proxied GETs.
+
+Logically identical queries are rewritten to the same params before they are used as a
+cache key or sent upstream, following the parameters the upstream schema
+(`templates/vulmatch_api/schema.json`) declares for the route:
+
+* every value of a repeated param is kept;
+* params are sorted by name;
+* empty values, and values equal to the param's default, are dropped;
+* the items of array params are sorted and deduplicated. Those the schema declares with
+  `explode: false` are sent as one comma separated value, the others repeated.
+
+Params of routes, or names, the schema doesn't know are only sorted and stripped of
+empty values.
+"""
+import functools
+import os
+import re
+
+from django.conf import settings
+from django.http import QueryDict
+
+from .cache import normalize_path
+from .schema import get_schema_version, read_schema_document
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'vulmatch_api', 'schema.json')
+SCHEMA_PATH_PREFIX = '/vulmatch_api/api/v1/'
+
+# defaults of the upstream pagination, which the schema doesn't declare
+PAGINATION_DEFAULTS = {"page": "1"}
+
+# commas separate the items of an unexploded array, unless escaped (as in CPE names)
+ITEM_SEPARATOR = re.compile(r"(?<!\\),")
+
+
+def _format_default(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return ",".join(_format_default(item) for item in value)
+    return str(value)
+
+
+def _get_param_spec(parameter):
+    schema = parameter.get("schema", {})
+    default = schema.get("default")
+    if default is None:
+        default = PAGINATION_DEFAULTS.get(parameter["name"])
+    return {
+        "array": schema.get("type") == "array",
+        # form style arrays are exploded unless the schema says otherwise
+        "explode": parameter.get("explode", True),
+        "default": None if default is None else _format_default(default),
+    }
+
+
+def get_routes():
+    """
+    Returns `(path regex, {param name: spec})` for the GET routes of the upstream schema,
+    as last synced (see `schema.read_schema_document`).
+    """
+    return _get_routes(get_schema_version())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_routes(schema_version):
+    schema = read_schema_document(SCHEMA_PATH)
+    routes = []
+    for path, operations in schema.get("paths", {}).items():
+        operation = operations.get("get")
+        if not operation or not path.startswith(SCHEMA_PATH_PREFIX):
+            continue
+        pattern = re.sub(r"\\\{[^}]+\\\}", "[^/]+", re.escape(path[len(SCHEMA_PATH_PREFIX):]))
+        specs = {
+            parameter["name"]: _get_param_spec(parameter)
+            for parameter in operation.get("parameters", [])
+            if parameter.get("in") == "query"
+        }
+        routes.append((re.compile(pattern), specs))
+    return routes
+
+
+def get_param_specs(path):
+    path = normalize_path(path)
+    for pattern, specs in get_routes():
+        if pattern.fullmatch(path):
+            return specs
+    return {}
+
+
+def _normalize_values(values, spec):
+    if not spec or not spec["array"]:
+        values = [value for value in values if value != ""]
+        if spec and values == [spec["default"]]:
+            return []
+        return values
+    items = []
+    for value in values:
+        items += ITEM_SEPARATOR.split(value) if not spec["explode"] else [value]
+    items = sorted(set(item for item in items if item != ""))
+    if not items or ",".join(items) == spec["default"]:
+        return []
+    return items if spec["explode"] else [",".join(items)]
+
+
+def normalize(path, params):
+    """
+    Returns the canonical form of query `params` (a QueryDict) for an upstream `path`.
+    """
+    if not settings.VULMATCH_PROXY_NORMALIZE_QUERY:
+        return params
+    specs = get_param_specs(path)
+    normalized = QueryDict(mutable=True)
+    for key in sorted(params):
+        values = _normalize_values(params.getlist(key), specs.get(key))
+        if values:
+            normalized.setlist(key, values)
+    return normalized
+
+
+def get_pairs(params):
+    """
+    Returns `(key, value)` pairs of a QueryDict, one per value, to send upstream.
+    """
+    return [(key, value) for key, values in params.lists() for value in values]
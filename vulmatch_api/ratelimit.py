@@ -0,0 +1,165 @@
+"""
+Per-team rate limits and daily quotas for the API-key proxy.
+
+Limits come from the team's plan (see `Team.get_api_limits`), as cached with the
+verified API key (see `verify_team_api_key`). A key counts against the team it belongs
+to, so creating more keys doesn't raise a team's limits. Both checks run in a single
+Lua script. If redis can't be reached, requests are let through.
+"""
+import dataclasses
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django_redis import get_redis_connection
+
+from . import timing
+
+
+RATE_LIMIT_CACHE_KEY = 'vulmatch_api.rate_limit'
+
+# KEYS: token bucket hash, daily quota counter
+# ARGV: refill rate (tokens per second), burst, now, cost, daily quota, seconds until the quota resets
+# returns: allowed, tokens left, quota used
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local quota = tonumber(ARGV[5])
+local quota_ttl = tonumber(ARGV[6])
+
+local allowed = 1
+local tokens = burst
+if rate > 0 then
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        allowed = 0
+    end
+end
+
+local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+if quota > 0 and used + cost > quota then
+    allowed = 0
+end
+
+if allowed == 1 then
+    if rate > 0 then
+        tokens = tokens - cost
+    end
+    if quota > 0 then
+        used = redis.call('INCRBY', KEYS[2], cost)
+        if used == cost then
+            redis.call('EXPIRE', KEYS[2], quota_ttl)
+        end
+    end
+end
+if rate > 0 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.max(1, math.ceil(burst / rate)) + 1)
+end
+return {allowed, tostring(tokens), used}
+"""
+
+_script = None
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = get_redis_connection("default").register_script(TOKEN_BUCKET_SCRIPT)
+    return _script
+
+
+@dataclasses.dataclass
+class RateLimitResult:
+    allowed: bool
+    # the limit closest to being exhausted, as sent in the RateLimit-* headers
+    limit: int
+    remaining: int
+    reset: int
+    policy: str
+    retry_after: Optional[int] = None
+
+
+def _get_seconds_until_midnight(now):
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return math.ceil((tomorrow - now).total_seconds())
+
+
+def evaluate(limits, tokens, used, allowed, cost, quota_reset):
+    """
+    Turns the state left by the script into a `RateLimitResult`.
+    """
+    rate = limits["rate_limit"] / 60
+    burst, quota = limits["burst"], limits["daily_quota"]
+    candidates, policy = [], []
+    if rate:
+        candidates.append((
+            burst,
+            max(0, math.floor(tokens)),
+            math.ceil((burst - tokens) / rate),
+            math.ceil((cost - tokens) / rate) if tokens < cost else None,
+        ))
+        policy.append(f"{limits['rate_limit']};w=60;burst={burst}")
+    if quota:
+        candidates.append((quota, max(0, quota - used), quota_reset, quota_reset if used + cost > quota else None))
+        policy.append(f"{quota};w=86400")
+    limit, remaining, reset, _ = min(candidates, key=lambda candidate: candidate[1])
+    retry_after = None
+    if not allowed:
+        retry_after = max(candidate[3] or 0 for candidate in candidates) or 1
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=remaining,
+        reset=reset,
+        policy=", ".join(policy),
+        retry_after=retry_after,
+    )
+
+
+@timing.phase("cache")
+def consume(team_api_key, cost=1):
+    """
+    Charges `cost` requests to the team of a verified API key, and returns a
+    `RateLimitResult`, or None if the team is unlimited or the limits couldn't be checked.
+    """
+    team_id, limits = team_api_key["team_id"], team_api_key["api_limits"]
+    try:
+        if not limits["rate_limit"] and not limits["daily_quota"]:
+            return None
+        now = datetime.now(timezone.utc)
+        quota_reset = _get_seconds_until_midnight(now)
+        allowed, tokens, used = _get_script()(
+            keys=[
+                f"{RATE_LIMIT_CACHE_KEY}:bucket:{team_id}",
+                f"{RATE_LIMIT_CACHE_KEY}:quota:{team_id}:{now.date().isoformat()}",
+            ],
+            args=[limits["rate_limit"] / 60, limits["burst"], time.time(), cost, limits["daily_quota"], quota_reset],
+        )
+    except Exception:
+        logging.exception("could not check rate limit")
+        return None
+    return evaluate(limits, float(tokens), int(used), bool(allowed), cost, quota_reset)
+
+
+aconsume = sync_to_async(consume, thread_sensitive=False)
+
+
+def set_headers(response, result: RateLimitResult):
+    if result is None:
+        return response
+    response["RateLimit-Limit"] = str(result.limit)
+    response["RateLimit-Remaining"] = str(result.remaining)
+    response["RateLimit-Reset"] = str(result.reset)
+    response["RateLimit-Policy"] = result.policy
+    if result.retry_after:
+        response["Retry-After"] = str(result.retry_after)
+    return response
@@ -1,5 +1,15 @@
+import functools
+import gzip
+import hashlib
 import json
-from django.http import JsonResponse
+import logging
+import threading
+import time
+import drf_spectacular
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import URLResolver, get_resolver
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.views import View
 import os
 from importlib import import_module
@@ -14,6 +24,23 @@ from drf_spectacular.renderers import (
 )
 from drf_spectacular.views import SpectacularSwaggerView
 
+from .helpers import get_accepted_encodings, get_representation_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'vulmatch_api')
+ADMIN_SCHEMA_FRAGMENT_CACHE_KEY = 'vulmatch_api.admin_schema_fragment'
+ADMIN_SCHEMA_FRAGMENT_TTL = 7 * 24 * 60 * 60
+# upstream schema documents synced by create_swagger_json, shared by every process, and
+# their version, bumped when any of them changes
+SCHEMA_DOCUMENT_CACHE_KEY = 'vulmatch_api.schema_document'
+SCHEMA_VERSION_CACHE_KEY = 'vulmatch_api.schema_version'
+# how often (in seconds) each process looks for schema changes made elsewhere
+SCHEMA_CHECK_INTERVAL = 5
+
 
 def merge_components(comp1, comp2):
     merged = comp1.copy()
@@ -48,53 +75,218 @@ def merge_paths(paths1, paths2):
     return merged
 
 
-def extract_paths_and_schemas(openapi_data):
-    # Extract paths
-    paths = openapi_data.get('paths', {})
-
-    # Initialize a dictionary to store the paths and their corresponding schemas
-    path_schemas = {}
-
-    for path, methods in paths.items():
-        for method, details in methods.items():
-            response_schemas = {}
-            responses = details.get('responses', {})
-            for status_code, response in responses.items():
-                content = response.get('content', {})
-                for media_type, media_details in content.items():
-                    schema = media_details.get('schema', {})
-                    if '$ref' in schema:
-                        ref = schema['$ref']
-                        response_schemas[status_code] = ref
-                        path_schemas[ref] = True
-
-    return path_schemas
+REF_PREFIX = '#/components/'
 
+# component sections only ever used through `$ref`s, which can be pruned
+REFERENCED_SECTIONS = (
+    'schemas', 'responses', 'parameters', 'examples', 'requestBodies', 'headers', 'links', 'callbacks',
+)
 
-def find_unresolved_references(schemas):
-    # Gather all component refs
-    components = schemas
-    resolved_refs = set(components.keys())
-    results = set()
 
-    # A function to recursively check for refs in the paths
-    def check_refs(obj):
+def iter_refs(obj):
+    """
+    Yields every `#/components/...` reference found in `obj`, including the ones of
+    discriminator mappings.
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
         if isinstance(obj, dict):
             for key, value in obj.items():
-                if key == '$ref':
-                    if value.split('/')[-1] not in resolved_refs:
-                        print(f"Unresolved reference: {value}")
-                        results.add(value)
-                else:
-                    check_refs(value)
+                if key == '$ref' and isinstance(value, str):
+                    if value.startswith(REF_PREFIX):
+                        yield value
+                    continue
+                if key == 'mapping' and isinstance(value, dict):
+                    yield from (ref for ref in value.values() if isinstance(ref, str) and ref.startswith(REF_PREFIX))
+                stack.append(value)
         elif isinstance(obj, list):
-            for item in obj:
-                check_refs(item)
+            stack.extend(obj)
+
+
+def parse_ref(ref):
+    """
+    Returns `(section, name)` for a `#/components/<section>/<name>` reference.
+    """
+    section, _, name = ref[len(REF_PREFIX):].partition('/')
+    return section, name.replace('~1', '/').replace('~0', '~')
+
+
+class ComponentGraph:
+    """
+    Which components each component references, indexed once, so the components
+    reachable from a set of operations can be found in time linear in the graph.
+    """
+
+    def __init__(self, components):
+        self.components = components
+        self.edges = {}
+        for section in REFERENCED_SECTIONS:
+            for name, component in components.get(section, {}).items():
+                self.edges[(section, name)] = {parse_ref(ref) for ref in iter_refs(component)}
+
+    def get_closure(self, refs):
+        """
+        Returns the `(section, name)` of every component `refs` lead to, transitively.
+        References to components that don't exist are ignored.
+        """
+        reachable = set()
+        pending = [parse_ref(ref) for ref in refs]
+        while pending:
+            node = pending.pop()
+            if node in reachable or node not in self.edges:
+                continue
+            reachable.add(node)
+            pending.extend(self.edges[node])
+        return reachable
+
+    def prune(self, paths):
+        """
+        Returns the components with only the ones used by `paths` (in parameters, request
+        bodies, responses or anything else of their operations), and what they use.
+        """
+        reachable = self.get_closure(iter_refs(paths))
+        components = dict(self.components)
+        for section in REFERENCED_SECTIONS:
+            if section in components:
+                components[section] = {
+                    name: component
+                    for name, component in components[section].items()
+                    if (section, name) in reachable
+                }
+        return components
+
+
+class EncodedSchema:
+    """
+    A schema document encoded once, with a content-hash ETag and compressed copies of
+    its body, so serving it is only a matter of picking one.
+    """
+
+    def __init__(self, document):
+        self.body = json.dumps(document).encode()
+        self.etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+        self.encoded = {"gzip": gzip.compress(self.body, mtime=0)}
+        if brotli:
+            self.encoded["br"] = brotli.compress(self.body)
+
+    def get_response(self, request):
+        accepted = get_accepted_encodings(request)
+        content_encoding = next((coding for coding in ("br", "gzip") if coding in self.encoded and coding in accepted), "")
+        etag = get_representation_etag(self.etag, content_encoding)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(self.encoded.get(content_encoding, self.body), content_type="application/json")
+            if content_encoding:
+                response["Content-Encoding"] = content_encoding
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+
+def _get_document_key(schema_path):
+    return f'{SCHEMA_DOCUMENT_CACHE_KEY}:{os.path.basename(schema_path)}'
+
+
+_schema_version = None
+
+
+def get_schema_version():
+    """
+    Returns the shared schema version, read from the cache at most every
+    SCHEMA_CHECK_INTERVAL seconds.
+    """
+    global _schema_version
+    now = time.monotonic()
+    if _schema_version is None or now - _schema_version[0] >= SCHEMA_CHECK_INTERVAL:
+        try:
+            version = cache.get(SCHEMA_VERSION_CACHE_KEY)
+        except Exception:
+            logging.exception("could not read schema version from cache")
+            version = _schema_version and _schema_version[1]
+        _schema_version = (now, version)
+    return _schema_version[1]
+
+
+def read_schema_document(schema_path):
+    """
+    Returns the last synced version of a schema document, or the one shipped in
+    `schema_path` if it was never synced.
+
+    Syncs run on the task workers, whose files web processes can't see, so the synced
+    documents are kept in the shared cache (see `store_schema_documents`).
+    """
+    try:
+        document = cache.get(_get_document_key(schema_path))
+    except Exception:
+        logging.exception("could not read schema document from cache")
+        document = None
+    if document is None:
+        with open(schema_path) as schema_file:
+            document = json.load(schema_file)
+    return document
+
+
+def store_schema_documents(documents):
+    """
+    Shares synced schema documents (by path) with every process, and bumps the schema
+    version so they rebuild what they made of the old ones.
+    """
+    global _schema_version
+    cache.set_many({_get_document_key(path): document for path, document in documents.items()}, timeout=None)
+    cache.add(SCHEMA_VERSION_CACHE_KEY, 0, timeout=None)
+    version = cache.incr(SCHEMA_VERSION_CACHE_KEY)
+    # this process needn't wait for its next check
+    _schema_version = (time.monotonic(), version)
+    _encoded_schemas.clear()
+    return version
+
+
+_encoded_schemas = {}
+_encoded_schemas_lock = threading.Lock()
+
+
+def get_encoded_schema(schema_path, build, version=None):
+    """
+    Returns the EncodedSchema of the document `build()` makes out of `schema_path`,
+    building it once per process, and again when `version` (of whatever else the
+    document is made of) changes or, checked every SCHEMA_CHECK_INTERVAL seconds, the
+    file is regenerated or a sync changes the shared schema version.
+    """
+    now = time.monotonic()
+    cached = _encoded_schemas.get(schema_path)
+    if cached is not None and cached[0][2] == version and now < cached[2]:
+        return cached[1]
+    stamp = (os.stat(schema_path).st_mtime_ns, get_schema_version(), version)
+    if cached is not None and cached[0] == stamp:
+        cached = _encoded_schemas[schema_path] = (stamp, cached[1], now + SCHEMA_CHECK_INTERVAL)
+        return cached[1]
+    with _encoded_schemas_lock:
+        cached = _encoded_schemas.get(schema_path)
+        if cached is None or cached[0] != stamp:
+            cached = _encoded_schemas[schema_path] = (stamp, EncodedSchema(build()), now + SCHEMA_CHECK_INTERVAL)
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=None)
+def get_urlconf_hash(urlconf=None):
+    """
+    Returns a hash of the url patterns of `urlconf` and the views they route to, which
+    only changes with the code.
+    """
+    digest = hashlib.sha256()
+
+    def add_patterns(patterns, prefix):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                add_patterns(pattern.url_patterns, f"{prefix}{pattern.pattern}")
+                continue
+            callback = pattern.callback
+            view = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None) or callback
+            digest.update(f"{prefix}{pattern.pattern} {view.__module__}.{view.__qualname__}\n".encode())
 
-    # Check paths for unresolved references
-    for schema in schemas.values():
-        check_refs(schema)
-    return results
+    add_patterns(get_resolver(urlconf).url_patterns, "")
+    return digest.hexdigest()[:32]
 
 
 class SchemaView(APIView):
@@ -111,6 +303,13 @@ class SchemaView(APIView):
     patterns = None
 
     def get(self, request, *args, **kwargs):
+        return self.get_encoded_schema(request).get_response(request)
+
+    def get_encoded_schema(self, request):
+        # the document only depends on schema.json, and its synced versions
+        return get_encoded_schema(self.get_schema_path(), lambda: self.build_schema(request))
+
+    def resolve_urlconf(self):
         if isinstance(self.urlconf, list) or isinstance(self.urlconf, tuple):
             ModuleWrapper = namedtuple('ModuleWrapper', ['urlpatterns'])
             if all(isinstance(i, str) for i in self.urlconf):
@@ -123,11 +322,13 @@ class SchemaView(APIView):
             else:
                 # explicitly resolved urlconf
                 self.urlconf = ModuleWrapper(tuple(self.urlconf))
+        return self.urlconf
+
+    def build_schema(self, request):
+        self.resolve_urlconf()
         api_schema = self._get_schema_response(request)
 
-        schema_path = self.get_schema_path()
-        with open(schema_path) as schema_file:
-            vulmatch_schema = json.load(schema_file)
+        vulmatch_schema = read_schema_document(self.get_schema_path())
 
         merged_components = merge_components(
             api_schema.get('components', {}),
@@ -149,27 +350,14 @@ class SchemaView(APIView):
         }
 
         self.resolve_schemas(merged_swagger)
-        return JsonResponse(merged_swagger)
+        return merged_swagger
 
     def resolve_schemas(self, merged_swagger):
-        merged_components = merged_swagger['components']
-        schema = extract_paths_and_schemas(merged_swagger)
-        new_schema_dict = {}
-        schemas = merged_components['schemas']
-        for component_key in schemas:
-            if f"#/components/schemas/{component_key}" in schema:
-                new_schema_dict[component_key] = schemas[component_key]
-        refs = find_unresolved_references(new_schema_dict)
-        for ref in refs:
-            ref_key = ref.split("/")[-1]
-            if ref_key in new_schema_dict:
-                continue
-            new_schema_dict[ref_key] = schemas[ref_key]
-
-        merged_components['schemas'] = new_schema_dict
+        graph = ComponentGraph(merged_swagger['components'])
+        merged_swagger['components'] = graph.prune(merged_swagger['paths'])
 
     def get_schema_path(self):
-        return os.path.join('vulmatch_api', 'templates', 'vulmatch_api', 'schema.json')
+        return os.path.join(SCHEMA_DIR, 'schema.json')
 
     def get_authentication_schemas(self):
         return {
@@ -199,8 +387,9 @@ class AdminSchemaView(SchemaView):
     authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [IsAdminUser]
 
-    def resolve_schemas(self, merged_swagger):
-        pass
+    def get_encoded_schema(self, request):
+        version = self.get_fragment_key(self.get_api_version(request))
+        return get_encoded_schema(self.get_schema_path(), lambda: self.build_schema(request), version)
 
     def get_authentication_schemas(self):
         return {
@@ -212,9 +401,45 @@ class AdminSchemaView(SchemaView):
             }
         }
 
+    def get_api_version(self, request):
+        if self.api_version:
+            return self.api_version
+        return request and request.version or self._get_version_parameter(request)
+
+    def get_fragment_key(self, version):
+        """
+        Returns the cache key of the generated fragment, which only changes with the
+        routes, the app version or drf-spectacular.
+        """
+        return ':'.join([
+            ADMIN_SCHEMA_FRAGMENT_CACHE_KEY,
+            get_urlconf_hash(self.resolve_urlconf()),
+            spectacular_settings.VERSION or '',
+            drf_spectacular.__version__,
+            str(version or ''),
+        ])
+
     def _get_schema_response(self, request):
-        version = self.api_version or request.version or self._get_version_parameter(
-            request)
+        """
+        Returns the generated part of the document, which drf-spectacular takes a while
+        to produce, from the shared cache if another worker already generated it.
+        """
+        version = self.get_api_version(request)
+        key = self.get_fragment_key(version)
+        try:
+            data = cache.get(key)
+        except Exception:
+            logging.exception("could not read admin schema fragment from cache")
+            data = None
+        if data is None:
+            data = self._generate_schema_fragment(request, version)
+            try:
+                cache.set(key, data, timeout=ADMIN_SCHEMA_FRAGMENT_TTL)
+            except Exception:
+                logging.exception("could not write admin schema fragment to cache")
+        return data
+
+    def _generate_schema_fragment(self, request, version):
         generator = self.generator_class(
             urlconf=self.urlconf, api_version=version, patterns=self.patterns)
         data = generator.get_schema(request=request, public=self.serve_public)
@@ -239,7 +464,18 @@ class AdminSchemaView(SchemaView):
         return data
 
     def get_schema_path(self):
-        return os.path.join('vulmatch_api', 'templates', 'vulmatch_api', 'admin-schema.json')
+        return os.path.join(SCHEMA_DIR, 'admin-schema.json')
+
+
+def warm_admin_schema():
+    """
+    Builds the admin schema document ahead of the first request for it. Called when
+    the app starts serving, see project/wsgi.py and project/asgi.py.
+    """
+    try:
+        AdminSchemaView().get_encoded_schema(None)
+    except Exception:
+        logging.exception("could not warm the admin schema")
 
 
 class AdminSwaggerView(SpectacularSwaggerView):
@@ -0,0 +1,21 @@
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class BatchLookupSerializer(serializers.Serializer):
+    cve = serializers.ListField(child=serializers.CharField(max_length=256), required=False, default=list)
+    cpe = serializers.ListField(child=serializers.CharField(max_length=1024), required=False, default=list)
+
+    def validate(self, attrs):
+        # duplicates are looked up (and charged) once
+        items = list(dict.fromkeys(
+            [("cve", object_id) for object_id in attrs["cve"]]
+            + [("cpe", object_id) for object_id in attrs["cpe"]]
+        ))
+        if not items:
+            raise ValidationError("At least one CVE or CPE id is required")
+        if len(items) > settings.VULMATCH_BATCH_MAX_ITEMS:
+            raise ValidationError(f"A batch can't have more than {settings.VULMATCH_BATCH_MAX_ITEMS} ids")
+        attrs["items"] = items
+        return attrs
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# sent by create_swagger_json when syncing the upstream schema changed operations, with
+# `operations`, the "METHOD path"s added, removed or changed. Only receivers in the
+# process that ran the sync get it, so they should act on shared state
+schema_changed = Signal()
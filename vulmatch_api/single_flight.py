@@ -0,0 +1,240 @@
+"""
+Coalescing of identical concurrent upstream calls.
+
+When many clients miss the proxy cache for the same key at once, only one of them (the
+leader) calls upstream and the others wait for its result instead of piling onto the
+Vulmatch service. This happens at two levels:
+
+* within a worker, callers block on the leader's in-flight call (`SingleFlight` for
+  threads, `AsyncSingleFlight` for the event loop);
+* across workers, the leader holds a short redis lock while it fetches and the other
+  workers poll until its entry shows up. A 200 lands in the response cache, anything
+  else is handed off under a short-lived key.
+
+Fetch functions return `(entry, response)`: `entry` is a cache entry (see
+`cache.make_entry`) that can be shared, `response` a live upstream response that could
+not be turned into one and is only usable by the leader. Waiters whose leader got no
+entry, or that time out, make their own call.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _get_lock_key(key):
+    return f'{key}:lock'
+
+
+def _get_handoff_key(key):
+    return f'{key}:handoff'
+
+
+def _get_lock_timeout():
+    return math.ceil(settings.VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces calls with the same key made concurrently from different threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(settings.VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT):
+                if call.error:
+                    raise call.error
+                if call.entry is not None:
+                    return call.entry, None
+            return fn()
+
+        try:
+            call.entry, response = fn()
+            return call.entry, response
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces calls with the same key made concurrently on the running event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                entry, error = await asyncio.wait_for(
+                    asyncio.shield(future), settings.VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                entry, error = None, None
+            if error:
+                raise error
+            if entry is not None:
+                return entry, None
+            return await fn()
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            entry, response = await fn()
+            future.set_result((entry, None))
+            return entry, response
+        except Exception as e:
+            future.set_result((None, e))
+            raise
+        finally:
+            del self._calls[key]
+            if not future.done():
+                # the leader was cancelled, let the waiters make their own calls
+                future.set_result((None, None))
+
+
+def acquire_lock(key):
+    """
+    Returns a token if this worker should call upstream for `key`, or None if another
+    worker already is.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if cache.add(_get_lock_key(key), token, timeout=_get_lock_timeout()):
+            return token
+        return None
+    except Exception:
+        logging.exception("could not acquire single flight lock")
+        return token
+
+
+def release_lock(key, token):
+    try:
+        if cache.get(_get_lock_key(key)) == token:
+            cache.delete(_get_lock_key(key))
+    except Exception:
+        logging.exception("could not release single flight lock")
+
+
+def hand_off(key, entry):
+    try:
+        cache.set(_get_handoff_key(key), entry, timeout=_get_lock_timeout())
+    except Exception:
+        logging.exception("could not hand off single flight result")
+
+
+def poll(key):
+    """
+    Returns `(entry, locked)`, where entry is the result for `key` if there is one yet
+    and locked tells whether a worker is still fetching it.
+    """
+    try:
+        values = cache.get_many([key, _get_handoff_key(key), _get_lock_key(key)])
+    except Exception:
+        logging.exception("could not poll single flight result")
+        return None, False
+    return values.get(key) or values.get(_get_handoff_key(key)), _get_lock_key(key) in values
+
+
+def _finish(key, token, entry):
+    if token:
+        if entry is not None and entry["status"] != 200:
+            # 200s are picked up from the response cache
+            hand_off(key, entry)
+        release_lock(key, token)
+
+
+def _fetch_across_workers(key, fn):
+    token = acquire_lock(key)
+    if token is None:
+        deadline = time.monotonic() + settings.VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT
+        while True:
+            entry, locked = poll(key)
+            if entry is not None:
+                return entry, None
+            if not locked or time.monotonic() >= deadline:
+                break
+            time.sleep(settings.VULMATCH_PROXY_SINGLE_FLIGHT_POLL_INTERVAL)
+
+    entry = None
+    try:
+        entry, response = fn()
+        return entry, response
+    finally:
+        _finish(key, token, entry)
+
+
+_apoll = sync_to_async(poll, thread_sensitive=False)
+_aacquire_lock = sync_to_async(acquire_lock, thread_sensitive=False)
+_afinish = sync_to_async(_finish, thread_sensitive=False)
+
+
+async def _afetch_across_workers(key, fn):
+    token = await _aacquire_lock(key)
+    if token is None:
+        deadline = time.monotonic() + settings.VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT
+        while True:
+            entry, locked = await _apoll(key)
+            if entry is not None:
+                return entry, None
+            if not locked or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(settings.VULMATCH_PROXY_SINGLE_FLIGHT_POLL_INTERVAL)
+
+    entry = None
+    try:
+        entry, response = await fn()
+        return entry, response
+    finally:
+        await _afinish(key, token, entry)
+
+
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
+
+
+def fetch(key, fn):
+    """
+    Calls `fn` at most once at a time for `key`, across threads and workers, and returns
+    its `(entry, response)`.
+    """
+    if not settings.VULMATCH_PROXY_SINGLE_FLIGHT:
+        return fn()
+    return single_flight.do(key, lambda: _fetch_across_workers(key, fn))
+
+
+async def afetch(key, fn):
+    """
+    Same as `fetch`, for an async `fn`.
+    """
+    if not settings.VULMATCH_PROXY_SINGLE_FLIGHT:
+        return await fn()
+    return await async_single_flight.do(key, lambda: _afetch_across_workers(key, fn))
@@ -0,0 +1,123 @@
+"""
+Serving last-known-good copies of proxied responses.
+
+Next to each entry of the proxy cache, a copy of it is kept under a key that doesn't
+change with the cache generation (see `cache.set_entry`), so it survives the
+invalidation that follows an ingest and outlives the entry's TTL. When there is no
+fresh entry for a request, its copy is served instead:
+
+* while it is revalidated, if it is no older than the route's TTL plus
+  VULMATCH_PROXY_STALE_WHILE_REVALIDATE and was stored in the current cache generation
+  (so never right after an ingest): one refresh per key runs in the background, on a
+  pool of VULMATCH_PROXY_STALE_REFRESH_CONCURRENCY threads per worker process, and the
+  client doesn't wait for upstream;
+* when upstream fails (an error, a timeout or a 5xx), if it is no older than the
+  route's maximum staleness (see `cache.get_max_staleness`).
+
+Stale responses carry an `Age` header and a `Warning` saying why they are stale.
+"""
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import batch
+from . import cache as proxy_cache
+
+
+# RFC 7234 warn-codes
+RESPONSE_IS_STALE = '110 - "Response is Stale"'
+REVALIDATION_FAILED = '111 - "Revalidation Failed"'
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.VULMATCH_PROXY_STALE_REFRESH_CONCURRENCY,
+                    thread_name_prefix="vulmatch-stale-refresh",
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def can_revalidate(path, entry, key):
+    """
+    Tells whether a stale entry may be served, for `key`, while it is refreshed in the
+    background.
+    """
+    if not entry or not settings.VULMATCH_PROXY_STALE_WHILE_REVALIDATE:
+        return False
+    if entry.get("generation") != proxy_cache.get_key_generation(key):
+        # the cache was invalidated since, the entry is only good for upstream failures
+        return False
+    return proxy_cache.get_age(entry) <= proxy_cache.get_ttl(path) + settings.VULMATCH_PROXY_STALE_WHILE_REVALIDATE
+
+
+def can_serve_on_error(path, entry):
+    """
+    Tells whether a stale entry may be served instead of an upstream error.
+    """
+    return bool(entry) and proxy_cache.get_age(entry) <= proxy_cache.get_max_staleness(path)
+
+
+def is_failure(entry, response):
+    """
+    Tells whether the `(entry, response)` of an upstream call (see `single_flight`) is a
+    5xx, or nothing at all because the call failed.
+    """
+    if entry is not None:
+        return entry["status"] >= 500
+    if response is None:
+        return True
+    return getattr(response, "status_code", getattr(response, "status", 0)) >= 500
+
+
+def _get_refresh_key(key):
+    return f'{key}:refresh'
+
+
+def _refresh(path, params, key):
+    try:
+        batch.get_entry(path, params)
+    except Exception:
+        logging.exception("could not refresh stale proxy response")
+    finally:
+        try:
+            cache.delete(_get_refresh_key(key))
+        except Exception:
+            logging.exception("could not release stale proxy response refresh")
+
+
+def refresh(path, params, key):
+    """
+    Fetches a fresh entry for `key` in the background, unless a worker already is.
+    """
+    try:
+        if not cache.add(_get_refresh_key(key), 1, timeout=math.ceil(settings.VULMATCH_UPSTREAM_READ_TIMEOUT)):
+            return
+    except Exception:
+        logging.exception("could not start stale proxy response refresh")
+        return
+    get_executor().submit(_refresh, path, params, key)
+
+
+arefresh = sync_to_async(refresh, thread_sensitive=False)
+
+
+def mark(response, entry, warning):
+    response["Age"] = str(proxy_cache.get_age(entry))
+    response["Warning"] = warning
+    return response
@@ -0,0 +1,271 @@
+"""
+Minimal keep-alive HTTP server standing in for the Vulmatch service.
+
+Used by the tests and by the proxy benchmarks, so neither needs a live upstream.
+`StubUpstreamHandler` echoes the requested path; `PayloadStubUpstreamHandler` serves
+CVE, CPE and bundle payloads shaped after the upstream schema, for benchmarks.
+"""
+import gzip
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # whether to gzip bodies for clients that accept it
+    compress = True
+
+    def get_body(self):
+        return json.dumps({"path": self.path}).encode()
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        latency = self.server.get_latency()
+        if latency:
+            time.sleep(latency)
+        body = self.get_body()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if self.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+CVE_PATH = re.compile(r"/api/v1/cve/objects/(?P<cve_id>[^/]+)/(?P<sub>bundle/|relationships/)?")
+CPE_PATH = re.compile(r"/api/v1/cpe/objects/(?P<cpe_name>[^/]+)/(?P<sub>relationships/)?")
+LIST_PATH = re.compile(r"/api/v1/(?P<kind>cve|cpe)/objects/")
+
+
+def _lognormal(rng, median, sigma):
+    return median * rng.lognormvariate(0, sigma) if sigma else median
+
+
+class PayloadStubUpstreamHandler(StubUpstreamHandler):
+    """
+    Serves STIX objects shaped after `PaginatedStixObjectsList` and the bundle responses
+    of the upstream schema. Payloads only depend on the path, so they (and their ETags)
+    are the same on every request, and their sizes vary with the class attributes below.
+    """
+
+    # total number of CVEs and CPEs in list responses
+    total_results = 250000
+    # median length of descriptions, log-normally distributed
+    description_size = 600
+    description_sigma = 0.8
+    # median number of objects in a bundle besides the vulnerability
+    bundle_size = 40
+    bundle_sigma = 1.0
+    default_page_size = 50
+
+    def _get_rng(self, *seed):
+        return random.Random(hashlib.md5(repr(seed).encode()).digest())
+
+    def _text(self, rng, size, sigma):
+        words = ("buffer", "overflow", "remote", "attacker", "crafted", "request", "allows",
+                 "execute", "arbitrary", "code", "via", "the", "in", "component", "version")
+        length = int(_lognormal(rng, size, sigma))
+        text = []
+        while length > 0:
+            word = rng.choice(words)
+            text.append(word)
+            length -= len(word) + 1
+        return " ".join(text)
+
+    def _stix_id(self, rng, type):
+        return f"{type}--{uuid.UUID(int=rng.getrandbits(128), version=4)}"
+
+    def get_vulnerability(self, cve_id):
+        rng = self._get_rng("vulnerability", cve_id)
+        return {
+            "type": "vulnerability",
+            "spec_version": "2.1",
+            "id": self._stix_id(rng, "vulnerability"),
+            "created": "2024-03-29T17:15:21.150Z",
+            "modified": "2024-05-01T06:15:35.007Z",
+            "name": cve_id,
+            "description": self._text(rng, self.description_size, self.description_sigma),
+            "external_references": [
+                {"source_name": "cve", "url": f"https://nvd.nist.gov/vuln/detail/{cve_id}", "external_id": cve_id},
+            ] + [
+                {"source_name": "cwe", "external_id": f"CWE-{rng.randint(20, 1400)}"}
+                for _ in range(rng.randint(0, 3))
+            ],
+            "x_cvss": {"v3_1": {"base_score": round(rng.uniform(0, 10), 1), "base_severity": "HIGH"}},
+        }
+
+    def get_software(self, cpe_name):
+        rng = self._get_rng("software", cpe_name)
+        return {
+            "type": "software",
+            "spec_version": "2.1",
+            "id": self._stix_id(rng, "software"),
+            "name": self._text(rng, 40, 0.5),
+            "cpe": cpe_name,
+            "vendor": cpe_name.split(":")[3] if cpe_name.count(":") > 3 else "vendor",
+            "version": cpe_name.split(":")[5] if cpe_name.count(":") > 5 else "*",
+            "x_cpe_struct": {"part": "a", "update": "*", "edition": "*", "language": "*"},
+        }
+
+    def get_related(self, rng, source):
+        type = rng.choice(("indicator", "weakness", "software", "attack-pattern", "relationship"))
+        obj = {
+            "type": type,
+            "spec_version": "2.1",
+            "id": self._stix_id(rng, type),
+            "created": source.get("created"),
+            "modified": source.get("modified"),
+            "description": self._text(rng, self.description_size // 2, self.description_sigma),
+        }
+        if type == "relationship":
+            obj.update(source_ref=source["id"], target_ref=self._stix_id(rng, "weakness"), relationship_type="exploits")
+        return obj
+
+    def _get_cve_id(self, index):
+        return f"CVE-{2000 + index % 25}-{index:05d}"
+
+    def _get_cpe_name(self, index):
+        return f"cpe:2.3:a:vendor{index % 997}:product{index}:{index % 10}.{index % 7}:*:*:*:*:*:*:*"
+
+    def _paginate(self, query, total, get_object):
+        page = max(int((query.get("page") or ["1"])[0]), 1)
+        page_size = int((query.get("page_size") or [str(self.default_page_size)])[0])
+        start = (page - 1) * page_size
+        objects = [get_object(i) for i in range(start, min(start + page_size, total))]
+        return {
+            "page_size": page_size,
+            "page_number": page,
+            "page_results_count": len(objects),
+            "total_results_count": total,
+            "objects": objects,
+        }
+
+    def get_payload(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if match := CVE_PATH.fullmatch(url.path):
+            vulnerability = self.get_vulnerability(match["cve_id"])
+            if not match["sub"]:
+                return {"page_size": 1, "page_number": 1, "page_results_count": 1,
+                        "total_results_count": 1, "objects": [vulnerability]}
+            rng = self._get_rng("bundle", match["cve_id"])
+            related = [self.get_related(rng, vulnerability)
+                       for _ in range(int(_lognormal(rng, self.bundle_size, self.bundle_sigma)))]
+            objects = [vulnerability] + related
+            return self._paginate(query, len(objects), objects.__getitem__)
+        if match := CPE_PATH.fullmatch(url.path):
+            software = self.get_software(match["cpe_name"])
+            return {"page_size": 1, "page_number": 1, "page_results_count": 1,
+                    "total_results_count": 1, "objects": [software]}
+        if match := LIST_PATH.fullmatch(url.path):
+            if match["kind"] == "cve":
+                return self._paginate(query, self.total_results, lambda i: self.get_vulnerability(self._get_cve_id(i)))
+            return self._paginate(query, self.total_results, lambda i: self.get_software(self._get_cpe_name(i)))
+        return {"page_size": 0, "page_number": 1, "page_results_count": 0, "total_results_count": 0, "objects": []}
+
+    def get_body(self):
+        return json.dumps(self.get_payload()).encode()
+
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def configure(self, latency, latency_sigma):
+        self.requests = []
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rng = random.Random()
+
+    def get_latency(self):
+        return _lognormal(self.rng, self.latency, self.latency_sigma)
+
+
+class StubUpstream:
+    """
+    Runs a stub upstream in a background thread, for use as a context manager.
+
+    `latency` is the number of seconds each response is delayed by: the median of a
+    log-normal distribution if `latency_sigma` is set, else a constant.
+    """
+
+    def __init__(self, handler_class=StubUpstreamHandler, latency=0, latency_sigma=0):
+        self.server = StubUpstreamServer(("127.0.0.1", 0), handler_class)
+        self.server.configure(latency, latency_sigma)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _serve(queue, handler_class, latency, latency_sigma):
+    server = StubUpstreamServer(("127.0.0.1", 0), handler_class)
+    server.configure(latency, latency_sigma)
+    queue.put(server.server_address)
+    server.serve_forever()
+
+
+class StubUpstreamProcess:
+    """
+    Runs a stub upstream in a child process.
+
+    Benchmarks should use this rather than `StubUpstream`, so the server's threads don't
+    compete with the code being measured for the GIL.
+    """
+
+    def __init__(self, handler_class=StubUpstreamHandler, latency=0, latency_sigma=0):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(self.queue, handler_class, latency, latency_sigma), daemon=True
+        )
+        self.server_address = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.process.start()
+        self.server_address = self.queue.get(timeout=10)
+        return self
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.join()
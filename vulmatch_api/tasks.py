@@ -3,11 +3,14 @@ import requests
 import logging
 from django.conf import settings
 from django.utils.timezone import now
-from celery import shared_task
+from celery import chain, shared_task
+from django.core.management import call_command
+
+from . import ingest, warm
+from .cache import bump_generation
 
 
 BASE_URL = settings.VULMATCH_SERVICE_BASE_URL
-JOB_STATUS_CHECK_DELAY_SECONDS = 300
 
 def send_request(path, body):
     url = BASE_URL + path
@@ -31,18 +34,29 @@ def cve_download():
     })
     job = res.json()
     job_id = job['id']
-    check_job_status.apply_async(args=[job_id], countdown=JOB_STATUS_CHECK_DELAY_SECONDS)
+    ingest.start(job_id)
+    check_job_status.apply_async(args=[job_id], countdown=ingest.get_poll_delay(job_id, 0))
 
 @shared_task()
-def check_job_status(job_id):
+def check_job_status(job_id, attempt=0, reschedule=True):
+    """
+    Moves the pipeline on once the CVE download job finishes, polling it again (unless
+    `reschedule` is false, as for job callbacks) while it is pending. See `ingest`.
+    """
+    if ingest.is_finished(job_id):
+        return
     logging.debug(BASE_URL + f"/api/v1/jobs/{job_id}/")
     response = requests.get(BASE_URL + f"/api/v1/jobs/{job_id}/")
     job = response.json()
     logging.debug(job)
-    if job['state'] == "completed":
+    if job['state'] == "pending":
+        if reschedule:
+            check_job_status.apply_async(args=[job_id, attempt + 1], countdown=ingest.get_poll_delay(job_id, attempt + 1))
+    elif not ingest.finish(job_id, job['state']):
+        # another poll (or a callback) already saw it finish
+        return
+    elif job['state'] == "completed":
         cwe_update.delay()
-    elif  job['state'] == "pending":
-        check_job_status.apply_async(args=[job_id], countdown=JOB_STATUS_CHECK_DELAY_SECONDS)
     else:
         cve_download.delay()
 
@@ -89,4 +103,32 @@ def kev_update():
         "modified_min": f"{date_string}T00:00:00.000Z",
         "created_min": f"{date_string}T23:59:59.999Z"
     })
+    bump_generation()
+    # the schema sync invalidates the proxy cache again if upstream routes changed, so
+    # it runs before warming
+    chain(sync_upstream_schema.si(), warm_proxy_cache.si(f"{date_string}T00:00:00.000Z")).delay()
+
+
+@shared_task()
+def sync_upstream_schema():
+    """
+    Syncs the user and admin API schemas with the upstream one (see create_swagger_json).
+    A failed sync is logged rather than raised, so the rest of the pipeline still runs.
+    """
+    try:
+        call_command("create_swagger_json")
+    except Exception:
+        logging.exception("could not sync the upstream schema")
+
 
+@shared_task()
+def warm_proxy_cache(modified_min):
+    """
+    Fetches what is likely to be requested first back into the (just invalidated) proxy
+    cache: the web app's default listings, the most requested paths and the CVEs
+    modified since `modified_min` (see `warm`).
+    """
+    urls = warm.get_open_listing_urls() + warm.get_hot_urls() + warm.get_modified_urls(modified_min)
+    warmed = warm.warm(urls)
+    logging.info("warmed %d of %d proxy cache entries", warmed, len(set(urls)))
+    return warmed
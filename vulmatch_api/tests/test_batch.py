@@ -0,0 +1,104 @@
+from unittest.mock import MagicMock, patch
+
+import urllib3
+
+from django.test import TestCase, override_settings
+
+from vulmatch_api.tests.test_ratelimit import LIMITS
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+CPE = "cpe:2.3:a:tukaani:xz:5.6.0:*:*:*:*:*:*:*"
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchLookupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("hedy@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+
+    def _post(self, data, **headers):
+        headers.setdefault("HTTP_API_KEY", self.key)
+        return self.client.post(
+            "/vulmatch_api/api/v1/batch/objects/", data, content_type="application/json", **headers
+        )
+
+    def test_requires_api_key(self):
+        response = self._post({"cve": ["CVE-2024-3094"]}, HTTP_API_KEY="")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stub.requests, [])
+
+    def test_lookup(self):
+        response = self._post({"cve": ["CVE-2024-3094", "CVE-2021-44228"], "cpe": [CPE]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(
+            [(item["type"], item["id"], item["status"]) for item in data["results"]],
+            [("cve", "CVE-2024-3094", 200), ("cve", "CVE-2021-44228", 200), ("cpe", CPE, 200)],
+        )
+        self.assertEqual(data["results"][2]["data"], {"path": f"/api/v1/cpe/objects/{CPE}/"})
+        self.assertCountEqual(self.stub.requests, [
+            "/api/v1/cve/objects/CVE-2024-3094/",
+            "/api/v1/cve/objects/CVE-2021-44228/",
+            f"/api/v1/cpe/objects/{CPE}/",
+        ])
+
+    def test_body_read_error_fails_the_item(self):
+        with patch("vulmatch_api.cache.read_body", side_effect=urllib3.exceptions.ProtocolError("broken")):
+            response = self._post({"cve": ["CVE-2024-3094"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["status"], 502)
+
+    @override_settings(VULMATCH_PROXY_CACHE_MAX_BODY_SIZE=10, VULMATCH_PROXY_STALE_ENABLED=False)
+    def test_item_over_cache_size_is_not_cached(self):
+        for _ in range(2):
+            response = self._post({"cve": ["CVE-2024-3094"]})
+            self.assertEqual(response.json()["results"][0]["status"], 200)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VULMATCH_PROXY_CACHE_MAX_BODY_SIZE=10, VULMATCH_BATCH_MAX_ITEM_SIZE=20)
+    def test_item_over_max_size_fails(self):
+        response = self._post({"cve": ["CVE-2024-3094"]})
+        self.assertEqual(response.status_code, 200)
+        item = response.json()["results"][0]
+        self.assertEqual(item["status"], 502)
+        self.assertEqual(item["error"]["detail"], "The Vulmatch service response is too large.")
+
+    def test_duplicates_are_looked_up_once(self):
+        response = self._post({"cve": ["CVE-2024-3094", "CVE-2024-3094"]})
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_cached_items_are_not_fetched(self):
+        self._post({"cve": ["CVE-2024-3094"]})
+        response = self._post({"cve": ["CVE-2024-3094"]})
+        self.assertEqual(response.json()["results"][0]["status"], 200)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_invalid_batches(self):
+        self.assertEqual(self._post({}).status_code, 400)
+        with override_settings(VULMATCH_BATCH_MAX_ITEMS=1):
+            self.assertEqual(self._post({"cve": ["CVE-2024-3094"], "cpe": [CPE]}).status_code, 400)
+        self.assertEqual(self.stub.requests, [])
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_charged_once_per_batch(self, get_api_limits):
+        script = MagicMock(return_value=[1, "7", 3])
+        with patch("vulmatch_api.ratelimit._get_script", return_value=script):
+            response = self._post({"cve": ["CVE-2024-3094", "CVE-2021-44228"], "cpe": [CPE]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["RateLimit-Remaining"], "7")
+        script.assert_called_once()
+        self.assertEqual(script.call_args.kwargs["args"][3], 3)
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_throttled(self, get_api_limits):
+        script = MagicMock(return_value=[0, "1", 3])
+        with patch("vulmatch_api.ratelimit._get_script", return_value=script):
+            response = self._post({"cve": ["CVE-2024-3094", "CVE-2021-44228"]})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.stub.requests, [])
@@ -0,0 +1,75 @@
+import json
+import urllib.request
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from vulmatch_api.management.commands.benchmark_proxy import get_paths
+from vulmatch_api.stub_upstream import PayloadStubUpstreamHandler, StubUpstream
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key
+
+
+class PayloadStubUpstreamTest(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubUpstream(PayloadStubUpstreamHandler).__enter__()
+        self.addCleanup(self.stub.__exit__)
+
+    def _get(self, path):
+        with urllib.request.urlopen(f"{self.stub.base_url}/api/v1/{path}") as response:
+            return json.loads(response.read())
+
+    def test_list(self):
+        body = self._get("cve/objects/?page=3&page_size=20")
+        self.assertEqual(body["page_number"], 3)
+        self.assertEqual(body["page_results_count"], 20)
+        self.assertEqual(body["total_results_count"], PayloadStubUpstreamHandler.total_results)
+        self.assertTrue(all(obj["type"] == "vulnerability" for obj in body["objects"]))
+
+    def test_payloads_are_stable(self):
+        body = self._get("cve/objects/CVE-2024-3094/bundle/")
+        self.assertEqual(body["objects"][0]["name"], "CVE-2024-3094")
+        self.assertEqual(body, self._get("cve/objects/CVE-2024-3094/bundle/"))
+        cpe = self._get("cpe/objects/cpe:2.3:a:tukaani:xz:5.6.0:*:*:*:*:*:*:*/")["objects"][0]
+        self.assertEqual(cpe["cpe"], "cpe:2.3:a:tukaani:xz:5.6.0:*:*:*:*:*:*:*")
+
+    def test_get_paths(self):
+        self.assertEqual(get_paths(50, 10, seed=1), get_paths(50, 10, seed=1))
+        self.assertTrue(all(path.startswith("/vulmatch_api/api/v1/") for path in get_paths(50, 10, seed=1)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkProxyCommandTest(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        _, self.key = create_team_api_key("paula@example.com")
+
+    def test_report(self):
+        stdout = StringIO()
+        call_command(
+            "benchmark_proxy", "--api-key", self.key, "--requests", "20", "--concurrency", "1", "4",
+            "--latency", "0", "--json", stdout=stdout,
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual([level["concurrency"] for level in report["results"]], [1, 4])
+        for level in report["results"]:
+            self.assertEqual(level["requests"], 20)
+            self.assertEqual(level["errors"], 0)
+            self.assertGreater(level["peak_rss_mb"], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkAsyncProxyCommandTest(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_requests_reach_upstream(self):
+        stdout = StringIO()
+        call_command(
+            "benchmark_async_proxy", "--requests", "10", "--concurrency", "2", "--latency", "0", "--json",
+            stdout=stdout,
+        )
+        results = json.loads(stdout.getvalue())
+        self.assertEqual([result["mode"] for result in results], ["sync", "async"])
+        for result in results:
+            self.assertEqual(result["statuses"], {"200": 10})
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import requests
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from vulmatch_api import breaker, upstream
+from vulmatch_api.exceptions import UpstreamCircuitOpen, UpstreamUnavailable
+from vulmatch_api.stub_upstream import StubUpstream, StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES
+
+DEAD_UPSTREAM = "http://127.0.0.1:1/api/v1/cve/objects/"
+
+
+class ErrorStubUpstreamHandler(StubUpstreamHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class SlowFirstStubUpstreamHandler(StubUpstreamHandler):
+    def do_GET(self):
+        self.server.calls = getattr(self.server, "calls", 0) + 1
+        if self.server.calls == 1:
+            time.sleep(1)
+        super().do_GET()
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    VULMATCH_UPSTREAM_BREAKER_FAILURE_THRESHOLD=3,
+    VULMATCH_UPSTREAM_CONNECT_TIMEOUT=0.5,
+)
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _fail(self, times):
+        for _ in range(times):
+            with self.assertRaises(UpstreamUnavailable):
+                upstream.request("GET", DEAD_UPSTREAM)
+
+    def test_opens_after_threshold(self):
+        self._fail(2)
+        self.assertEqual(breaker.get_status()["state"], breaker.CLOSED)
+        self._fail(1)
+        self.assertEqual(breaker.get_status()["state"], breaker.OPEN)
+        with self.assertRaises(UpstreamCircuitOpen) as context:
+            upstream.request("GET", DEAD_UPSTREAM)
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(context.exception.wait, 30)
+
+    def test_server_errors_count_as_failures(self):
+        with StubUpstream(ErrorStubUpstreamHandler) as stub:
+            for _ in range(3):
+                upstream.request("GET", f"{stub.base_url}/api/v1/cve/objects/")
+            with self.assertRaises(UpstreamCircuitOpen):
+                upstream.request("GET", f"{stub.base_url}/api/v1/cve/objects/")
+        self.assertEqual(len(stub.requests), 3)
+
+    @override_settings(VULMATCH_UPSTREAM_BREAKER_SLOW_CALL=0.05)
+    def test_slow_calls_count_as_failures(self):
+        with StubUpstream(latency=0.1) as stub:
+            for _ in range(3):
+                upstream.request("GET", f"{stub.base_url}/api/v1/cve/objects/")
+        self.assertEqual(breaker.get_status()["state"], breaker.OPEN)
+
+    def test_half_open_probe(self):
+        self._fail(3)
+        cache.delete(breaker._get_key("opened_at"))
+        self.assertEqual(breaker.get_status()["state"], breaker.HALF_OPEN)
+
+        self.assertEqual(breaker.before_request(), breaker.HALF_OPEN)
+        # only one probe at a time
+        with self.assertRaises(UpstreamCircuitOpen):
+            breaker.before_request()
+        breaker.record_response(breaker.HALF_OPEN, 200, 0.01)
+        self.assertEqual(breaker.get_status()["state"], breaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self._fail(3)
+        cache.delete(breaker._get_key("opened_at"))
+        self._fail(1)
+        self.assertEqual(breaker.get_status()["state"], breaker.OPEN)
+
+    def test_other_request_errors_fail_the_probe(self):
+        self._fail(3)
+        cache.delete(breaker._get_key("opened_at"))
+        with patch.object(upstream.get_session(), "request", side_effect=requests.exceptions.ChunkedEncodingError()):
+            with self.assertRaises(UpstreamUnavailable):
+                upstream.request("GET", DEAD_UPSTREAM)
+        self.assertEqual(breaker.get_status()["state"], breaker.OPEN)
+        self.assertIsNone(cache.get(breaker._get_key("probe")))
+
+    def test_other_async_errors_fail_the_probe(self):
+        self._fail(3)
+        cache.delete(breaker._get_key("opened_at"))
+
+        async def fail():
+            try:
+                with patch.object(upstream.get_async_session(), "request", side_effect=ValueError()):
+                    with self.assertRaises(UpstreamUnavailable):
+                        await upstream.arequest("GET", DEAD_UPSTREAM)
+            finally:
+                await upstream.aclose_async_session()
+
+        asyncio.run(fail())
+        self.assertEqual(breaker.get_status()["state"], breaker.OPEN)
+        self.assertIsNone(cache.get(breaker._get_key("probe")))
+
+    def test_cancelled_probe_is_released(self):
+        self._fail(3)
+        cache.delete(breaker._get_key("opened_at"))
+
+        async def cancel():
+            try:
+                with patch.object(upstream.get_async_session(), "request", side_effect=asyncio.CancelledError()):
+                    with self.assertRaises(asyncio.CancelledError):
+                        await upstream.arequest("GET", DEAD_UPSTREAM)
+            finally:
+                await upstream.aclose_async_session()
+
+        asyncio.run(cancel())
+        self.assertEqual(breaker.get_status()["state"], breaker.HALF_OPEN)
+        self.assertIsNone(cache.get(breaker._get_key("probe")))
+
+    @override_settings(VULMATCH_UPSTREAM_BREAKER=False)
+    def test_disabled(self):
+        self._fail(4)
+        self.assertEqual(breaker.get_status()["state"], breaker.CLOSED)
+
+    def test_async_client(self):
+        async def fail():
+            try:
+                for _ in range(3):
+                    with self.assertRaises(UpstreamUnavailable):
+                        await upstream.arequest("GET", DEAD_UPSTREAM)
+                with self.assertRaises(UpstreamCircuitOpen):
+                    await upstream.arequest("GET", DEAD_UPSTREAM)
+            finally:
+                await upstream.aclose_async_session()
+
+        asyncio.run(fail())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_UPSTREAM_HEDGE=True)
+class HedgedRequestTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        upstream.latency_tracker.reset()
+        self.addCleanup(upstream.latency_tracker.reset)
+        for _ in range(upstream.HEDGE_MIN_SAMPLES):
+            upstream.latency_tracker.record(0.01)
+
+    def test_slow_call_is_hedged(self):
+        with StubUpstream(SlowFirstStubUpstreamHandler) as stub:
+            start = time.monotonic()
+            response = upstream.request("GET", f"{stub.base_url}/api/v1/cve/objects/")
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(stub.server.calls, 2)
+
+    def test_async_slow_call_is_hedged(self):
+        async def get(url):
+            try:
+                start = time.monotonic()
+                response = await upstream.arequest("GET", url)
+                await response.read()
+                response.release()
+                return response, time.monotonic() - start
+            finally:
+                await upstream.aclose_async_session()
+
+        with StubUpstream(SlowFirstStubUpstreamHandler) as stub:
+            response, elapsed = asyncio.run(get(f"{stub.base_url}/api/v1/cve/objects/"))
+        self.assertEqual(response.status, 200)
+        self.assertLess(elapsed, 0.5)
+
+    def test_not_enough_samples(self):
+        upstream.latency_tracker.reset()
+        self.assertIsNone(upstream.get_hedge_delay("GET"))
+
+    def test_only_gets_are_hedged(self):
+        self.assertEqual(upstream.get_hedge_delay("GET"), 0.05)
+        self.assertIsNone(upstream.get_hedge_delay("POST"))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, HEALTH_CHECK_TOKENS=["secret"])
+class UpstreamStatusViewTest(TestCase):
+    def test_requires_token_or_staff(self):
+        self.assertEqual(self.client.get("/vulmatch_api/upstream/status/").status_code, 403)
+        response = self.client.get("/vulmatch_api/upstream/status/?token=secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["breaker"]["state"], breaker.CLOSED)
+
+        user = get_user_model().objects.create(username="admin@example.com", is_staff=True)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/vulmatch_api/upstream/status/").status_code, 200)
@@ -0,0 +1,113 @@
+import gzip
+import json
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlsplit
+
+from django.test import TestCase, override_settings
+
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.test_ratelimit import LIMITS
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+TOTAL = 7
+
+
+class PaginatedHandler(StubUpstreamHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get("invalid"):
+            body = gzip.compress(json.dumps({"detail": "Not a list"}).encode())
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        page, page_size = int(query["page"][0]), int(query["page_size"][0])
+        if page > 2 and query.get("fail"):
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        ids = range((page - 1) * page_size, min(page * page_size, TOTAL))
+        body = json.dumps({
+            "page_size": page_size,
+            "page_number": page,
+            "page_results_count": len(ids),
+            "total_results_count": TOTAL,
+            "objects": [{"id": f"vulnerability--{i}"} for i in ids],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("katherine@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self, PaginatedHandler)
+
+    def _export(self, query):
+        response = self.client.get(f"/vulmatch_api/api/v1/cve/objects/?stream=ndjson&{query}", HTTP_API_KEY=self.key)
+        lines = b"".join(response.streaming_content).splitlines() if response.streaming else []
+        return response, [json.loads(line) for line in lines]
+
+    def test_all_pages_are_streamed(self):
+        response, lines = self._export("page_size=3&has_kev=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["X-Total-Count"], str(TOTAL))
+        self.assertEqual(lines, [{"id": f"vulnerability--{i}"} for i in range(TOTAL)])
+        self.assertEqual(len(self.stub.requests), 3)
+        for page, path in enumerate(self.stub.requests, 1):
+            query = parse_qs(urlsplit(path).query)
+            self.assertEqual(query["page"], [str(page)])
+            self.assertEqual(query["has_kev"], ["true"])
+            self.assertNotIn("stream", query)
+
+    @override_settings(VULMATCH_EXPORT_PAGE_SIZE=5)
+    def test_default_page_size_and_start_page(self):
+        response, lines = self._export("page=2")
+        self.assertEqual(lines, [{"id": "vulnerability--5"}, {"id": "vulnerability--6"}])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_upstream_error_ends_stream(self):
+        response, lines = self._export("page_size=2&fail=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1]["error"]["status"], 500)
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_each_page_is_charged(self, get_api_limits):
+        script = MagicMock(side_effect=[[1, "9", 1], [1, "8", 2], [0, "0", 2]])
+        with patch("vulmatch_api.ratelimit._get_script", return_value=script):
+            response, lines = self._export("page_size=3")
+        self.assertEqual(script.call_count, 3)
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[-1]["error"]["status"], 429)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_relayed_response_is_decoded_for_identity_clients(self):
+        response = self.client.get(
+            "/vulmatch_api/api/v1/cve/objects/?stream=ndjson&invalid=1", HTTP_API_KEY=self.key, HTTP_ACCEPT_ENCODING="identity"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(json.loads(response.content), {"detail": "Not a list"})
+
+    def test_relayed_response_is_passed_through_gzipped(self):
+        response = self.client.get(
+            "/vulmatch_api/api/v1/cve/objects/?stream=ndjson&invalid=1", HTTP_API_KEY=self.key, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(response.content)), {"detail": "Not a list"})
@@ -0,0 +1,81 @@
+import json
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from vulmatch_api import ingest, tasks
+from vulmatch_api.stub_upstream import StubUpstream, StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES
+
+
+class JobStubUpstreamHandler(StubUpstreamHandler):
+    def get_body(self):
+        return json.dumps({"id": "job-1", "state": self.server.state}).encode()
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    VULMATCH_INGEST_POLL_INITIAL_DELAY=15.0,
+    VULMATCH_INGEST_POLL_BACKOFF=2.0,
+    VULMATCH_INGEST_POLL_MAX_DELAY=300.0,
+    VULMATCH_INGEST_POLL_ESTIMATE_FRACTION=0.9,
+    VULMATCH_INGEST_CALLBACK_TOKENS=["secret"],
+)
+class IngestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = StubUpstream(JobStubUpstreamHandler).__enter__()
+        self.stub.server.state = "pending"
+        self.addCleanup(self.stub.__exit__)
+        base_url_patch = patch.object(tasks, "BASE_URL", self.stub.base_url)
+        base_url_patch.start()
+        self.addCleanup(base_url_patch.stop)
+
+    def test_poll_delay_backs_off(self):
+        ingest.start("job-1")
+        self.assertEqual([ingest.get_poll_delay("job-1", attempt) for attempt in range(7)], [15, 30, 60, 120, 240, 300, 300])
+
+    def test_poll_delay_follows_past_durations(self):
+        for duration in (1000, 1200, 5000):
+            ingest.record_duration(duration)
+        ingest.start("job-1")
+        self.assertAlmostEqual(ingest.get_poll_delay("job-1", 0), 1080, delta=5)
+        with patch("vulmatch_api.ingest.time.time", return_value=time.time() + 1100):
+            self.assertEqual(ingest.get_poll_delay("job-1", 3), 120)
+
+    def test_pending_job_is_polled_again(self):
+        ingest.start("job-1")
+        with patch.object(tasks.check_job_status, "apply_async") as apply_async, \
+                patch.object(tasks.cwe_update, "delay") as cwe_update:
+            tasks.check_job_status("job-1", attempt=2)
+        apply_async.assert_called_once_with(args=["job-1", 3], countdown=120)
+        cwe_update.assert_not_called()
+
+    def test_completed_job_moves_the_pipeline_on_once(self):
+        ingest.start("job-1")
+        self.stub.server.state = "completed"
+        with patch.object(tasks.cwe_update, "delay") as cwe_update:
+            tasks.check_job_status("job-1")
+            tasks.check_job_status("job-1", reschedule=False)
+        cwe_update.assert_called_once_with()
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(len(cache.get(ingest.INGEST_JOB_DURATIONS_KEY)), 1)
+
+    def test_failed_job_is_restarted(self):
+        ingest.start("job-1")
+        self.stub.server.state = "failed"
+        with patch.object(tasks.cve_download, "delay") as cve_download:
+            tasks.check_job_status("job-1")
+        cve_download.assert_called_once_with()
+        self.assertIsNone(cache.get(ingest.INGEST_JOB_DURATIONS_KEY))
+
+    def test_callback(self):
+        url = "/vulmatch_api/ingest/jobs/job-1/callback/"
+        with patch.object(tasks.check_job_status, "delay") as check_job_status:
+            self.assertEqual(self.client.post(url).status_code, 403)
+            self.assertEqual(self.client.post(url + "?token=secret").status_code, 404)
+            ingest.start("job-1")
+            self.assertEqual(self.client.post(url + "?token=secret").status_code, 202)
+        check_job_status.assert_called_once_with("job-1", reschedule=False)
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from prometheus_client import REGISTRY
+
+from vulmatch_api import metrics
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+class RouteTest(SimpleTestCase):
+    def test_get_route(self):
+        self.assertEqual(metrics.get_route("cve/objects/CVE-2024-3094/bundle/"), "cve/objects/{cve_id}/bundle/")
+        self.assertEqual(
+            metrics.get_route("cpe/objects/cpe:2.3:a:tukaani:xz:5.6.0:*:*:*:*:*:*:*/"), "cpe/objects/{cpe_name}/"
+        )
+        self.assertEqual(metrics.get_route("//jobs/"), "jobs/")
+        self.assertEqual(metrics.get_route("cve/objects/CVE-2024-3094/unknown/"), metrics.OTHER_ROUTE)
+
+
+class WorkerMetricsTest(SimpleTestCase):
+    @override_settings(VULMATCH_WORKER_METRICS_PORT=9808)
+    def test_worker_serves_metrics(self):
+        with patch("vulmatch_api.metrics.start_http_server") as start_http_server:
+            metrics._on_worker_init()
+        start_http_server.assert_called_once_with(9808, registry=REGISTRY)
+
+    @override_settings(VULMATCH_WORKER_METRICS_PORT=0)
+    def test_disabled(self):
+        with patch("vulmatch_api.metrics.start_http_server") as start_http_server:
+            metrics._on_worker_init()
+        start_http_server.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, HEALTH_CHECK_TOKENS=["secret"])
+class MetricsViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.key = create_team_api_key("margaret@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+
+    def _sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get("/vulmatch_api/metrics/").status_code, 403)
+        self.assertEqual(self.client.get("/vulmatch_api/metrics/?token=wrong").status_code, 403)
+        response = self.client.get("/vulmatch_api/metrics/?token=secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"vulmatch_proxy_request_duration_seconds", response.content)
+
+    def test_proxied_request_is_measured(self):
+        route = "cve/objects/{cve_id}/"
+        request_labels = dict(view="proxy", route=route, method="GET", status="200")
+        requests_before = self._sample("vulmatch_proxy_request_duration_seconds_count", **request_labels)
+        misses_before = self._sample("vulmatch_proxy_cache_requests_total", route=route, result="miss")
+        hits_before = self._sample("vulmatch_proxy_cache_requests_total", route=route, result="hit")
+        upstream_before = self._sample(
+            "vulmatch_upstream_request_duration_seconds_count", route=route, method="GET", status="200"
+        )
+        bytes_before = self._sample("vulmatch_proxy_response_bytes_total", view="proxy", route=route)
+
+        for _ in range(2):
+            response = self.client.get("/vulmatch_api/api/v1/cve/objects/CVE-2024-3094/", HTTP_API_KEY=self.key)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self._sample("vulmatch_proxy_request_duration_seconds_count", **request_labels), requests_before + 2)
+        self.assertEqual(self._sample("vulmatch_proxy_cache_requests_total", route=route, result="miss"), misses_before + 1)
+        self.assertEqual(self._sample("vulmatch_proxy_cache_requests_total", route=route, result="hit"), hits_before + 1)
+        self.assertEqual(
+            self._sample("vulmatch_upstream_request_duration_seconds_count", route=route, method="GET", status="200"),
+            upstream_before + 1,
+        )
+        self.assertEqual(
+            self._sample("vulmatch_proxy_response_bytes_total", view="proxy", route=route),
+            bytes_before + 2 * len(response.content),
+        )
+        self.assertGreater(self._sample("vulmatch_proxy_auth_duration_seconds_count", view="proxy"), 0)
@@ -0,0 +1,163 @@
+import gzip
+import json
+
+from django.test import TestCase, override_settings
+
+from vulmatch_api import cache as proxy_cache
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+class ChunkedStubUpstreamHandler(StubUpstreamHandler):
+    """
+    Sends gzipped bodies with chunked transfer encoding, so without a Content-Length.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = gzip.compress(json.dumps({"path": self.path, "objects": ["x" * 100] * 100}).encode())
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(body), 64):
+            chunk = body[start:start + 64]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProxyCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.key = create_team_api_key("carol@example.com")
+        team_api_key, _ = create_team_api_key("dave@example.com")
+        _, cls.other_key = create_team_api_key("erin@example.com", team=team_api_key.team)
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+
+    def _get(self, url, key=None, **extra):
+        return self.client.get(f"/vulmatch_api/api/v1/{url}", HTTP_API_KEY=key or self.key, **extra)
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self._get("cve/objects/?page=2")
+        second = self._get("cve/objects/?page=2")
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(first.json(), {"path": "/api/v1/cve/objects/?page=2"})
+        self.assertEqual(second.json(), first.json())
+
+    def test_cache_is_shared_between_keys_and_param_orders(self):
+        self._get("cve/objects/?page=2&sort=modified_descending")
+        response = self._get("cve/objects/?sort=modified_descending&page=2", key=self.other_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_different_params_are_cached_separately(self):
+        self._get("cve/objects/?page=2")
+        self._get("cve/objects/?page=3")
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VULMATCH_PROXY_STALE_ENABLED=False)
+    def test_bump_generation_invalidates_entries(self):
+        self._get("cpe/objects/")
+        proxy_cache.bump_generation()
+        self._get("cpe/objects/")
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VULMATCH_PROXY_CACHE_MAX_BODY_SIZE=100, VULMATCH_PROXY_STALE_ENABLED=False)
+    def test_chunked_body_over_max_size_is_relayed_uncached(self):
+        self.stub.server.RequestHandlerClass = ChunkedStubUpstreamHandler
+        for accept_encoding in ("identity", "gzip"):
+            response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING=accept_encoding)
+            body = b"".join(response.streaming_content) if response.streaming else response.content
+            if accept_encoding == "gzip":
+                body = gzip.decompress(body)
+            self.assertEqual(json.loads(body)["objects"], ["x" * 100] * 100)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_uncached_route(self):
+        self._get("jobs/")
+        self._get("jobs/")
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_entry_is_encoded_for_each_client(self):
+        self._get("cve/objects/", HTTP_ACCEPT_ENCODING="identity")
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(response.content)), {"path": "/api/v1/cve/objects/"})
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="identity")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_get_ttl(self):
+        self.assertEqual(proxy_cache.get_ttl("jobs/1234/"), 0)
+        self.assertEqual(proxy_cache.get_ttl("cve/objects/"), 3600)
+        self.assertEqual(proxy_cache.get_ttl("//cve/objects/CVE-2024-1234/"), 86400)
+        with self.settings(VULMATCH_PROXY_CACHE_ENABLED=False):
+            self.assertEqual(proxy_cache.get_ttl("cve/objects/"), 0)
+
+    def test_conditional_request(self):
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="identity")
+        etag = response["ETag"]
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="identity", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_etag_depends_on_encoding(self):
+        identity_etag = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="identity")["ETag"]
+        gzip_etag = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        self.assertNotEqual(identity_etag, gzip_etag)
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=identity_etag)
+        self.assertEqual(response.status_code, 200)
+        response = self._get("cve/objects/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditions_are_not_forwarded_on_miss(self):
+        etag = self._get("cve/objects/")["ETag"]
+        proxy_cache.bump_generation()
+        response = self._get("cve/objects/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self._get("cve/objects/")
+        self.assertEqual(response.json(), {"path": "/api/v1/cve/objects/"})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OpenProxyCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("ida@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.team_api_key.user)
+        self.stub = start_stub_upstream(self)
+
+    def test_cache_is_shared_with_api_keys(self):
+        self.client.get("/vulmatch_api/api/v1/cve/objects/?page=2", HTTP_API_KEY=self.key)
+        response = self.client.get("/vulmatch_api/proxy/open/cve/objects/?page=2")
+        self.assertEqual(response.json(), {"path": "/api/v1/cve/objects/?page=2"})
+        self.client.get("/vulmatch_api/proxy/open/cve/objects/CVE-2024-3094/bundle/")
+        self.client.get("/vulmatch_api/proxy/open/cve/objects/CVE-2024-3094/bundle/")
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(
+        VULMATCH_OPEN_PROXY_MAX_AGE=60,
+        VULMATCH_OPEN_PROXY_S_MAXAGE=600,
+        VULMATCH_OPEN_PROXY_STALE_WHILE_REVALIDATE=3600,
+    )
+    def test_cache_control(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cpe/objects/")
+        self.assertEqual(
+            set(response["Cache-Control"].split(", ")),
+            {"public", "max-age=60", "s-maxage=600", "stale-while-revalidate=3600"},
+        )
+        response = self.client.get("/vulmatch_api/proxy/open/cpe/objects/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("public", response["Cache-Control"])
+        response = self.client.get("/vulmatch_api/api/v1/cpe/objects/", HTTP_API_KEY=self.key)
+        self.assertFalse(response.has_header("Cache-Control"))
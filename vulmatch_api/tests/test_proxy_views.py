@@ -0,0 +1,193 @@
+import gzip
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from apps.teams.models import TeamApiKey, TeamApiKeyStatus
+from apps.users.models import CustomUser
+from vulmatch_api import upstream
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+from vulmatch_api.views import AsyncOpenVulmatchProxyView, AsyncVulmatchProxyView
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_PROXY_CACHE_ENABLED=False)
+class OpenProxyStreamingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username="alice@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+        self.stub = start_stub_upstream(self)
+
+    def test_response_is_streamed(self):
+        response = self.client.get(
+            "/vulmatch_api/proxy/open/cve/objects/?page=2", HTTP_ACCEPT_ENCODING="identity"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b"".join(response.streaming_content)
+        self.assertEqual(json.loads(body), {"path": "/api/v1/cve/objects/?page=2"})
+        self.assertEqual(response["Content-Length"], str(len(body)))
+
+    def test_compressed_body_is_passed_through(self):
+        response = self.client.get(
+            "/vulmatch_api/proxy/open/cve/objects/", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(json.loads(gzip.decompress(body)), {"path": "/api/v1/cve/objects/"})
+
+    @override_settings(VULMATCH_PROXY_STREAMING=False)
+    def test_buffered_mode(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cpe/objects/")
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.json(), {"path": "/api/v1/cpe/objects/"})
+
+    def test_conditional_request_is_forwarded(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cpe/objects/", HTTP_ACCEPT_ENCODING="identity")
+        etag = response["ETag"]
+        response = self.client.get(
+            "/vulmatch_api/proxy/open/cpe/objects/", HTTP_ACCEPT_ENCODING="identity", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+    def test_etag_is_weakened_when_body_is_decoded(self):
+        with override_settings(VULMATCH_PROXY_STREAMING=False):
+            response = self.client.get("/vulmatch_api/proxy/open/cpe/objects/", HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertTrue(response["ETag"].startswith('W/"'))
+
+
+class UncompressedStubUpstreamHandler(StubUpstreamHandler):
+    compress = False
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_PROXY_CACHE_ENABLED=False, VULMATCH_PROXY_COMPRESS_MIN_SIZE=0)
+class ProxyCompressionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username="frank@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+        self.stub = start_stub_upstream(self, UncompressedStubUpstreamHandler)
+
+    def test_uncompressed_body_is_gzipped(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cve/objects/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        self.assertTrue(response["ETag"].endswith('-gzip"'))
+        body = gzip.decompress(b"".join(response.streaming_content))
+        self.assertEqual(json.loads(body), {"path": "/api/v1/cve/objects/"})
+
+    @override_settings(VULMATCH_PROXY_COMPRESS_MIN_SIZE=1024)
+    def test_small_body_is_not_gzipped(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cve/objects/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_identity_client(self):
+        response = self.client.get("/vulmatch_api/proxy/open/cve/objects/")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(self.stub.requests, ["/api/v1/cve/objects/"])
+
+    def test_async_view(self):
+        request = AsyncRequestFactory().get(
+            "/vulmatch_api/proxy/open/cve/objects/", headers={"Accept-Encoding": "gzip"}
+        )
+        # what AuthenticationMiddleware sets for a logged-in session
+        request.user = self.user
+
+        async def get():
+            try:
+                response = await AsyncOpenVulmatchProxyView.as_view()(request)
+                return response, b"".join([chunk async for chunk in response.streaming_content])
+            finally:
+                await upstream.aclose_async_session()
+
+        response, body = async_to_sync(get)()
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), {"path": "/api/v1/cve/objects/"})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_PROXY_CACHE_ENABLED=False)
+class AsyncOpenProxyAuthTest(TransactionTestCase):
+    """
+    The async open proxy authenticates like the sync one. Users are looked up outside
+    the test's thread, so the data is committed rather than kept in a test transaction.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.user = CustomUser.objects.create(username="grace@example.com")
+        self.token = Token.objects.create(user=self.user)
+        self.stub = start_stub_upstream(self)
+
+    def _get(self, headers):
+        request = AsyncRequestFactory().get("/vulmatch_api/proxy/open/cve/objects/", headers=headers)
+
+        async def get():
+            try:
+                response = await AsyncOpenVulmatchProxyView.as_view()(request)
+                if response.streaming:
+                    response.body = b"".join([chunk async for chunk in response.streaming_content])
+                return response
+            finally:
+                await upstream.aclose_async_session()
+
+        return async_to_sync(get)()
+
+    def test_token_auth(self):
+        response = self._get({"Authorization": f"Token {self.token.key}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body), {"path": "/api/v1/cve/objects/"})
+
+    def test_invalid_token(self):
+        response = self._get({"Authorization": "Token invalid"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.requests, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncProxyViewTest(TransactionTestCase):
+    """
+    Keys are verified outside the test's thread, so they are committed rather than kept
+    in a test transaction.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.team_api_key, self.key = create_team_api_key("bob@example.com")
+        self.stub = start_stub_upstream(self)
+
+    @override_settings(VULMATCH_PROXY_CACHE_ENABLED=False)
+    async def _get(self, key=None):
+        headers = {"Api-Key": key} if key else {}
+        request = AsyncRequestFactory().get("/vulmatch_api/api/v1/cve/objects/?page=3", headers=headers)
+        try:
+            response = await AsyncVulmatchProxyView.as_view()(request, path="cve/objects/")
+            if response.streaming:
+                response.body = b"".join([chunk async for chunk in response.streaming_content])
+            return response
+        finally:
+            await upstream.aclose_async_session()
+
+    async def test_valid_key(self):
+        response = await self._get(self.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body), {"path": "/api/v1/cve/objects/?page=3"})
+
+    async def test_missing_key(self):
+        response = await self._get()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.requests, [])
+
+    async def test_blocked_key(self):
+        await TeamApiKey.objects.filter(id=self.team_api_key.id).aupdate(status=TeamApiKeyStatus.BLOCKED)
+        response = await self._get(self.key)
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,93 @@
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from vulmatch_api import metrics, query, schema
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SyncedSchemaTest(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        # back to the shipped documents, with a new version so nothing is memoised
+        self.addCleanup(schema.store_schema_documents, {})
+        self.addCleanup(clear_caches)
+
+    def test_routes_follow_synced_schema(self):
+        self.assertEqual(query.get_param_specs("new/objects/"), {})
+        self.assertEqual(metrics.get_route("new/objects/"), metrics.OTHER_ROUTE)
+        for schema_path, prefix in ((query.SCHEMA_PATH, query.SCHEMA_PATH_PREFIX), (metrics.SCHEMA_PATH, metrics.SCHEMA_PATH_PREFIX)):
+            document = schema.read_schema_document(schema_path)
+            document["paths"][f"{prefix}new/objects/"] = {
+                "get": {"parameters": [{"name": "sort", "in": "query", "schema": {"type": "string"}}]},
+            }
+            schema.store_schema_documents({schema_path: document})
+        self.assertIn("sort", query.get_param_specs("new/objects/"))
+        self.assertEqual(metrics.get_route("new/objects/"), "new/objects/")
+
+
+class NormalizeTest(SimpleTestCase):
+    def _normalize(self, path, query_string):
+        return query.normalize(path, QueryDict(query_string)).urlencode(safe=",:*")
+
+    def test_params_are_sorted_and_empty_ones_dropped(self):
+        self.assertEqual(
+            self._normalize("cve/objects/", "sort=modified_descending&has_kev=true&description=&cve_id="),
+            "has_kev=true&sort=modified_descending",
+        )
+
+    def test_default_page_is_dropped(self):
+        self.assertEqual(self._normalize("cve/objects/", "page=1&page_size=50"), "page_size=50")
+        self.assertEqual(self._normalize("cve/objects/", "page=2"), "page=2")
+        self.assertEqual(self._normalize("cve/objects/CVE-2024-3094/bundle/", "page=1"), "")
+
+    def test_unexploded_arrays_are_joined(self):
+        self.assertEqual(
+            self._normalize("cve/objects/", "weakness_id=CWE-787,CWE-20&weakness_id=CWE-20&weakness_id="),
+            "weakness_id=CWE-20,CWE-787",
+        )
+        self.assertEqual(
+            self._normalize("cve/objects/CVE-2024-3094/bundle/", "object_type=weakness,vulnerability"),
+            self._normalize("cve/objects/CVE-2024-3094/bundle/", "object_type=vulnerability&object_type=weakness"),
+        )
+
+    def test_exploded_arrays_are_repeated(self):
+        self.assertEqual(
+            self._normalize("cve/objects/", "stix_id=vulnerability--b&stix_id=vulnerability--a&stix_id=vulnerability--b"),
+            "stix_id=vulnerability--a&stix_id=vulnerability--b",
+        )
+
+    def test_unknown_params_and_routes(self):
+        self.assertEqual(self._normalize("cve/objects/", "b=2&a=1&a=3&c="), "a=1&a=3&b=2")
+        self.assertEqual(self._normalize("jobs/", "page=1&z=1"), "page=1&z=1")
+
+    def test_route_with_path_params(self):
+        self.assertIn("cve_version", query.get_param_specs("cve/objects/CVE-2024-3094/"))
+        self.assertIn("cpe_match_string", query.get_param_specs("//cpe/objects/"))
+
+    @override_settings(VULMATCH_PROXY_NORMALIZE_QUERY=False)
+    def test_disabled(self):
+        self.assertEqual(self._normalize("cve/objects/", "page=1&b=&a=1"), "page=1&b=&a=1")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProxyQueryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.key = create_team_api_key("lise@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+
+    def _get(self, url):
+        return self.client.get(f"/vulmatch_api/api/v1/{url}", HTTP_API_KEY=self.key)
+
+    def test_equivalent_queries_share_an_entry(self):
+        self._get("cve/objects/?weakness_id=CWE-787&weakness_id=CWE-20&page=1")
+        self._get("cve/objects/?weakness_id=CWE-20,CWE-787&description=")
+        self.assertEqual(self.stub.requests, ["/api/v1/cve/objects/?weakness_id=CWE-20%2CCWE-787"])
+
+    def test_repeated_params_are_forwarded(self):
+        self._get("jobs/?state=failed&state=pending")
+        self.assertEqual(self.stub.requests, ["/api/v1/jobs/?state=failed&state=pending"])
@@ -0,0 +1,91 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from vulmatch_api import ratelimit
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+LIMITS = {"rate_limit": 60, "burst": 10, "daily_quota": 1000}
+
+
+class EvaluateTest(SimpleTestCase):
+    def test_allowed(self):
+        result = ratelimit.evaluate(LIMITS, tokens=7.5, used=20, allowed=True, cost=1, quota_reset=3600)
+        self.assertTrue(result.allowed)
+        self.assertEqual((result.limit, result.remaining, result.reset), (10, 7, 3))
+        self.assertEqual(result.policy, "60;w=60;burst=10, 1000;w=86400")
+        self.assertIsNone(result.retry_after)
+
+    def test_bucket_exhausted(self):
+        result = ratelimit.evaluate(LIMITS, tokens=0.25, used=20, allowed=False, cost=1, quota_reset=3600)
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.remaining, 0)
+        self.assertEqual(result.retry_after, 1)
+
+    def test_quota_exhausted(self):
+        result = ratelimit.evaluate(LIMITS, tokens=10, used=1000, allowed=False, cost=1, quota_reset=3600)
+        self.assertEqual((result.limit, result.remaining, result.reset), (1000, 0, 3600))
+        self.assertEqual(result.retry_after, 3600)
+
+    def test_quota_only(self):
+        limits = {"rate_limit": 0, "burst": 0, "daily_quota": 100}
+        result = ratelimit.evaluate(limits, tokens=0, used=40, allowed=True, cost=1, quota_reset=60)
+        self.assertEqual((result.limit, result.remaining), (100, 60))
+        self.assertEqual(result.policy, "100;w=86400")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProxyRateLimitTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("grace@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+        self.script = MagicMock()
+        script_patch = patch("vulmatch_api.ratelimit._get_script", return_value=self.script)
+        script_patch.start()
+        self.addCleanup(script_patch.stop)
+
+    def _get(self):
+        return self.client.get("/vulmatch_api/api/v1/cve/objects/", HTTP_API_KEY=self.key)
+
+    def test_team_without_plan_is_unlimited(self):
+        self.assertEqual(
+            self.team_api_key.team.get_api_limits(), {"rate_limit": 0, "burst": 0, "daily_quota": 0}
+        )
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("RateLimit-Limit"))
+        self.script.assert_not_called()
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_headers(self, get_api_limits):
+        self.script.return_value = [1, "9", 1]
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["RateLimit-Limit"], "10")
+        self.assertEqual(response["RateLimit-Remaining"], "9")
+        self.assertEqual(response["RateLimit-Policy"], "60;w=60;burst=10, 1000;w=86400")
+        self.assertFalse(response.has_header("Retry-After"))
+        keys = self.script.call_args.kwargs["keys"]
+        self.assertIn(str(self.team_api_key.team.id), keys[0])
+
+        # limits are cached
+        self._get()
+        get_api_limits.assert_called_once()
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_throttled(self, get_api_limits):
+        self.script.return_value = [0, "0.5", 12]
+        response = self._get()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(response["RateLimit-Remaining"], "0")
+        self.assertEqual(self.stub.requests, [])
+
+    @patch("apps.teams.models.Team.get_api_limits", return_value=LIMITS)
+    def test_redis_errors_let_requests_through(self, get_api_limits):
+        self.script.side_effect = ConnectionError()
+        self.assertEqual(self._get().status_code, 200)
@@ -0,0 +1,146 @@
+import gzip
+import json
+import time
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.users.models import CustomUser
+from vulmatch_api import schema
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches
+
+URL = "/vulmatch_api/api/schema/schema-json"
+
+
+def ref(name, section="schemas"):
+    return {"$ref": f"#/components/{section}/{name}"}
+
+
+class ComponentGraphTest(SimpleTestCase):
+    components = {
+        "schemas": {
+            "Page": {"properties": {"objects": {"items": ref("Object")}}},
+            "Object": {"oneOf": [ref("Page")], "discriminator": {"mapping": {"cve": "#/components/schemas/Cve"}}},
+            "Cve": {},
+            "Filter": {},
+            "Body": {"properties": {"mapping": ref("Cve")}},
+            "Unused": {"properties": {"a": ref("Cve")}},
+        },
+        "parameters": {"filter": {"schema": ref("Filter")}, "unused": {}},
+        "securitySchemes": {"api_key": {"type": "apiKey"}},
+    }
+    paths = {
+        "/v1/cve/objects/": {
+            "get": {
+                "parameters": [ref("filter", "parameters")],
+                "responses": {"200": {"content": {"application/json": {"schema": ref("Page")}}}},
+            },
+            "post": {"requestBody": {"content": {"application/json": {"schema": ref("Body")}}}},
+        },
+    }
+
+    def test_prune_keeps_transitive_closure(self):
+        components = schema.ComponentGraph(self.components).prune(self.paths)
+        self.assertEqual(set(components["schemas"]), {"Page", "Object", "Cve", "Filter", "Body"})
+        self.assertEqual(set(components["parameters"]), {"filter"})
+        self.assertEqual(components["securitySchemes"], self.components["securitySchemes"])
+
+    def test_unknown_refs_are_ignored(self):
+        graph = schema.ComponentGraph(self.components)
+        self.assertEqual(graph.get_closure(["#/components/schemas/Missing"]), set())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchemaViewTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        schema._encoded_schemas.clear()
+        self.addCleanup(schema._encoded_schemas.clear)
+
+    def test_schema_is_built_once(self):
+        with patch("vulmatch_api.schema.merge_paths", wraps=schema.merge_paths) as merge_paths:
+            first = self.client.get(URL)
+            second = self.client.get("/vulmatch_api/schema/schema-json")
+        self.assertEqual(merge_paths.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        document = json.loads(first.content)
+        self.assertIn("/v1/cve/objects/", document["paths"])
+        self.assertIn("PaginatedStixObjectsList", document["components"]["schemas"])
+        self.assertIn("StixObjects", document["components"]["schemas"])
+        self.assertNotIn("PaginatedJobList", document["components"]["schemas"])
+        self.assertEqual(first["Content-Type"], "application/json")
+
+    def test_synced_schema_is_served(self):
+        first = self.client.get(URL)
+        # as synced by a task worker, whose files this process doesn't see
+        schema_path = schema.SchemaView().get_schema_path()
+        document = schema.read_schema_document(schema_path)
+        document["paths"]["/vulmatch_api/api/v1/new/objects/"] = {"get": {"operationId": "new_list"}}
+        schema.store_schema_documents({schema_path: document})
+        second = self.client.get(URL)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertIn("/v1/new/objects/", json.loads(second.content)["paths"])
+
+    def test_changes_are_checked_periodically(self):
+        self.client.get(URL)
+        with patch("vulmatch_api.schema.get_schema_version", wraps=schema.get_schema_version) as get_schema_version:
+            self.client.get(URL)
+            self.client.get(URL)
+            self.assertEqual(get_schema_version.call_count, 0)
+            later = time.monotonic() + schema.SCHEMA_CHECK_INTERVAL
+            with patch("vulmatch_api.schema.time.monotonic", return_value=later):
+                self.client.get(URL)
+            self.assertEqual(get_schema_version.call_count, 1)
+
+    def test_conditional_request(self):
+        etag = self.client.get(URL)["ETag"]
+        response = self.client.get(URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_compressed(self):
+        identity = self.client.get(URL, HTTP_ACCEPT_ENCODING="identity")
+        response = self.client.get(URL, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), identity.content)
+        self.assertNotEqual(response["ETag"], identity["ETag"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdminSchemaViewTest(TestCase):
+    url = "/vulmatch_api/admin/schema/schema-json"
+
+    def setUp(self):
+        clear_caches()
+        schema._encoded_schemas.clear()
+        self.addCleanup(schema._encoded_schemas.clear)
+        self.client.force_login(CustomUser.objects.create(username="rosa@example.com", is_staff=True))
+
+    def test_generated_fragment_is_cached(self):
+        with patch.object(
+            schema.AdminSchemaView, "_generate_schema_fragment", autospec=True,
+            side_effect=schema.AdminSchemaView._generate_schema_fragment,
+        ) as generate:
+            first = self.client.get(self.url)
+            self.client.get(self.url)
+            # another worker, with the fragment in the shared cache
+            schema._encoded_schemas.clear()
+            second = self.client.get(self.url)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertIn("users_admin_token_create", first.content.decode())
+
+    def test_warm(self):
+        schema.warm_admin_schema()
+        with patch.object(schema.AdminSchemaView, "build_schema") as build_schema:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        build_schema.assert_not_called()
+
+    def test_fragment_key_follows_the_version(self):
+        view = schema.AdminSchemaView()
+        key = view.get_fragment_key(None)
+        self.assertEqual(schema.AdminSchemaView().get_fragment_key(None), key)
+        with patch.object(schema.spectacular_settings, "VERSION", "9.9.9"):
+            self.assertNotEqual(view.get_fragment_key(None), key)
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from vulmatch_api import schema
+from vulmatch_api.management.commands import create_swagger_json
+from vulmatch_api.signals import schema_changed
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, start_stub_upstream
+
+
+def get_upstream_schema(description="List CVEs"):
+    return {
+        "openapi": "3.0.3",
+        "paths": {
+            "/api/v1/cve/objects/": {"get": {"operationId": "cve_list", "description": description}},
+            "/api/v1/jobs/": {"get": {"operationId": "jobs_list"}},
+            "/api/schema/": {"get": {"operationId": "schema_retrieve"}},
+        },
+        "components": {"schemas": {}},
+    }
+
+
+class SchemaStubUpstreamHandler(StubUpstreamHandler):
+    def get_body(self):
+        return json.dumps(self.server.schema).encode()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchemaSyncTest(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self, SchemaStubUpstreamHandler)
+        self.stub.server.schema = get_upstream_schema()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        dir_patch = patch.object(create_swagger_json, "SCHEMA_DIR", self.dir.name)
+        dir_patch.start()
+        self.addCleanup(dir_patch.stop)
+        self.receiver = MagicMock()
+        schema_changed.connect(self.receiver)
+        self.addCleanup(schema_changed.disconnect, self.receiver)
+
+    def _read(self, name):
+        with open(os.path.join(self.dir.name, name)) as f:
+            return json.load(f)
+
+    def test_sync(self):
+        with patch("vulmatch_api.cache.bump_generation") as bump_generation:
+            call_command("create_swagger_json", stdout=StringIO())
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(list(self._read("schema.json")["paths"]), ["/vulmatch_api/api/v1/cve/objects/"])
+        self.assertEqual(
+            set(self._read("admin-schema.json")["paths"]),
+            {"/vulmatch_api/admin/api/v1/cve/objects/", "/vulmatch_api/admin/api/v1/jobs/"},
+        )
+        self.assertEqual(self.receiver.call_count, 1)
+        bump_generation.assert_called_once()
+        # shared with the web processes, which don't see the worker's files
+        schema_path = os.path.join(self.dir.name, "schema.json")
+        self.assertEqual(schema.read_schema_document(schema_path), self._read("schema.json"))
+        self.assertEqual(schema.get_schema_version(), 2)
+
+    def test_synced_documents_are_compared(self):
+        create_swagger_json.sync_schemas()
+        os.remove(os.path.join(self.dir.name, "schema.json"))
+        self.receiver.reset_mock()
+        changes = create_swagger_json.sync_schemas()
+        self.assertEqual(set().union(*changes.values()), set())
+        self.receiver.assert_not_called()
+
+    def test_unchanged_schema_is_not_rewritten(self):
+        call_command("create_swagger_json", stdout=StringIO())
+        mtime = os.stat(os.path.join(self.dir.name, "schema.json")).st_mtime_ns
+        self.receiver.reset_mock()
+        changes = create_swagger_json.sync_schemas()
+        self.assertEqual(set().union(*changes.values()), set())
+        self.assertEqual(os.stat(os.path.join(self.dir.name, "schema.json")).st_mtime_ns, mtime)
+        self.receiver.assert_not_called()
+
+    def test_changed_operations(self):
+        create_swagger_json.sync_schemas()
+        self.receiver.reset_mock()
+        self.stub.server.schema = get_upstream_schema("List vulnerabilities")
+        changes = create_swagger_json.sync_schemas()
+        self.assertEqual(
+            changes[os.path.join(self.dir.name, "schema.json")], {"GET /vulmatch_api/api/v1/cve/objects/"}
+        )
+        self.assertEqual(
+            self.receiver.call_args.kwargs["operations"],
+            {"GET /vulmatch_api/api/v1/cve/objects/", "GET /vulmatch_api/admin/api/v1/cve/objects/"},
+        )
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from vulmatch_api import single_flight
+from vulmatch_api.exceptions import UpstreamUnavailable
+from vulmatch_api.tests.utils import LOCMEM_CACHES
+
+ENTRY = {"status": 200, "content_type": "application/json", "body": b""}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_PROXY_SINGLE_FLIGHT_POLL_INTERVAL=0.01)
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return ENTRY, None
+
+    def test_concurrent_calls_are_coalesced(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: single_flight.fetch("key", self.fetch), range(10)))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [(ENTRY, None)] * 10)
+
+    def test_errors_are_shared(self):
+        def fetch():
+            self.calls += 1
+            time.sleep(0.2)
+            raise UpstreamUnavailable()
+
+        def call(_):
+            try:
+                single_flight.fetch("key", fetch)
+            except UpstreamUnavailable as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(call, range(5)))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, UpstreamUnavailable) for result in results))
+
+    def test_waiters_call_upstream_if_leader_has_no_entry(self):
+        response = object()
+
+        def fetch():
+            self.calls += 1
+            time.sleep(0.2)
+            return None, response
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: single_flight.fetch("key", fetch), range(3)))
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(results, [(None, response)] * 3)
+
+    def test_waits_for_other_worker(self):
+        token = single_flight.acquire_lock("key")
+
+        def other_worker():
+            time.sleep(0.1)
+            cache.set("key", ENTRY)
+            single_flight.release_lock("key", token)
+
+        threading.Thread(target=other_worker).start()
+        self.assertEqual(single_flight.fetch("key", self.fetch), (ENTRY, None))
+        self.assertEqual(self.calls, 0)
+
+    def test_non_200_entries_are_handed_off(self):
+        entry = dict(ENTRY, status=404)
+        token = single_flight.acquire_lock("key")
+
+        def other_worker():
+            time.sleep(0.1)
+            single_flight._finish("key", token, entry)
+
+        threading.Thread(target=other_worker).start()
+        self.assertEqual(single_flight.fetch("key", self.fetch), (entry, None))
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(VULMATCH_PROXY_SINGLE_FLIGHT_TIMEOUT=0.1)
+    def test_stale_lock_times_out(self):
+        single_flight.acquire_lock("key")
+        self.assertEqual(single_flight.fetch("key", self.fetch), (ENTRY, None))
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(VULMATCH_PROXY_SINGLE_FLIGHT=False)
+    def test_disabled(self):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda _: single_flight.fetch("key", self.fetch), range(3)))
+        self.assertEqual(self.calls, 3)
+
+    def test_async_calls_are_coalesced(self):
+        async def fetch():
+            self.calls += 1
+            await asyncio.sleep(0.2)
+            return ENTRY, None
+
+        async def main():
+            return await asyncio.gather(*(single_flight.afetch("key", fetch) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(main()), [(ENTRY, None)] * 10)
+        self.assertEqual(self.calls, 1)
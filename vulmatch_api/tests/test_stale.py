@@ -0,0 +1,114 @@
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.http import HttpResponse, QueryDict
+from django.test import TestCase, override_settings
+
+from vulmatch_api import cache as proxy_cache
+from vulmatch_api import stale
+from vulmatch_api.helpers import patch_public_cache_control
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+class FailingStubUpstreamHandler(StubUpstreamHandler):
+    def do_GET(self):
+        if not getattr(self.server, "failing", False):
+            return super().do_GET()
+        self.server.requests.append(self.path)
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_UPSTREAM_BREAKER=False)
+class StaleResponseTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.key = create_team_api_key("quinn@example.com")
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self, FailingStubUpstreamHandler)
+
+    def _get(self, url):
+        return self.client.get(f"/vulmatch_api/api/v1/{url}", HTTP_API_KEY=self.key)
+
+    def _wait_for_requests(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.stub.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _expire(self, path):
+        cache.delete(proxy_cache.get_cache_key(path, QueryDict()))
+
+    def test_served_while_revalidating(self):
+        self._get("cve/objects/CVE-2024-3094/")
+        self._expire("cve/objects/CVE-2024-3094/")
+        response = self._get("cve/objects/CVE-2024-3094/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"path": "/api/v1/cve/objects/CVE-2024-3094/"})
+        self.assertEqual(response["Warning"], stale.RESPONSE_IS_STALE)
+        self.assertIn("Age", response)
+
+        self._wait_for_requests(2)
+        deadline = time.monotonic() + 5
+        while self._get("cve/objects/CVE-2024-3094/").has_header("Warning") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self._get("cve/objects/CVE-2024-3094/").has_header("Warning"))
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @patch("vulmatch_api.batch.get_executor")
+    def test_refreshed_off_the_batch_pool(self, get_batch_executor):
+        self._get("cve/objects/CVE-2024-3094/")
+        self._expire("cve/objects/CVE-2024-3094/")
+        self.assertEqual(self._get("cve/objects/CVE-2024-3094/")["Warning"], stale.RESPONSE_IS_STALE)
+        self._wait_for_requests(2)
+        self.assertEqual(len(self.stub.requests), 2)
+        get_batch_executor.assert_not_called()
+
+    def test_not_revalidated_after_invalidation(self):
+        self._get("cve/objects/CVE-2024-3094/")
+        proxy_cache.bump_generation()
+        response = self._get("cve/objects/CVE-2024-3094/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Warning"))
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_invalidated_entry_served_on_upstream_error(self):
+        self._get("cve/objects/CVE-2024-3094/")
+        proxy_cache.bump_generation()
+        self.stub.server.failing = True
+        response = self._get("cve/objects/CVE-2024-3094/")
+        self.assertEqual(response["Warning"], stale.REVALIDATION_FAILED)
+
+    def test_stale_response_is_not_public(self):
+        response = patch_public_cache_control(stale.mark(HttpResponse(), {"stored_at": time.time()}, stale.RESPONSE_IS_STALE))
+        self.assertFalse(response.has_header("Cache-Control"))
+        self.assertIn("public", patch_public_cache_control(HttpResponse())["Cache-Control"])
+
+    @override_settings(VULMATCH_PROXY_STALE_WHILE_REVALIDATE=0)
+    def test_served_on_upstream_error(self):
+        self._get("cve/objects/CVE-2024-3094/")
+        proxy_cache.bump_generation()
+        self.stub.server.failing = True
+        response = self._get("cve/objects/CVE-2024-3094/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Warning"], stale.REVALIDATION_FAILED)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(VULMATCH_PROXY_STALE_WHILE_REVALIDATE=0, VULMATCH_PROXY_DEFAULT_MAX_STALENESS=60)
+    def test_too_stale(self):
+        self._get("cve/objects/CVE-2024-3094/")
+        proxy_cache.bump_generation()
+        self.stub.server.failing = True
+        with patch("vulmatch_api.cache.get_age", return_value=61):
+            response = self._get("cve/objects/CVE-2024-3094/")
+        self.assertEqual(response.status_code, 503)
+
+    def test_get_max_staleness(self):
+        self.assertEqual(proxy_cache.get_max_staleness("cve/objects/"), 24 * 60 * 60)
+        self.assertEqual(proxy_cache.get_max_staleness("jobs/"), 0)
+        with self.settings(VULMATCH_PROXY_STALE_ENABLED=False):
+            self.assertEqual(proxy_cache.get_max_staleness("cve/objects/CVE-2024-3094/"), 0)
@@ -0,0 +1,50 @@
+import re
+
+from django.test import TestCase, override_settings
+
+from apps.users.models import CustomUser
+from vulmatch_api import timing
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+class PhaseTest(TestCase):
+    def test_phases_are_added_up(self):
+        timings = timing.start()
+        with timing.phase("cache"):
+            pass
+        with timing.phase("cache"):
+            pass
+        CustomUser.objects.count()
+        header = timings.get_header()
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="1x", cache;dur=[\d.]+;desc="2x", total;dur=[\d.]+$')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ServerTimingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("nancy@example.com")
+        cls.staff = CustomUser.objects.create(username="olive@example.com", is_staff=True)
+
+    def setUp(self):
+        clear_caches()
+        self.stub = start_stub_upstream(self)
+
+    def _get(self):
+        return self.client.get("/vulmatch_api/api/v1/cve/objects/", HTTP_API_KEY=self.key)
+
+    @override_settings(VULMATCH_SERVER_TIMING="all")
+    def test_breakdown(self):
+        phases = dict(re.findall(r"(\w+);dur=([\d.]+)", self._get()["Server-Timing"]))
+        self.assertEqual(set(phases), {"auth", "db", "cache", "upstream", "serialization", "total"})
+
+    @override_settings(VULMATCH_SERVER_TIMING="staff")
+    def test_staff_only(self):
+        self.assertFalse(self._get().has_header("Server-Timing"))
+        self.client.force_login(self.staff)
+        self.assertTrue(self._get().has_header("Server-Timing"))
+
+    @override_settings(VULMATCH_SERVER_TIMING="none")
+    def test_disabled(self):
+        self.client.force_login(self.staff)
+        self.assertFalse(self._get().has_header("Server-Timing"))
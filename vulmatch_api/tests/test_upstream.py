@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from vulmatch_api import upstream
+from vulmatch_api.exceptions import UpstreamUnavailable
+from vulmatch_api.stub_upstream import StubUpstream
+from vulmatch_api.tests.utils import LOCMEM_CACHES
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UpstreamClientTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        upstream.pool_stats.reset()
+
+    def test_session_is_shared(self):
+        self.assertIs(upstream.get_session(), upstream.get_session())
+
+    def test_connections_are_reused(self):
+        with StubUpstream() as stub:
+            for _ in range(3):
+                response = upstream.request("GET", f"{stub.base_url}/api/v1/cve/objects/")
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual(upstream.get_pool_stats(), {"hits": 2, "misses": 1})
+
+    @override_settings(VULMATCH_UPSTREAM_CONNECT_TIMEOUT=0.5)
+    def test_connection_error_is_translated(self):
+        with self.assertRaises(UpstreamUnavailable):
+            upstream.request("GET", "http://127.0.0.1:1/api/v1/cve/objects/")
+
+    def test_hop_by_hop_headers_are_not_forwarded(self):
+        class Request:
+            headers = {
+                "Host": "example.com",
+                "Connection": "close",
+                "Content-Length": "0",
+                "Api-Key": "abc",
+            }
+
+        self.assertEqual(upstream.get_forward_headers(Request()), {"Api-Key": "abc"})
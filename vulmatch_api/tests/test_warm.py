@@ -0,0 +1,122 @@
+import json
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+from django.test import TestCase, override_settings
+
+from vulmatch_api import hits, tasks, warm
+from vulmatch_api.stub_upstream import StubUpstreamHandler
+from vulmatch_api.tests.utils import LOCMEM_CACHES, clear_caches, create_team_api_key, start_stub_upstream
+
+
+class FakeRedis:
+    """
+    Just enough of a redis client (sorted sets and pipelines) for the hit counts.
+    """
+
+    def __init__(self):
+        self.sets = {}
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __getattr__(self, command):
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    def execute(self):
+        results = []
+        for command, args, kwargs in self.commands:
+            if command == "zincrby":
+                name, amount, member = args
+                values = self.sets.setdefault(name, {})
+                values[member] = values.get(member, 0) + amount
+                results.append(values[member])
+            elif command == "zrevrange":
+                name, start, end = args
+                ranked = sorted(self.sets.get(name, {}).items(), key=lambda item: -item[1])
+                results.append([(member.encode(), score) for member, score in ranked[start:end + 1]])
+            elif command == "zremrangebyrank":
+                name, start, end = args
+                ranked = sorted(self.sets.get(name, {}).items(), key=lambda item: item[1])
+                for member, _ in ranked[start:len(ranked) + end + 1]:
+                    del self.sets[name][member]
+                results.append(None)
+            else:
+                results.append(None)
+        self.commands = []
+        return results
+
+
+class ModifiedCveHandler(StubUpstreamHandler):
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        if "modified_min" not in query:
+            return super().do_GET()
+        self.server.requests.append(self.path)
+        body = json.dumps({
+            "page_size": 50,
+            "page_number": 1,
+            "page_results_count": 2,
+            "total_results_count": 2,
+            "objects": [{"name": "CVE-2024-3094"}, {"name": "CVE-2021-44228"}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VULMATCH_PROXY_HITS_FLUSH_INTERVAL=0, VULMATCH_OPEN_PROXY_WARM_PAGES=2)
+class WarmTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_api_key, cls.key = create_team_api_key("jean@example.com")
+
+    def setUp(self):
+        clear_caches()
+        hits.hit_counter.pop()
+        self.redis = FakeRedis()
+        redis_patch = patch("vulmatch_api.hits.get_redis_connection", return_value=self.redis)
+        redis_patch.start()
+        self.addCleanup(redis_patch.stop)
+        self.stub = start_stub_upstream(self, ModifiedCveHandler)
+
+    def _get(self, url):
+        return self.client.get(f"/vulmatch_api/api/v1/{url}", HTTP_API_KEY=self.key)
+
+    def test_hits_are_counted(self):
+        self._get("cve/objects/CVE-2024-1234/")
+        self._get("cve/objects/?sort=modified_descending&page=2")
+        self._get("cve/objects/?page=2&sort=modified_descending")
+        self._get("jobs/")
+        self.assertEqual(
+            hits.get_top_urls(10),
+            ["cve/objects/?page=2&sort=modified_descending", "cve/objects/CVE-2024-1234/?"],
+        )
+        self.assertEqual(hits.get_top_urls(1), ["cve/objects/?page=2&sort=modified_descending"])
+
+    def test_get_modified_urls(self):
+        self.assertEqual(warm.get_modified_urls("2024-03-29T00:00:00.000Z"), [
+            "cve/objects/CVE-2024-3094/?", "cve/objects/CVE-2024-3094/bundle/?",
+            "cve/objects/CVE-2021-44228/?", "cve/objects/CVE-2021-44228/bundle/?",
+        ])
+
+    def test_warm_proxy_cache(self):
+        self._get("cve/objects/CVE-2024-1234/")
+        clear_caches()
+        self.stub.requests.clear()
+        warmed = tasks.warm_proxy_cache("2024-03-29T00:00:00.000Z")
+        self.assertEqual(warmed, 9)
+        self.assertEqual(len(self.stub.requests), 10)
+        self.assertIn("/api/v1/cve/objects/?page=2", self.stub.requests)
+        self.assertIn("/api/v1/cve/objects/CVE-2024-1234/", self.stub.requests)
+        self.assertIn("/api/v1/cve/objects/CVE-2021-44228/bundle/", self.stub.requests)
+
+        # everything warmed is served from the cache
+        self._get("cve/objects/CVE-2024-1234/")
+        self._get("cve/objects/CVE-2024-3094/bundle/")
+        self.client.force_login(self.team_api_key.user)
+        self.client.get("/vulmatch_api/proxy/open/cpe/objects/?page=2")
+        self.assertEqual(len(self.stub.requests), 10)
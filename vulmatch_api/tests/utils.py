@@ -0,0 +1,41 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from apps.teams.cache import verified_api_key_local_cache
+from apps.teams.models import Membership, Team, TeamApiKey
+from apps.teams.roles import ROLE_ADMIN
+from apps.users.models import CustomUser
+from vulmatch_api.stub_upstream import StubUpstream
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_team_api_key(email, team=None):
+    """
+    Creates a user (and team, if not given) with an API key, and returns `(team_api_key, key)`.
+    """
+    user = CustomUser.objects.create(username=email, email=email)
+    team = team or Team.objects.create(name=email, slug=email.split("@")[0])
+    with patch("apps.teams.receivers.update_user_teams_on_auth0"):
+        membership = Membership.objects.create(team=team, user=user, role=ROLE_ADMIN)
+    return TeamApiKey.objects.create_key(name=email, user=user, team=team, membership=membership)
+
+
+def clear_caches():
+    cache.clear()
+    verified_api_key_local_cache.clear()
+
+
+def start_stub_upstream(test_case, *args, **kwargs):
+    """
+    Starts a `StubUpstream` (with the given arguments) that the proxy talks to until
+    `test_case` ends, and returns it.
+    """
+    stub = StubUpstream(*args, **kwargs).__enter__()
+    test_case.addCleanup(stub.__exit__)
+    settings_override = override_settings(VULMATCH_SERVICE_BASE_URL=stub.base_url)
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+    return stub
@@ -0,0 +1,98 @@
+"""
+Per-request breakdown of where time goes, sent back in a `Server-Timing` header (see
+`ServerTimingMiddleware`).
+
+Time is added up per phase for the request being served:
+
+* `auth`: authenticating the request (API key lookup and verification);
+* `db`: SQL queries, timed on every connection;
+* `cache`: redis calls of the proxy cache and rate limits;
+* `upstream`: calls to the Vulmatch service, until their headers are received;
+* `serialization`: building the response from an upstream response or cache entry.
+
+Phases can overlap (the queries made while authenticating count for `db` too), and work
+done on other threads (batch lookups, hedged calls, export prefetches) isn't counted.
+"""
+import contextvars
+import functools
+import inspect
+import time
+from collections import defaultdict
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+PHASES = ("auth", "db", "cache", "upstream", "serialization")
+
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+
+class Timings:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, name, elapsed):
+        self.durations[name] += elapsed
+        self.counts[name] += 1
+
+    def get_header(self):
+        entries = [
+            f'{name};dur={self.durations[name] * 1000:.1f};desc="{self.counts[name]}x"'
+            for name in PHASES
+            if name in self.durations
+        ]
+        entries.append(f"total;dur={(time.monotonic() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def start():
+    """
+    Starts collecting timings for the current request, and returns them.
+    """
+    timings = Timings()
+    _timings.set(timings)
+    return timings
+
+
+class phase:
+    """
+    Context manager adding the time spent in its block to `name`, if timings are being
+    collected. Also usable as a decorator, of sync and async functions.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _timings.get()
+        self.start = time.monotonic()
+
+    def __exit__(self, *args):
+        if self.timings is not None:
+            self.timings.add(self.name, time.monotonic() - self.start)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with phase(self.name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with phase(self.name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+
+def _time_query(execute, sql, params, many, context):
+    with phase("db"):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _add_query_timer(sender, connection, **kwargs):
+    connection.execute_wrappers.append(_time_query)
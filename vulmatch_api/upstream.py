@@ -0,0 +1,427 @@
+"""
+Shared HTTP clients for talking to the Vulmatch service.
+
+Every proxied call goes through a single `requests.Session` per worker process (or a
+single `aiohttp.ClientSession` per event loop for the async views) so that TCP/TLS
+connections to `VULMATCH_SERVICE_BASE_URL` are pooled and kept alive between requests
+instead of being opened and torn down on every call.
+"""
+import asyncio
+import collections
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import aiohttp
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from . import breaker, metrics, timing
+from .exceptions import UpstreamTimeout, UpstreamUnavailable
+
+
+# headers that only make sense for a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+# headers that make upstream answer 304 without a body
+CONDITIONAL_HEADERS = {
+    "if-match",
+    "if-none-match",
+    "if-modified-since",
+    "if-unmodified-since",
+    "if-range",
+}
+
+
+class PoolStats:
+    """
+    Process-wide counters of upstream connection checkouts.
+
+    A hit is a checkout that reused an open keep-alive connection, a miss is one that
+    had to open a new connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, reused: bool):
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def as_dict(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+pool_stats = PoolStats()
+
+
+class _CountingPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        pool_stats.record(reused=conn.sock is not None)
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class UpstreamHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        if settings.VULMATCH_UPSTREAM_KEEPALIVE:
+            kwargs.setdefault(
+                "socket_options",
+                HTTPConnection.default_socket_options
+                + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+            )
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = UpstreamHTTPAdapter(
+        pool_connections=settings.VULMATCH_UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=settings.VULMATCH_UPSTREAM_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the session for the current worker process.
+
+    The pid check makes sure forked workers never share sockets with their parent.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def get_timeout():
+    return (
+        settings.VULMATCH_UPSTREAM_CONNECT_TIMEOUT,
+        settings.VULMATCH_UPSTREAM_READ_TIMEOUT,
+    )
+
+
+def get_pool_stats():
+    return pool_stats.as_dict()
+
+
+def get_forward_headers(request, conditional=True):
+    """
+    Returns the client's headers to send upstream. Conditional headers are only kept if
+    `conditional` is set, so a response that is going to be cached always has a body.
+    """
+    excluded = HOP_BY_HOP_HEADERS if conditional else HOP_BY_HOP_HEADERS | CONDITIONAL_HEADERS
+    return {
+        key: value
+        for key, value in request.headers.items()
+        if key.lower() not in excluded
+    }
+
+
+def _with_accept_encoding(headers):
+    # requests would otherwise ask for gzip on behalf of clients that can't take it
+    headers = dict(headers or {})
+    if not any(key.lower() == "accept-encoding" for key in headers):
+        headers["Accept-Encoding"] = "identity"
+    return headers
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies (time to response headers) of the most recent upstream calls
+    made by this worker process.
+    """
+
+    def __init__(self, size=1000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=size)
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+
+    def percentile(self, percent, min_samples=1):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < max(min_samples, 1):
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def as_dict(self):
+        return {
+            "samples": len(self._latencies),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+latency_tracker = LatencyTracker()
+
+# don't hedge on a percentile computed from too few calls
+HEDGE_MIN_SAMPLES = 20
+
+
+def get_hedge_delay(method):
+    """
+    Returns how long to wait for a call before sending a second, identical one, or
+    None if the call must not be hedged.
+    """
+    if not settings.VULMATCH_UPSTREAM_HEDGE or method != "GET":
+        return None
+    delay = latency_tracker.percentile(settings.VULMATCH_UPSTREAM_HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    return delay and max(delay, settings.VULMATCH_UPSTREAM_HEDGE_MIN_DELAY)
+
+
+_hedge_executor = None
+_hedge_executor_pid = None
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor, _hedge_executor_pid
+    pid = os.getpid()
+    if _hedge_executor is None or _hedge_executor_pid != pid:
+        with _session_lock:
+            if _hedge_executor is None or _hedge_executor_pid != pid:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * settings.VULMATCH_UPSTREAM_POOL_MAXSIZE,
+                    thread_name_prefix="upstream-hedge",
+                )
+                _hedge_executor_pid = pid
+    return _hedge_executor
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _send_hedged(method, url, delay, **kwargs):
+    executor = _get_hedge_executor()
+    futures = [executor.submit(get_session().request, method, url, **kwargs)]
+    try:
+        return futures[0].result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    futures.append(executor.submit(get_session().request, method, url, **kwargs))
+    error = None
+    for future in as_completed(futures):
+        try:
+            response = future.result()
+        except Exception as e:
+            error = e
+            continue
+        for other in futures:
+            if other is not future:
+                other.add_done_callback(_close_response)
+        return response
+    raise error
+
+
+def _record_response(state, method, url, status_code, start):
+    elapsed = time.monotonic() - start
+    latency_tracker.record(elapsed)
+    metrics.observe_upstream(method, url, status_code, elapsed)
+    breaker.record_response(state, status_code, elapsed)
+
+
+@timing.phase("upstream")
+def request(method, url, headers=None, **kwargs) -> requests.Response:
+    """
+    Sends a request with the shared session, through the circuit breaker. Like
+    `arequest`, only encodings the client itself accepts are requested from upstream.
+
+    GETs that take longer than the configured latency percentile are hedged: a second,
+    identical call is sent and whichever answers first is used.
+    """
+    kwargs["headers"] = _with_accept_encoding(headers)
+    kwargs.setdefault("timeout", get_timeout())
+    kwargs.setdefault("allow_redirects", False)
+    state = breaker.before_request()
+    start = time.monotonic()
+    try:
+        delay = get_hedge_delay(method)
+        if delay:
+            response = _send_hedged(method, url, delay, **kwargs)
+        else:
+            response = get_session().request(method, url, **kwargs)
+    except requests.Timeout as e:
+        breaker.record_failure(state)
+        raise UpstreamTimeout() from e
+    except requests.ConnectionError as e:
+        breaker.record_failure(state)
+        raise UpstreamUnavailable() from e
+    except requests.RequestException as e:
+        # anything else (a broken chunked body, an invalid URL...) counts too, or a
+        # half-open probe would hold the breaker until the probe key expires
+        breaker.record_failure(state)
+        raise UpstreamUnavailable() from e
+    _record_response(state, method, url, response.status_code, start)
+    return response
+
+
+_async_session = None
+_async_session_loop = None
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    Returns the async session bound to the running event loop.
+
+    Under ASGI there is a single long-lived loop per worker, so in practice this is one
+    pool shared by every in-flight request. Bodies are not decompressed, so they can be
+    relayed to the client byte for byte.
+    """
+    global _async_session, _async_session_loop
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session_loop is not loop:
+        _async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=settings.VULMATCH_UPSTREAM_ASYNC_MAX_CONNECTIONS,
+                keepalive_timeout=settings.VULMATCH_UPSTREAM_ASYNC_KEEPALIVE_TIMEOUT,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=settings.VULMATCH_UPSTREAM_CONNECT_TIMEOUT,
+                sock_read=settings.VULMATCH_UPSTREAM_READ_TIMEOUT,
+            ),
+            auto_decompress=False,
+        )
+        _async_session_loop = loop
+    return _async_session
+
+
+async def aclose_async_session():
+    global _async_session, _async_session_loop
+    if _async_session is not None:
+        await _async_session.close()
+    _async_session = _async_session_loop = None
+
+
+@timing.phase("upstream")
+async def arequest(method, url, headers=None, **kwargs) -> aiohttp.ClientResponse:
+    """
+    Sends a request with the async session and returns the response with its body
+    still unread. The caller must read it and call `release()`.
+
+    Only encodings the client itself accepts are requested from upstream (identity if
+    it sent no Accept-Encoding), since the body is never decoded on the way through.
+    """
+    kwargs["headers"] = _with_accept_encoding(headers)
+    kwargs["allow_redirects"] = False
+    state = await breaker.abefore_request()
+    start = time.monotonic()
+    try:
+        delay = get_hedge_delay(method)
+        if delay:
+            response = await _asend_hedged(method, url, delay, **kwargs)
+        else:
+            response = await get_async_session().request(method, url, **kwargs)
+    except asyncio.TimeoutError as e:
+        await breaker.arecord_failure(state)
+        raise UpstreamTimeout() from e
+    except aiohttp.ClientError as e:
+        await breaker.arecord_failure(state)
+        raise UpstreamUnavailable() from e
+    except asyncio.CancelledError:
+        # the client went away, which says nothing of upstream, but a probe must let go
+        await breaker.arelease_probe(state)
+        raise
+    except Exception as e:
+        # as in `request`, anything else counts too, or a half-open probe would hold the
+        # breaker until the probe key expires
+        await breaker.arecord_failure(state)
+        raise UpstreamUnavailable() from e
+    elapsed = time.monotonic() - start
+    latency_tracker.record(elapsed)
+    metrics.observe_upstream(method, url, response.status, elapsed)
+    if state != breaker.CLOSED or response.status >= 500 or elapsed > settings.VULMATCH_UPSTREAM_BREAKER_SLOW_CALL:
+        # only worth leaving the event loop when the breaker has something to record
+        await breaker.arecord_response(state, response.status, elapsed)
+    return response
+
+
+async def _asend_hedged(method, url, delay, **kwargs):
+    session = get_async_session()
+    pending = {asyncio.ensure_future(session.request(method, url, **kwargs))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            pending.add(asyncio.ensure_future(session.request(method, url, **kwargs)))
+        error = None
+        while True:
+            if not done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().release()
+            if winner is not None:
+                return winner
+            if not pending:
+                raise error
+            done = set()
+    finally:
+        for task in pending:
+            task.cancel()
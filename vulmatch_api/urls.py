@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from django.contrib.auth.decorators import login_required
 from drf_spectacular.views import SpectacularSwaggerView
@@ -7,11 +8,27 @@ from .views import (
     VulmatchProxyView,
     AdminVulmatchProxyView,
     OpenVulmatchProxyView,
+    AsyncVulmatchProxyView,
+    AsyncOpenVulmatchProxyView,
+    BatchLookupView,
+    IngestJobCallbackView,
+    MetricsView,
+    UpstreamStatusView,
 )
 
+if settings.VULMATCH_PROXY_ASYNC:
+    # served under ASGI (see project/asgi.py)
+    ProxyView, OpenProxyView = AsyncVulmatchProxyView, AsyncOpenVulmatchProxyView
+else:
+    ProxyView, OpenProxyView = VulmatchProxyView, OpenVulmatchProxyView
+
 urlpatterns = [
-    path("api/v1/<path:path>", VulmatchProxyView.as_view(), name="proxy"),
+    path("api/v1/batch/objects/", BatchLookupView.as_view(), name="batch-lookup"),
+    path("api/v1/<path:path>", ProxyView.as_view(), name="proxy"),
     path("admin/api/v1/<path:path>", AdminVulmatchProxyView.as_view(), name="admin-proxy"),
+    path("upstream/status/", UpstreamStatusView.as_view(), name="upstream-status"),
+    path("ingest/jobs/<str:job_id>/callback/", IngestJobCallbackView.as_view(), name="ingest-job-callback"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
     path('schema/schema-json', SchemaView.as_view(), name='schema-json'),
     path(
         "api/schema/swagger-ui/",
@@ -25,7 +42,7 @@ urlpatterns = [
         login_required(AdminSwaggerView.as_view(url="../schema-json")),
         name="swagger-ui",
     ),
-    path("proxy/open/cve/objects/", OpenVulmatchProxyView.as_view(), name=""),
-    path("proxy/open/cve/objects/<str:id>/bundle/", OpenVulmatchProxyView.as_view(), name=""),
-    path("proxy/open/cpe/objects/", OpenVulmatchProxyView.as_view(), name=""),
+    path("proxy/open/cve/objects/", OpenProxyView.as_view(), name="open-proxy"),
+    path("proxy/open/cve/objects/<str:id>/bundle/", OpenProxyView.as_view(), name="open-proxy"),
+    path("proxy/open/cpe/objects/", OpenProxyView.as_view(), name="open-proxy"),
 ]
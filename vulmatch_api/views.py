@@ -1,23 +1,44 @@
 from django.shortcuts import render
 
 # Create your views here.
-import requests
 from django.shortcuts import render
 from rest_framework.views import APIView
 from apps.teams.permissions import TeamModelAccessPermissions
+from apps.utils.db import db_sync_to_async
 from django.conf import settings
 from django.http import JsonResponse, HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django.views import View
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
 from rest_framework.exceptions import (
+    APIException,
+    MethodNotAllowed,
+    NotFound,
     PermissionDenied,
+    Throttled,
 )
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
-from .permisions import HasTeamApiKey
+from . import cache as proxy_cache
+from . import batch, breaker, export, hits, ingest, metrics, query, ratelimit, single_flight, stale, tasks, upstream
+from .exceptions import UpstreamError
+from .helpers import (
+    abuild_proxy_response,
+    build_cached_response,
+    build_proxy_response,
+    patch_public_cache_control,
+)
+from .permisions import HasHealthCheckToken, HasIngestCallbackToken, HasTeamApiKey
+from .serializers import BatchLookupSerializer
 
 
 # Create your views here.
 class VulmatchProxyView(APIView):
     permission_classes = [HasTeamApiKey]
+    rate_limit = None
+    allow_export = True
 
     def dispatch(self, request, *args, **kwargs):
         self.args = args
@@ -27,37 +48,16 @@ class VulmatchProxyView(APIView):
         self.headers = self.default_response_headers  # deprecate?
 
         try:
-            self.initial(request, *args, **kwargs)
-            if not HasTeamApiKey().has_permission(self.request, self):
-                raise PermissionDenied()
-            # Modify the target URL as needed
-            target_url = (
-                f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{kwargs['path']}"
-            )
+            with metrics.observe_auth("proxy"):
+                self.initial(request, *args, **kwargs)
+                if not HasTeamApiKey().has_permission(self.request, self):
+                    raise PermissionDenied()
             if request.method != "GET":
-                raise MethodNotAllowed()
-
-            # Forward the request to the target URL
-            headers = {
-                key: value
-                for key, value in request.headers.items()
-                if (key != "Host" and key != "Content-Length")
-            }
-            response = requests.request(
-                method="GET",
-                url=target_url,
-                headers=headers,
-                data=request.body,
-                params={key: value for key, value in request.GET.items()},
-                allow_redirects=False,
-            )
-
-            # Return the response to the original request
-            return HttpResponse(
-                response.content,
-                status=response.status_code,
-                content_type=response.headers.get("Content-Type"),
-            )
+                raise MethodNotAllowed(request.method)
+            self.rate_limit = ratelimit.consume(request.team_api_key)
+            if self.rate_limit and not self.rate_limit.allowed:
+                raise Throttled(wait=self.rate_limit.retry_after)
+            return ratelimit.set_headers(self.forward(request, kwargs["path"]), self.rate_limit)
         except PermissionDenied:
             return HttpResponse(
                 {},
@@ -67,7 +67,87 @@ class VulmatchProxyView(APIView):
             response = self.handle_exception(exc)
             self.response = self.finalize_response(
                 request, response, *args, **kwargs)
-            return self.response
+            return ratelimit.set_headers(self.response, self.rate_limit)
+
+    def forward(self, request, path):
+        if self.allow_export and export.is_export(request):
+            return export.build_export_response(request, path, request.team_api_key)
+        target_url = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}"
+        headers = upstream.get_forward_headers(request)
+        params = query.normalize(path, request.GET)
+        cache_ttl = proxy_cache.get_ttl(path)
+        cache_key = cache_ttl and proxy_cache.get_cache_key(path, params)
+        if cache_key:
+            hits.record(path, params)
+            entry, stale_entry = proxy_cache.get_entries(cache_key)
+            metrics.observe_cache(path, hit=bool(entry))
+            if not entry and stale.can_revalidate(path, stale_entry, cache_key):
+                stale.refresh(path, params, cache_key)
+                return stale.mark(build_cached_response(request, stale_entry), stale_entry, stale.RESPONSE_IS_STALE)
+            if not entry:
+                # the cache stores one full gzipped copy, whatever this client accepts
+                # or already has; its conditions are evaluated against the entry
+                headers = upstream.get_forward_headers(request, conditional=False)
+                headers["Accept-Encoding"] = "gzip"
+                max_staleness = proxy_cache.get_max_staleness(path)
+                try:
+                    entry, response = single_flight.fetch(
+                        cache_key,
+                        lambda: self.fetch(request, target_url, headers, params, cache_key, cache_ttl, max_staleness),
+                    )
+                except UpstreamError:
+                    if not stale.can_serve_on_error(path, stale_entry):
+                        raise
+                    entry, response = None, None
+                if stale.is_failure(entry, response) and stale.can_serve_on_error(path, stale_entry):
+                    if response is not None:
+                        response.close()
+                    return stale.mark(build_cached_response(request, stale_entry), stale_entry, stale.REVALIDATION_FAILED)
+            if entry:
+                return build_cached_response(request, entry)
+            return build_proxy_response(request, response)
+
+        # Forward the request to the target URL
+        response = upstream.request(
+            method="GET",
+            url=target_url,
+            headers=headers,
+            data=request.body,
+            params=query.get_pairs(params),
+            stream=True,
+        )
+
+        # Return the response to the original request
+        return build_proxy_response(request, response)
+
+    def fetch(self, request, target_url, headers, params, cache_key, cache_ttl, max_staleness=0):
+        """
+        Calls upstream on a cache miss and returns `(entry, response)`, see `single_flight`.
+        """
+        response = upstream.request(
+            method="GET",
+            url=target_url,
+            headers=headers,
+            data=request.body,
+            params=query.get_pairs(params),
+            stream=True,
+        )
+        if not proxy_cache.is_shareable(response.headers):
+            return None, response
+        try:
+            body, complete = proxy_cache.read_body(response)
+        except BaseException:
+            response.close()
+            raise
+        if not complete:
+            # too big to cache: relayed from what was read on
+            response.body_prefix = body
+            return None, response
+        response.close()
+        entry = proxy_cache.make_entry(response.status_code, response.headers, body)
+        if response.status_code == 200:
+            proxy_cache.set_entry(cache_key, entry, cache_ttl, max_staleness)
+        return entry, None
 
 # Create your views here.
 class AdminVulmatchProxyView(APIView):
@@ -82,33 +162,26 @@ class AdminVulmatchProxyView(APIView):
         self.headers = self.default_response_headers  # deprecate?
 
         try:
-            self.initial(request, *args, **kwargs)
+            with metrics.observe_auth("admin-proxy"):
+                self.initial(request, *args, **kwargs)
             # Modify the target URL as needed
             target_url = (
                 f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{kwargs['path']}"
             )
 
             # Forward the request to the target URL
-            headers = {
-                key: value
-                for key, value in request.headers.items()
-                if (key != "Host" and key != "Content-Length")
-            }
-            response = requests.request(
+            headers = upstream.get_forward_headers(request)
+            response = upstream.request(
                 method=request.method,
                 url=target_url,
                 headers=headers,
                 json=request.data,
-                params={key: value for key, value in request.GET.items()},
-                allow_redirects=False,
+                params=query.get_pairs(request.GET),
+                stream=True,
             )
 
             # Return the response to the original request
-            return HttpResponse(
-                response.content,
-                status=response.status_code,
-                content_type=response.headers.get("Content-Type"),
-            )
+            return build_proxy_response(request, response)
         except PermissionDenied:
             return HttpResponse(
                 {},
@@ -121,7 +194,15 @@ class AdminVulmatchProxyView(APIView):
             return self.response
 
 
-class OpenVulmatchProxyView(APIView):
+class OpenVulmatchProxyView(VulmatchProxyView):
+    """
+    Proxy for the web app's logged-in users. Its data is the same for every user, so it
+    is served from the shared proxy cache and marked as cacheable by a CDN.
+    """
+
+    permission_classes = [IsAuthenticated]
+    allow_export = False
+
     def dispatch(self, request, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
@@ -130,36 +211,16 @@ class OpenVulmatchProxyView(APIView):
         self.headers = self.default_response_headers
 
         try:
-            if not IsAuthenticated().has_permission(self.request, self):
-                raise PermissionDenied()
+            with metrics.observe_auth("open-proxy"):
+                if not IsAuthenticated().has_permission(self.request, self):
+                    raise PermissionDenied()
 
             url = request.path
             path = url.split("proxy/open/")[1]
-            # Modify the target URL as needed
-            target_url = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}"
             if request.method != "GET":
-                raise MethodNotAllowed()
+                raise MethodNotAllowed(request.method)
 
-            # Forward the request to the target URL
-            response = requests.request(
-                method="GET",
-                url=target_url,
-                headers={
-                    key: value
-                    for key, value in request.headers.items()
-                    if key != "Host" and key != "Content-Length"
-                },
-                data=request.body,
-                params={key: value for key, value in request.GET.items()},
-                allow_redirects=False,
-            )
-
-            # Return the response to the original request
-            return HttpResponse(
-                response.content,
-                status=response.status_code,
-                content_type=response.headers.get("Content-Type"),
-            )
+            return patch_public_cache_control(self.forward(request, path))
         except PermissionDenied:
             return HttpResponse(
                 {},
@@ -169,3 +230,217 @@ class OpenVulmatchProxyView(APIView):
             response = self.handle_exception(exc)
             self.response = self.finalize_response(request, response, *args, **kwargs)
             return self.response
+
+
+class AsyncVulmatchProxyView(View):
+    """
+    Async version of `VulmatchProxyView`, used when the app is served under ASGI.
+
+    Upstream calls don't hold a worker thread while they are in flight, so a single
+    process can keep thousands of them open on the shared `aiohttp` pool.
+    """
+
+    use_cache = True
+    allow_export = True
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            with metrics.observe_auth("proxy"):
+                if not await HasTeamApiKey().ahas_permission(request, self):
+                    raise PermissionDenied()
+        except PermissionDenied:
+            return HttpResponse(
+                {},
+                status=401,
+            )
+        rate_limit = await ratelimit.aconsume(request.team_api_key)
+        if rate_limit and not rate_limit.allowed:
+            exc = Throttled(wait=rate_limit.retry_after)
+            response = JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+        else:
+            response = await self.forward(request, kwargs["path"])
+        return ratelimit.set_headers(response, rate_limit)
+
+    async def forward(self, request, path):
+        target_url = f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/{path}"
+        headers = upstream.get_forward_headers(request)
+        params = query.normalize(path, request.GET)
+        cache_ttl = proxy_cache.get_ttl(path) if self.use_cache else 0
+        cache_key = cache_ttl and await proxy_cache.aget_cache_key(path, params)
+        try:
+            if self.allow_export and export.is_export(request):
+                return await export.abuild_export_response(request, path, request.team_api_key)
+            if cache_key:
+                await hits.arecord(path, params)
+                entry, stale_entry = await proxy_cache.aget_entries(cache_key)
+                metrics.observe_cache(path, hit=bool(entry))
+                if not entry and stale.can_revalidate(path, stale_entry, cache_key):
+                    await stale.arefresh(path, params, cache_key)
+                    return stale.mark(build_cached_response(request, stale_entry), stale_entry, stale.RESPONSE_IS_STALE)
+                if not entry:
+                    # the cache stores one full gzipped copy, whatever this client accepts
+                    # or already has; its conditions are evaluated against the entry
+                    headers = upstream.get_forward_headers(request, conditional=False)
+                    headers["Accept-Encoding"] = "gzip"
+                    max_staleness = proxy_cache.get_max_staleness(path)
+                    try:
+                        entry, response = await single_flight.afetch(
+                            cache_key,
+                            lambda: self.fetch(request, target_url, headers, params, cache_key, cache_ttl, max_staleness),
+                        )
+                    except UpstreamError:
+                        if not stale.can_serve_on_error(path, stale_entry):
+                            raise
+                        entry, response = None, None
+                    if stale.is_failure(entry, response) and stale.can_serve_on_error(path, stale_entry):
+                        if response is not None:
+                            response.release()
+                        return stale.mark(
+                            build_cached_response(request, stale_entry), stale_entry, stale.REVALIDATION_FAILED
+                        )
+                if entry:
+                    return build_cached_response(request, entry)
+            else:
+                response = await self.request_upstream(request, target_url, headers, params)
+        except UpstreamError as exc:
+            response = JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+            if getattr(exc, "wait", None):
+                response["Retry-After"] = "%d" % exc.wait
+            return response
+        return await abuild_proxy_response(request, response)
+
+    async def request_upstream(self, request, target_url, headers, params):
+        return await upstream.arequest(
+            "GET",
+            target_url,
+            headers=headers,
+            data=request.body or None,
+            params=query.get_pairs(params),
+        )
+
+    async def fetch(self, request, target_url, headers, params, cache_key, cache_ttl, max_staleness=0):
+        """
+        Calls upstream on a cache miss and returns `(entry, response)`, see `single_flight`.
+        """
+        response = await self.request_upstream(request, target_url, headers, params)
+        if not proxy_cache.is_shareable(response.headers):
+            return None, response
+        try:
+            body, complete = await proxy_cache.aread_body(response)
+        except BaseException:
+            response.release()
+            raise
+        if not complete:
+            # too big to cache: relayed from what was read on
+            response.body_prefix = body
+            return None, response
+        response.release()
+        entry = proxy_cache.make_entry(response.status, response.headers, body)
+        if response.status == 200:
+            await proxy_cache.aset_entry(cache_key, entry, cache_ttl, max_staleness)
+        return entry, None
+
+
+def authenticate(request):
+    """
+    Returns the user DRF's default authenticators (session, basic and token, as for
+    `OpenVulmatchProxyView`) find for a plain Django request, or an anonymous one.
+    """
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        return Request(request, authenticators=authenticators).user
+    except APIException:
+        return AnonymousUser()
+
+
+class AsyncOpenVulmatchProxyView(AsyncVulmatchProxyView):
+    """
+    Async version of `OpenVulmatchProxyView`.
+    """
+
+    allow_export = False
+
+    async def get(self, request, *args, **kwargs):
+        with metrics.observe_auth("open-proxy"):
+            user = await db_sync_to_async(authenticate)(request)
+        if not user.is_authenticated:
+            return HttpResponse(
+                {},
+                status=401,
+            )
+        path = request.path.split("proxy/open/")[1]
+        return patch_public_cache_control(await self.forward(request, path))
+
+
+class BatchLookupView(APIView):
+    """
+    Looks up many CVE and CPE objects in one request, e.g.
+    `{"cve": ["CVE-2024-3094"], "cpe": ["cpe:2.3:a:tukaani:xz:5.6.0:*:*:*:*:*:*:*"]}`.
+
+    Each id is fetched concurrently (see `batch`), and the batch is charged to the team's
+    rate limit and quota once, as one request per id.
+    """
+
+    permission_classes = [HasTeamApiKey]
+    rate_limit = None
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchLookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["items"]
+        self.rate_limit = ratelimit.consume(request.team_api_key, cost=len(items))
+        if self.rate_limit and not self.rate_limit.allowed:
+            raise Throttled(wait=self.rate_limit.retry_after)
+        return Response({
+            "count": len(items),
+            "results": batch.lookup(items),
+        })
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return ratelimit.set_headers(response, self.rate_limit)
+
+
+class UpstreamStatusView(APIView):
+    """
+    Shows the state of the upstream circuit breaker, and the latencies and connection
+    reuse seen by the worker that answers.
+    """
+
+    permission_classes = [IsAdminUser | HasHealthCheckToken]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "breaker": breaker.get_status(),
+            "latency": upstream.latency_tracker.as_dict(),
+            "pool": upstream.get_pool_stats(),
+        })
+
+
+class MetricsView(APIView):
+    """
+    Prometheus scrape endpoint, see `metrics`.
+    """
+
+    permission_classes = [IsAdminUser | HasHealthCheckToken]
+
+    def get(self, request, *args, **kwargs):
+        body, content_type = metrics.export()
+        return HttpResponse(body, content_type=content_type)
+
+
+class IngestJobCallbackView(APIView):
+    """
+    Called when an upstream ingest job finishes, so it is polled right away rather than
+    on its next scheduled poll (see `ingest`).
+    """
+
+    authentication_classes = []
+    permission_classes = [HasIngestCallbackToken]
+
+    def post(self, request, job_id, *args, **kwargs):
+        if not ingest.is_tracked(job_id):
+            raise NotFound("no ingest job with this id is running")
+        if not ingest.is_finished(job_id):
+            tasks.check_job_status.delay(job_id, reschedule=False)
+        return Response({"job_id": job_id}, status=202)
@@ -0,0 +1,96 @@
+"""
+Warming of the proxy cache after an ingest has invalidated it.
+
+What gets fetched back in, most useful first:
+
+* the first pages of the web app's default listings;
+* the paths most requested through the proxy lately (see `hits`);
+* every CVE modified by the ingest, and its bundle.
+
+Urls are fetched on a pool of VULMATCH_WARM_CONCURRENCY threads, through `batch.get_entry`
+so they land in the cache exactly as a client request would have put them there.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import QueryDict
+
+from . import batch, hits, upstream
+from .exceptions import UpstreamError
+from .export import Page
+
+
+def get_open_listing_urls():
+    urls = []
+    for path in settings.VULMATCH_OPEN_PROXY_WARM_PATHS:
+        # the web app asks for the first page without a page number
+        urls.append(f"{path}?")
+        urls.extend(f"{path}?page={page}" for page in range(2, settings.VULMATCH_OPEN_PROXY_WARM_PAGES + 1))
+    return urls
+
+
+def get_hot_urls():
+    try:
+        return hits.get_top_urls(settings.VULMATCH_WARM_TOP_PATHS)
+    except Exception:
+        logging.exception("could not read proxy hits")
+        return []
+
+
+def get_modified_cve_ids(modified_min):
+    """
+    Returns the ids of the CVEs modified since `modified_min`, up to VULMATCH_WARM_MODIFIED_MAX.
+    """
+    cve_ids = []
+    number = 1
+    while len(cve_ids) < settings.VULMATCH_WARM_MODIFIED_MAX:
+        response = upstream.request(
+            method="GET",
+            url=f"{settings.VULMATCH_SERVICE_BASE_URL}/api/v1/cve/objects/",
+            headers={"Accept": "application/json"},
+            params={"modified_min": modified_min, "page": number, "page_size": settings.VULMATCH_EXPORT_PAGE_SIZE},
+        )
+        page = Page.parse(number, response.status_code, response.headers, response.content)
+        if page is None:
+            logging.warning("could not list modified CVEs, got %d", response.status_code)
+            break
+        cve_ids.extend(obj["name"] for obj in page.results if obj.get("name"))
+        if not page.has_next:
+            break
+        number += 1
+    return cve_ids[:settings.VULMATCH_WARM_MODIFIED_MAX]
+
+
+def get_modified_urls(modified_min):
+    try:
+        cve_ids = get_modified_cve_ids(modified_min)
+    except UpstreamError:
+        logging.exception("could not list modified CVEs")
+        return []
+    urls = []
+    for cve_id in cve_ids:
+        path = batch.get_object_path("cve", cve_id)
+        urls += [f"{path}?", f"{path}bundle/?"]
+    return urls
+
+
+def warm_url(url):
+    path, _, query = url.partition("?")
+    try:
+        batch.get_entry(path, QueryDict(query))
+    except UpstreamError as exc:
+        logging.warning("could not warm %s: %s", url, exc.detail)
+        return False
+    return True
+
+
+def warm(urls):
+    """
+    Fetches `path?query` urls into the proxy cache, and returns how many could be.
+    """
+    urls = list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(
+        max_workers=settings.VULMATCH_WARM_CONCURRENCY, thread_name_prefix="vulmatch-warm"
+    ) as executor:
+        return sum(executor.map(warm_url, urls))